@@ -0,0 +1,40 @@
+"""
+Benchmark the patient index engine (populate_from_tabular._index_patient_rows) against the number of rows in a
+file. Time per row should remain roughly constant as the number of rows grows i.e. the index scales linearly.
+
+Usage:
+    python -m ProjectBevan.benchmarks.bench_patient_index
+"""
+from ProjectBevan.populate_from_tabular import _index_patient_rows
+from time import perf_counter
+import pandas as pd
+import numpy as np
+
+
+def _legacy_index(pt_ids: pd.Series) -> dict:
+    return {str(_id): pt_ids[pt_ids == _id].index for _id in pt_ids}
+
+
+def _time(func, pt_ids: pd.Series, repeats: int = 3) -> float:
+    timings = list()
+    for _ in range(repeats):
+        start = perf_counter()
+        func(pt_ids)
+        timings.append(perf_counter() - start)
+    return min(timings)
+
+
+def main(row_counts: tuple = (10 ** 4, 10 ** 5, 10 ** 6, 4 * 10 ** 6),
+         rows_per_patient: int = 5,
+         legacy_limit: int = 10 ** 4):
+    rng = np.random.default_rng(42)
+    print(f"{'rows':>10} {'seconds':>10} {'ns/row':>10} {'legacy seconds':>15}")
+    for n in row_counts:
+        pt_ids = pd.Series(rng.integers(0, max(n // rows_per_patient, 1), size=n)).map(lambda x: f"PT{x:09d}")
+        seconds = _time(_index_patient_rows, pt_ids)
+        legacy = f"{_time(_legacy_index, pt_ids, repeats=1):>15.3f}" if n <= legacy_limit else f"{'-':>15}"
+        print(f"{n:>10} {seconds:>10.3f} {seconds / n * 1e9:>10.1f} {legacy}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+from collections import OrderedDict
+import pandas as pd
+
+
+class DataFrameCache:
+    """
+    In-process, file-level cache of parsed DataFrames with a memory budget and least-recently-used eviction.
+    Shared by all Populate methods so that each target file is parsed once per process rather than once per
+    patient per variable.
+
+    Parameters
+    ----------
+    max_bytes: int, (default = 1GB)
+        Memory budget in bytes, as measured by Pandas.DataFrame.memory_usage(deep=True). DataFrames larger
+        than the entire budget are returned to the caller but never stored. If 0, caching is disabled.
+
+    Properties
+    ----------
+    hits: int
+        Number of requests served from the cache
+    misses: int
+        Number of requests that required the file to be parsed
+    evictions: int
+        Number of DataFrames evicted to remain within the memory budget
+    current_bytes: int
+        Memory currently held by cached DataFrames
+    """
+    def __init__(self, max_bytes: int = 1024 ** 3):
+        assert max_bytes >= 0, "max_bytes must be a positive integer or 0"
+        self.max_bytes = max_bytes
+        self._store = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+
+    def __contains__(self, key):
+        return key in self._store
+
+    def __len__(self):
+        return len(self._store)
+
+    def keys(self) -> list:
+        return list(self._store.keys())
+
+    def get(self,
+            key: str,
+            loader: callable) -> pd.DataFrame:
+        """
+        Return the DataFrame stored under key, calling loader to parse it (and storing the result) on a cache miss.
+        The returned DataFrame is shared; callers must not modify it in place.
+
+        Parameters
+        ----------
+        key: str
+            Cache key e.g. file name
+        loader: callable
+            Function that takes no arguments and returns a Pandas.DataFrame
+
+        Returns
+        -------
+        Pandas.DataFrame
+        """
+        if key in self._store:
+            self._store.move_to_end(key)
+            self.hits += 1
+            return self._store[key][0]
+        self.misses += 1
+        df = loader()
+        self.put(key, df)
+        return df
+
+    def put(self,
+            key: str,
+            df: pd.DataFrame):
+        """
+        Store a DataFrame, evicting the least recently used entries until the memory budget is satisfied
+
+        Parameters
+        ----------
+        key: str
+        df: Pandas.DataFrame
+
+        Returns
+        -------
+        None
+        """
+        self.discard(key)
+        nbytes = int(df.memory_usage(deep=True).sum())
+        if nbytes > self.max_bytes:
+            return
+        while self.current_bytes + nbytes > self.max_bytes:
+            _, (_, evicted_bytes) = self._store.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+            self.evictions += 1
+        self._store[key] = (df, nbytes)
+        self.current_bytes += nbytes
+
+    def discard(self, key: str):
+        """
+        Remove key from the cache if present (does not count as an eviction)
+
+        Parameters
+        ----------
+        key: str
+
+        Returns
+        -------
+        None
+        """
+        if key in self._store:
+            _, nbytes = self._store.pop(key)
+            self.current_bytes -= nbytes
+
+    def clear(self):
+        """
+        Empty the cache, counters are retained
+
+        Returns
+        -------
+        None
+        """
+        self._store = OrderedDict()
+        self.current_bytes = 0
+
+    def info(self) -> dict:
+        """
+        Cache statistics, use to size max_bytes for a given host
+
+        Returns
+        -------
+        dict
+            {"hits", "misses", "evictions", "entries", "current_bytes", "max_bytes"}
+        """
+        return dict(hits=self.hits,
+                    misses=self.misses,
+                    evictions=self.evictions,
+                    entries=len(self._store),
+                    current_bytes=self.current_bytes,
+                    max_bytes=self.max_bytes)
@@ -0,0 +1,110 @@
+from .config import GlobalConfig
+from .nosql.patient import Patient
+from datetime import datetime
+import json
+
+SQL_TABLE = "Checkpoints"
+NOSQL_COLLECTION = "checkpoints"
+
+
+class CheckpointStore:
+    """
+    Durable record of the progress of long-running Populate stages (e.g. the last patient written by add_patients, or
+    the files and rows consumed by add_measurements), so that an interrupted stage can be resumed without re-reading
+    or re-writing work that has already been committed. Checkpoints are stored in the database alongside the data
+    they describe: the Checkpoints table (SQL, created on first use) or the checkpoints collection (NoSQL), with one
+    JSON state per stage key (see ingest.stage_key).
+
+    SQL: save can be called with commit=False inside the transaction that writes a batch, so that the batch and its
+    checkpoint are committed (or rolled back) together. NoSQL: MongoDB writes are not transactional, so a checkpoint
+    is saved once a batch has been acknowledged; a batch interrupted part way through is written again on resume.
+
+    Parameters
+    ----------
+    config: GlobalConfig
+        Instance of GlobalConfig, with database connection
+    """
+    def __init__(self, config: GlobalConfig):
+        self._config = config
+        if config.db_type == "sql":
+            with config.db_connection as conn:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {SQL_TABLE}("
+                             f"stage TEXT PRIMARY KEY, "
+                             f"state TEXT NOT NULL, "
+                             f"updated TEXT);")
+
+    def _collection(self):
+        return Patient._get_db()[NOSQL_COLLECTION]
+
+    def get(self, stage: str) -> dict or None:
+        """
+        Last saved state of a stage
+
+        Parameters
+        ----------
+        stage: str
+            Stage key
+
+        Returns
+        -------
+        dict or None
+            None if no checkpoint exists for the stage
+        """
+        if self._config.db_type == "sql":
+            row = self._config.db_connection.execute(f"SELECT state FROM {SQL_TABLE} WHERE stage=?;",
+                                                     (stage,)).fetchone()
+            return None if row is None else json.loads(row[0])
+        doc = self._collection().find_one({"_id": stage})
+        return None if doc is None else doc.get("state")
+
+    def save(self,
+             stage: str,
+             state: dict,
+             commit: bool = True):
+        """
+        Save the state of a stage, replacing any existing checkpoint
+
+        Parameters
+        ----------
+        stage: str
+            Stage key
+        state: dict
+            JSON serialisable state
+        commit: bool, (default = True)
+            SQL only. If False, the checkpoint is written within the caller's transaction and is not committed
+
+        Returns
+        -------
+        None
+        """
+        updated = datetime.now().isoformat()
+        if self._config.db_type == "sql":
+            sql = f"INSERT OR REPLACE INTO {SQL_TABLE}(stage, state, updated) VALUES(?, ?, ?);"
+            params = (stage, json.dumps(state), updated)
+            if commit:
+                with self._config.db_connection as conn:
+                    conn.execute(sql, params)
+            else:
+                self._config.db_connection.execute(sql, params)
+            return
+        self._collection().replace_one({"_id": stage}, {"_id": stage, "state": state, "updated": updated},
+                                       upsert=True)
+
+    def clear(self, stage: str):
+        """
+        Remove the checkpoint of a stage
+
+        Parameters
+        ----------
+        stage: str
+            Stage key
+
+        Returns
+        -------
+        None
+        """
+        if self._config.db_type == "sql":
+            with self._config.db_connection as conn:
+                conn.execute(f"DELETE FROM {SQL_TABLE} WHERE stage=?;", (stage,))
+            return
+        self._collection().delete_one({"_id": stage})
@@ -0,0 +1,292 @@
+from .config import GlobalConfig
+from .nosql.patient import Patient, Comorbidity
+from .nosql.measurement import Measurement
+from .utilities import parse_datetime
+from datetime import date, datetime
+import pandas as pd
+
+COLUMNS = ["patient_id", "age", "gender", "covid", "died", "criticalCareStay"]
+
+
+def _to_datetime(x: str or date) -> datetime:
+    """
+    Convert a date (or a date string, parsed day first, see utilities.parse_datetime) to a datetime at midnight
+    """
+    if isinstance(x, str):
+        parsed = parse_datetime(x).get("date")
+        if parsed is None:
+            raise ValueError(f"Invalid date {x}")
+        return datetime.strptime(parsed, "%d/%m/%Y")
+    return datetime(x.year, x.month, x.day)
+
+
+class CohortQuery:
+    """
+    Select a cohort of patients by predicates on their basic information (age, gender, COVID status, death,
+    critical care stay), comorbidities and measurements. Predicates are combined with AND and are evaluated by the
+    database: the query compiles to a SQL SELECT over the Patients table (with EXISTS sub-queries for comorbidities
+    and measurements) or to a MongoDB aggregation pipeline over the patients collection. In the pipeline, patients are
+    first matched on their basic information. Comorbidity predicates are a single $lookup of the patient's comorbidity
+    keys followed by a $match on their names. Each measurement predicate is a $lookup of the patient's measurements
+    (joined on patientId) immediately followed by $unwind and a $match on the name and date, which the server
+    coalesces into the lookup (the filter is applied within the join, using the (patientId, name, date) index of
+    testResults, so measurements are never gathered into a single document), then a $group that keeps one document
+    per patient.
+
+    Results are returned as DataFrames with the columns of the SQL Patients table (COLUMNS), streamed in batches:
+
+        query = CohortQuery(config).age_between(60, None).covid("P").has_measurement("crp", "01/04/2020")
+        for df in query.fetch(batch_size=10000):
+            ...
+
+    Parameters
+    ----------
+    config: GlobalConfig
+        Instance of GlobalConfig, with database connection
+    """
+    def __init__(self, config: GlobalConfig):
+        self._config = config
+        self._predicates = list()
+
+    def _add(self, kind: str, *args):
+        self._predicates.append((kind, args))
+        return self
+
+    def age_between(self,
+                    min_age: int or None = None,
+                    max_age: int or None = None):
+        """
+        Patients with an age in the given (inclusive) range
+
+        Parameters
+        ----------
+        min_age: int, optional
+        max_age: int, optional
+
+        Returns
+        -------
+        CohortQuery
+        """
+        return self._add("age", min_age, max_age)
+
+    def gender(self, *values: str):
+        """
+        Patients with any of the given genders ("M", "F" or "U")
+
+        Returns
+        -------
+        CohortQuery
+        """
+        return self._add("gender", *values)
+
+    def covid(self, *values: str):
+        """
+        Patients with any of the given COVID-19 statuses ("P", "N" or "U")
+
+        Returns
+        -------
+        CohortQuery
+        """
+        return self._add("covid", *values)
+
+    def died(self, value: bool = True):
+        """
+        Patients that did (or, if value is False, did not) die during their stay
+
+        Returns
+        -------
+        CohortQuery
+        """
+        return self._add("died", int(value))
+
+    def critical_care_stay(self, value: bool = True):
+        """
+        Patients that did (or, if value is False, did not) have a critical care stay
+
+        Returns
+        -------
+        CohortQuery
+        """
+        return self._add("criticalCareStay", int(value))
+
+    def has_comorbidity(self, name: str):
+        """
+        Patients associated to the given comorbidity
+
+        Parameters
+        ----------
+        name: str
+            Comorbidity name (key)
+
+        Returns
+        -------
+        CohortQuery
+        """
+        return self._add("comorbidity", name)
+
+    def has_measurement(self,
+                        name: str,
+                        start_date: str or date or None = None,
+                        end_date: str or date or None = None):
+        """
+        Patients with at least one measurement of the given name, dated within the given (inclusive) window
+
+        Parameters
+        ----------
+        name: str
+            Measurement name
+        start_date: str or datetime.date, optional
+            Strings are parsed day first (see utilities.parse_datetime)
+        end_date: str or datetime.date, optional
+
+        Returns
+        -------
+        CohortQuery
+        """
+        start_date = None if start_date is None else _to_datetime(start_date)
+        end_date = None if end_date is None else _to_datetime(end_date)
+        return self._add("measurement", name, start_date, end_date)
+
+    def to_sql(self) -> (str, list):
+        """
+        Compile the query to SQL
+
+        Returns
+        -------
+        str, list
+            SELECT statement over the Patients table and its parameters
+        """
+        conditions = list()
+        params = list()
+        for kind, args in self._predicates:
+            if kind == "age":
+                for operator, value in zip([">=", "<="], args):
+                    if value is not None:
+                        conditions.append(f"p.age {operator} ?")
+                        params.append(value)
+            elif kind in ["gender", "covid"]:
+                conditions.append(f"p.{kind} IN ({', '.join('?' * len(args))})")
+                params.extend(args)
+            elif kind in ["died", "criticalCareStay"]:
+                conditions.append(f"p.{kind} = ?")
+                params.append(args[0])
+            elif kind == "comorbidity":
+                conditions.append("EXISTS (SELECT 1 FROM Comorbidities c "
+                                  "WHERE c.patient_id = p.patient_id AND c.comorb_name = ?)")
+                params.append(args[0])
+            elif kind == "measurement":
+                name, start_date, end_date = args
+                condition = "m.patient_id = p.patient_id AND m.result_name = ?"
+                params.append(name)
+                # Result dates are ISO 8601 strings (see utilities.iso_date_series), compared using the index
+                if start_date is not None and end_date is not None:
+                    condition += " AND m.result_date BETWEEN ? AND ?"
+                elif start_date is not None:
+                    condition += " AND m.result_date >= ?"
+                elif end_date is not None:
+                    condition += " AND m.result_date <= ?"
+                params.extend([x.strftime("%Y-%m-%d") for x in [start_date, end_date] if x is not None])
+                conditions.append(f"EXISTS (SELECT 1 FROM Measurements m WHERE {condition})")
+        sql = f"SELECT {', '.join(f'p.{x}' for x in COLUMNS)} FROM Patients p"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        return sql + " ORDER BY p.patient_id;", params
+
+    def to_pipeline(self) -> list:
+        """
+        Compile the query to a MongoDB aggregation pipeline over the patients collection
+
+        Returns
+        -------
+        list
+        """
+        conditions = list()
+        comorbidities = list()
+        measurements = list()
+        for kind, args in self._predicates:
+            if kind == "age":
+                bounds = {operator: value for operator, value in zip(["$gte", "$lte"], args) if value is not None}
+                if bounds:
+                    conditions.append({"age": bounds})
+            elif kind in ["gender", "covid"]:
+                conditions.append({kind: {"$in": list(args)}})
+            elif kind in ["died", "criticalCareStay"]:
+                conditions.append({kind: args[0]})
+            elif kind == "comorbidity":
+                comorbidities.append({"_comorbidities.comorbidName": args[0]})
+            elif kind == "measurement":
+                name, start_date, end_date = args
+                query = {"_measurement.name": name}
+                dates = {operator: value for operator, value in zip(["$gte", "$lte"], [start_date, end_date])
+                         if value is not None}
+                if dates:
+                    query["_measurement.date"] = dates
+                measurements.append(query)
+        pipeline = list()
+        if conditions:
+            pipeline.append({"$match": {"$and": conditions} if len(conditions) > 1 else conditions[0]})
+        pipeline.append({"$sort": {"_id": 1}})
+        if comorbidities:
+            pipeline.append({"$lookup": {"from": Comorbidity._get_collection_name(),
+                                         "localField": "comorbidities",
+                                         "foreignField": "_id",
+                                         "as": "_comorbidities"}})
+            pipeline.append({"$match": {"$and": comorbidities} if len(comorbidities) > 1 else comorbidities[0]})
+        for query in measurements:
+            # $lookup, $unwind and $match on the joined field are coalesced into a single filtered join
+            pipeline.append({"$lookup": {"from": Measurement._get_collection_name(),
+                                         "localField": "_id",
+                                         "foreignField": "patientId",
+                                         "as": "_measurement"}})
+            pipeline.append({"$unwind": "$_measurement"})
+            pipeline.append({"$match": query})
+            pipeline.append({"$group": {"_id": "$_id", **{x: {"$first": f"${x}"} for x in COLUMNS[1:]}}})
+        if measurements:
+            pipeline.append({"$sort": {"_id": 1}})
+        pipeline.append({"$project": {"_id": 0, "patient_id": "$_id", **{x: 1 for x in COLUMNS[1:]}}})
+        return pipeline
+
+    def fetch(self, batch_size: int = 10000):
+        """
+        Run the query and stream the cohort as DataFrames of at most batch_size patients, in order of patient ID
+
+        Parameters
+        ----------
+        batch_size: int, (default = 10000)
+
+        Returns
+        -------
+        Generator of Pandas.DataFrame
+        """
+        assert batch_size > 0, "batch_size must be greater than 0"
+        if self._config.db_type == "sql":
+            assert self._config.db_connection is not None, "Not connected to a SQLite database, call connect first"
+            sql, params = self.to_sql()
+            cursor = self._config.db_connection.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield pd.DataFrame(rows, columns=COLUMNS)
+        cursor = Patient._get_collection().aggregate(self.to_pipeline(), batchSize=batch_size, allowDiskUse=True)
+        batch = list()
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) == batch_size:
+                yield pd.DataFrame(batch, columns=COLUMNS)
+                batch = list()
+        if batch:
+            yield pd.DataFrame(batch, columns=COLUMNS)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """
+        Run the query and return the whole cohort as a single DataFrame (see fetch)
+
+        Returns
+        -------
+        Pandas.DataFrame
+        """
+        batches = list(self.fetch())
+        if not batches:
+            return pd.DataFrame(columns=COLUMNS)
+        return pd.concat(batches, ignore_index=True)
@@ -0,0 +1,130 @@
+from functools import lru_cache
+import hashlib
+import re
+
+
+@lru_cache(maxsize=None)
+def compile_terms(terms: tuple) -> tuple:
+    """
+    Compile regular expression search terms (case insensitive). Cached so each set of terms is compiled once.
+
+    Parameters
+    ----------
+    terms: tuple
+        Regular expression patterns
+
+    Returns
+    -------
+    tuple
+        Compiled patterns
+    """
+    return tuple(re.compile(t, flags=re.IGNORECASE) for t in terms)
+
+
+def header_fingerprint(columns: list) -> str:
+    """
+    Fingerprint of a file header (ordered column names)
+
+    Parameters
+    ----------
+    columns: list
+
+    Returns
+    -------
+    str
+    """
+    return hashlib.blake2b("\x1f".join(str(c) for c in columns).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class ColumnRoleResolver:
+    """
+    Maps the columns of a file header to roles (e.g. "age", "gender", "covid") using regular expression search
+    terms registered for each role. Search terms are compiled once and the role map for a header is computed once
+    and cached by header fingerprint, so repeated lookups for the same file avoid regex matching entirely.
+
+    Parameters
+    ----------
+    roles: dict, optional
+        Role name and list of regular expression search terms for that role
+    """
+    def __init__(self, roles: dict or None = None):
+        self._terms = dict()
+        self._cache = dict()
+        self._version = 0
+        for role, terms in (roles or dict()).items():
+            self.set_role(role, terms)
+
+    @property
+    def roles(self) -> dict:
+        return {role: list(terms) for role, terms in self._terms.items()}
+
+    @property
+    def version(self) -> int:
+        """
+        Incremented whenever search terms change, so that role maps stored elsewhere can be invalidated
+        """
+        return self._version
+
+    def set_role(self,
+                 role: str,
+                 terms: list):
+        """
+        Register (or update) the search terms for a role. Cached role maps are only invalidated if the terms
+        have changed.
+
+        Parameters
+        ----------
+        role: str
+        terms: list
+            List of regular expression search terms
+
+        Returns
+        -------
+        None
+        """
+        terms = tuple(terms)
+        if self._terms.get(role) == terms:
+            return
+        compile_terms(terms)
+        self._terms[role] = terms
+        self._cache = dict()
+        self._version += 1
+
+    def resolve(self, columns: list) -> dict:
+        """
+        Map a header to roles
+
+        Parameters
+        ----------
+        columns: list
+            Column names
+
+        Returns
+        -------
+        dict
+            Role name and list of matching columns (in header order), for every registered role
+        """
+        key = header_fingerprint(columns)
+        if key not in self._cache:
+            self._cache[key] = {role: [c for c in columns if any(p.match(str(c)) for p in compile_terms(terms))]
+                                for role, terms in self._terms.items()}
+        return self._cache[key]
+
+    def columns(self,
+                columns: list,
+                role: str) -> list:
+        """
+        Columns of the given header that match a role
+
+        Parameters
+        ----------
+        columns: list
+            Column names
+        role: str
+
+        Returns
+        -------
+        list
+        """
+        assert role in self._terms, f"No search terms registered for role {role}"
+        return self.resolve(columns).get(role)
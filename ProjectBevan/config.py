@@ -1,7 +1,11 @@
 from ProjectBevan.nosql.setup import global_init
+from ProjectBevan.log_writer import BufferedLogWriter
+from ProjectBevan.sql import schema, bulk
 from mongoengine.connection import disconnect
+from contextlib import contextmanager
 from datetime import datetime
 from warnings import warn
+import importlib
 import sqlite3
 import os
 
@@ -15,18 +19,33 @@ class GlobalConfig:
     log: bool, (default = True)
         If True, logging is enabled
     log_path: str, (default = working directory)
-        If log is True, path for logging text file
+        If log is True, path for logging text file. Log records are appended
+    log_format: str, (default = "text")
+        "text" for plain text lines, "jsonl" for one JSON record per line
+    log_buffer_size: int, (default = 1000)
+        Number of log records buffered before they are written to file
+    log_flush_interval: float, (default = 1.0)
+        Maximum time in seconds between writes of buffered log records to file
     db_type: str, (default = "nosql")
         What type of database to use: "nosql" or "sql"; "nosql" will use MongoDB, "sql" will use "SQLite3"
         "sql" is designed for local deployment only!
     db_connection: sqlite3.Connection
         If db_type = "sql", db_connection contains Connection object AFTER connect() method call
+    store_references: bool, (default = True)
+        NoSQL only. If True, references to each patient's outcome events, measurements and critical care records are
+        stored in lists on the Patient document. If False, these documents are only related to their patient by
+        patientId (parent-referencing) and are retrieved by querying on patientId
     """
     def __init__(self):
         self.log_path = f"{os.getcwd()}/IDWT_log_{datetime.now().date()}.txt"
+        self.log_format = "text"
+        self.log_buffer_size = 1000
+        self.log_flush_interval = 1.0
+        self._log_writer = None
         self.db_type = "nosql"
         self.db_connection = None
         self.db_alias = list()
+        self.store_references = True
 
     @staticmethod
     def _type_assertation(given: object,
@@ -49,8 +68,50 @@ class GlobalConfig:
         self._type_assertation(path, str)
         assert os.path.exists(os.path.dirname(os.path.abspath(path))), "Given path contains a directory that does not " \
                                                                        "exist, create directory before continuing"
+        self.close_log()
         self.log_path = path
 
+    def set_log_format(self,
+                       log_format: str = "text",
+                       buffer_size: int = 1000,
+                       flush_interval: float = 1.0):
+        """
+        Set log format and buffering parameters. Buffered records are flushed before changes take effect.
+
+        Parameters
+        ----------
+        log_format: str, (default = "text")
+            "text" or "jsonl"
+        buffer_size: int, (default = 1000)
+            Number of log records buffered before they are written to file
+        flush_interval: float, (default = 1.0)
+            Maximum time in seconds between writes of buffered log records to file
+
+        Returns
+        -------
+        None
+        """
+        assert log_format in ["text", "jsonl"], "Valid inputs for log_format are: 'text' or 'jsonl'"
+        self.close_log()
+        self.log_format = log_format
+        self.log_buffer_size = buffer_size
+        self.log_flush_interval = flush_interval
+
+    def set_store_references(self, store_references: bool):
+        """
+        Set store_references parameter
+
+        Parameters
+        ----------
+        store_references: bool
+
+        Returns
+        -------
+        None
+        """
+        self._type_assertation(store_references, bool)
+        self.store_references = store_references
+
     def set_db_type(self, db_type: str):
         """
         Set db_type parameter. If currently connected to one or more databases, will raise ValueError.
@@ -74,23 +135,54 @@ class GlobalConfig:
                              "all databases before changing db_type")
         self.db_type = db_type
 
-    def write_to_log(self, message: str):
+    def write_to_log(self,
+                     message: str,
+                     **fields):
         """
-        Given some message, write new line to log file, prefixed with a timestamp
+        Given some message, append new line to log file, prefixed with a timestamp. Records are buffered and written
+        to file by a background thread (see log_writer.BufferedLogWriter); call flush_log to write immediately.
 
         Parameters
         ----------
         message: str
             Message for logging
+        fields:
+            Additional structured fields, recorded if log_format is "jsonl"
+
+        Returns
+        -------
+        None
+        """
+        if self._log_writer is None:
+            self._log_writer = BufferedLogWriter(path=self.log_path,
+                                                 log_format=self.log_format,
+                                                 buffer_size=self.log_buffer_size,
+                                                 flush_interval=self.log_flush_interval)
+        self._log_writer.write(message, **fields)
+
+    def flush_log(self):
+        """
+        Write any buffered log records to file
+
+        Returns
+        -------
+        None
+        """
+        if self._log_writer is not None:
+            self._log_writer.flush()
+
+    def close_log(self):
+        """
+        Flush buffered log records and stop the background log writer. A new writer is started by the next call
+        to write_to_log.
 
         Returns
         -------
         None
         """
-        log = open(self.log_path, mode="w")
-        new_line = f"{datetime.now()}: {message} \n"
-        log.write(new_line)
-        log.close()
+        if self._log_writer is not None:
+            self._log_writer.close()
+            self._log_writer = None
 
     def connect(self, db_name: str, alias: str = "core", **kwargs):
         """
@@ -145,6 +237,7 @@ class GlobalConfig:
         -------
          None
         """
+        self.flush_log()
         if self.db_type == "nosql":
             if close_all:
                 for alias in self.db_alias:
@@ -160,3 +253,123 @@ class GlobalConfig:
                 self.db_connection = None
 
 
+    def create_indexes(self) -> list:
+        """
+        Build any declared indexes that do not exist on the connected database and report all indexes.
+        SQL: the secondary indexes of the standard schema (see sql.schema.create_indexes).
+        NoSQL: the indexes declared in the meta of each document (see nosql.indexes)
+
+        Returns
+        -------
+        list
+            See index_report
+        """
+        if self.db_type == "sql":
+            assert self.db_connection is not None, "Not connected to a SQLite database, call connect first"
+            schema.create_indexes(self.db_connection)
+        else:
+            self._nosql("indexes").create_indexes()
+        return self._log_indexes()
+
+    @staticmethod
+    def _nosql(module: str):
+        # Imported on use as nosql documents import GlobalConfig
+        return importlib.import_module(f"ProjectBevan.nosql.{module}")
+
+    def _log_indexes(self) -> list:
+        report = self.index_report()
+        self.write_to_log(f"Indexes built; {len(report)} indexes, "
+                          f"{sum(x.get('size') or 0 for x in report)} bytes", indexes=report)
+        return report
+
+    def index_report(self) -> list:
+        """
+        Report the indexes of the connected database and their sizes
+
+        Returns
+        -------
+        list
+            One dictionary per index with keys "index", "keys", "size" (bytes, None if not reported by the database)
+            and "table" (SQL) or "collection" (NoSQL)
+        """
+        if self.db_type == "sql":
+            assert self.db_connection is not None, "Not connected to a SQLite database, call connect first"
+            return schema.index_report(self.db_connection)
+        return self._nosql("indexes").index_report()
+
+    @contextmanager
+    def bulk_load(self):
+        """
+        Context manager that defers building indexes until a bulk load (e.g. Populate) is complete, so that each
+        index is built once rather than maintained row by row during the load. Indexes are built (see
+        create_indexes) when the context exits without error. If the load raises an error, indexes are not built
+        (the load can be resumed first, see Populate), a warning is issued and logged, and create_indexes must be
+        called once the load is complete. If building the indexes fails, the loaded data is kept, a separate warning
+        is issued and logged, and create_indexes can be called to retry.
+        SQL: see sql.schema.bulk_load; WAL journaling and relaxed synchronous pragmas are also used for the load.
+        NoSQL: declared indexes are dropped on entry (see nosql.indexes.drop_indexes).
+
+            with config.bulk_load():
+                populate.add_patients()
+                populate.add_measurements(...)
+            config.index_report()
+
+        Returns
+        -------
+        GlobalConfig
+        """
+        if self.db_type == "sql":
+            assert self.db_connection is not None, "Not connected to a SQLite database, call connect first"
+        try:
+            if self.db_type == "sql":
+                with schema.bulk_load(self.db_connection, build_indexes=False):
+                    yield self
+            else:
+                self._nosql("indexes").drop_indexes()
+                yield self
+        except Exception:
+            err = "Bulk load failed, indexes have not been built; call create_indexes once the load is complete"
+            self.write_to_log(err)
+            warn(err)
+            raise
+        try:
+            self.create_indexes()
+        except Exception:
+            err = "Building indexes failed after bulk load, the loaded data is kept; call create_indexes to retry"
+            self.write_to_log(err)
+            warn(err)
+            raise
+
+    def delete_patients(self,
+                        patient_ids: list,
+                        batch_size: int or None = None) -> dict:
+        """
+        Delete patients and all of their data (outcome events, measurements, critical care records and, SQL only,
+        comorbidity associations) from the connected database, e.g. to withdraw an opt-out cohort. Deletes are
+        issued in batches of patient IDs, one statement per table or collection per batch (see
+        sql.bulk.delete_patients and nosql.bulk.delete_patients).
+
+        Parameters
+        ----------
+        patient_ids: list
+            Patients to delete
+        batch_size: int, optional
+            Number of patient IDs per batch, defaults to 500 (SQL) or 10000 (NoSQL)
+
+        Returns
+        -------
+        dict
+            Number of rows/documents deleted from each table/collection
+        """
+        if self.db_type == "sql":
+            assert self.db_connection is not None, "Not connected to a SQLite database, call connect first"
+            deleted = bulk.delete_patients(self.db_connection, patient_ids, batch_size=batch_size or 500)
+        else:
+            deleted = self._nosql("bulk").delete_patients(owner=self._nosql("patient").Patient,
+                                                          children=[self._nosql("event").Event,
+                                                                    self._nosql("measurement").Measurement,
+                                                                    self._nosql("critical_care").CriticalCare],
+                                                          patient_ids=patient_ids,
+                                                          batch_size=batch_size or 10000)
+        self.write_to_log(f"Deleted patients and associated data; {deleted}", **deleted)
+        return deleted
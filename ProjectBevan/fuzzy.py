@@ -0,0 +1,87 @@
+from Levenshtein import distance as levenshtein_distance
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree for fuzzy matching of strings by edit distance (levenshtein distance). Each node stores a
+    key and its children by their distance from that key; because edit distance is a metric, a search for keys within
+    threshold of x only needs to descend into children whose distance d from the node key satisfies
+    |d - distance(x, node key)| <= threshold, so lookups visit a fraction of the keys rather than all of them.
+
+    Used as the in-memory index of comorbidity names (ComorbKey table / comorbid collection), loaded once and
+    updated as new keys are added.
+
+    Parameters
+    ----------
+    keys: iterable, optional
+        Initial keys
+    """
+    def __init__(self, keys: iter or None = None):
+        self._root = None
+        self._keys = set()
+        for key in keys or []:
+            self.add(key)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, key: str):
+        return key in self._keys
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def add(self, key: str) -> bool:
+        """
+        Add a key to the tree
+
+        Parameters
+        ----------
+        key: str
+
+        Returns
+        -------
+        bool
+            False if the key was already present, else True
+        """
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        if self._root is None:
+            self._root = (key, dict())
+            return True
+        node = self._root
+        while True:
+            d = levenshtein_distance(key, node[0])
+            child = node[1].get(d)
+            if child is None:
+                node[1][d] = (key, dict())
+                return True
+            node = child
+
+    def search(self,
+               x: str,
+               edit_threshold: int = 1) -> list:
+        """
+        Find all keys whose edit distance to x is less than or equal to edit_threshold
+
+        Parameters
+        ----------
+        x: str
+        edit_threshold: int, (default = 1)
+
+        Returns
+        -------
+        list
+            Matching keys, ordered by edit distance and then alphabetically
+        """
+        matches = list()
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            key, children = stack.pop()
+            d = levenshtein_distance(x, key)
+            if d <= edit_threshold:
+                matches.append((d, key))
+            stack.extend(child for distance, child in children.items()
+                         if d - edit_threshold <= distance <= d + edit_threshold)
+        return [key for _, key in sorted(matches)]
@@ -0,0 +1,310 @@
+from .config import GlobalConfig
+from .nosql.patient import Patient
+from .patient_index import file_fingerprint
+from pandas.api.types import is_float_dtype
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+
+SQL_FILES_TABLE = "IngestFiles"
+SQL_ROWS_TABLE = "IngestRows"
+NOSQL_FILES_COLLECTION = "ingest_files"
+NOSQL_ROWS_COLLECTION = "ingest_rows"
+# Maximum number of row hashes per document (8 bytes each), well below the MongoDB document size limit
+NOSQL_BLOCK_SIZE = 1000000
+
+
+def stage_key(stage: str, **params) -> str:
+    """
+    Key identifying an ingest stage and the parameters it was called with e.g. add_events with a given set of
+    mappings, so that the same file ingested by the same method with different parameters is tracked separately
+
+    Parameters
+    ----------
+    stage: str
+        Name of stage e.g. "events"
+    params:
+        Parameters that determine what is written
+
+    Returns
+    -------
+    str
+    """
+    digest = hashlib.blake2b(json.dumps(params, sort_keys=True, default=str).encode("utf-8"), digest_size=8)
+    return f"{stage}-{digest.hexdigest()}"
+
+
+def row_hashes(df: pd.DataFrame) -> np.ndarray:
+    """
+    64-bit hash of the contents of each row of a DataFrame (the index is ignored). Values are hashed by their
+    string representation, and float columns holding only whole numbers are treated as integers, so that the hash
+    of a row does not depend on the dtypes inferred when the file was read (e.g. an integer column that is read as
+    float in a chunk containing missing values).
+
+    Parameters
+    ----------
+    df: Pandas.DataFrame
+
+    Returns
+    -------
+    Numpy.Array
+        uint64 array, one hash per row
+    """
+    normalised = dict()
+    for column in df.columns:
+        values = df[column]
+        if is_float_dtype(values) and (values.dropna() % 1 == 0).all():
+            values = values.astype("Int64")
+        normalised[str(column)] = np.array(["" if pd.isna(x) else str(x) for x in values.tolist()], dtype=object)
+    normalised = pd.DataFrame(normalised, index=df.index, dtype=object)
+    return pd.util.hash_pandas_object(normalised, index=False).values
+
+
+def row_keys(df: pd.DataFrame,
+             counts: pd.Series or None = None) -> (np.ndarray, pd.Series):
+    """
+    64-bit key of each row of a DataFrame read from a target file, combining the hash of the row contents (see
+    row_hashes) with the number of identical rows that precede it in the file. Identical rows therefore have distinct
+    keys, so that a row repeated in a later delta (e.g. a repeated measurement) is not mistaken for one already
+    written. When a file is read in chunks, pass the counts returned for the previous chunk so that rows are numbered
+    from the start of the file.
+
+    Parameters
+    ----------
+    df: Pandas.DataFrame
+    counts: Pandas.Series, optional
+        Number of rows read so far with each hash (as returned by the previous call for the same file)
+
+    Returns
+    -------
+    Numpy.Array, Pandas.Series
+        uint64 array, one key per row, and the updated counts
+    """
+    hashes = pd.Series(row_hashes(df))
+    occurrence = hashes.groupby(hashes).cumcount()
+    if counts is not None and len(counts) > 0:
+        occurrence += hashes.map(counts).fillna(0).astype("int64")
+    keys = pd.util.hash_pandas_object(pd.DataFrame({"hash": hashes, "occurrence": occurrence}), index=False).values
+    new_counts = hashes.value_counts()
+    counts = new_counts if counts is None else counts.add(new_counts, fill_value=0).astype("int64")
+    return keys, counts
+
+
+class IngestManifest:
+    """
+    Record of the rows of each target file that have been written to the database by each ingest stage, used for
+    incremental (delta) ingestion. For each stage and file the manifest stores the keys of all rows written (see
+    row_keys), so that when a file is re-read only new or changed rows are processed, and the fingerprint (size and
+    modification time) of the file when it was last fully processed, so that unchanged files are skipped without
+    being read at all.
+
+    The manifest is stored in the database it describes, like checkpoint.CheckpointStore: the IngestFiles and
+    IngestRows tables (SQL, created on first use) or the ingest_files and ingest_rows collections (NoSQL). Row keys
+    are appended as blocks of uint64 values, one block per commit. SQL: commit and complete can be called with
+    commit=False inside the transaction that writes the rows, so that the rows and the manifest are committed (or
+    rolled back) together.
+
+    Rows are identified by their contents and the number of identical rows preceding them in the file, so repeated
+    identical rows are each written once. Rows have no identity beyond their contents: a row that is modified in
+    place is treated as a new row, and its previous version is neither replaced nor removed from the database.
+
+    Parameters
+    ----------
+    config: GlobalConfig
+        Instance of GlobalConfig, with database connection
+    """
+    def __init__(self, config: GlobalConfig):
+        self._config = config
+        self._keys = dict()
+        if config.db_type == "sql":
+            with config.db_connection as conn:
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {SQL_FILES_TABLE}("
+                             f"stage TEXT NOT NULL, "
+                             f"filename TEXT NOT NULL, "
+                             f"fingerprint TEXT, "
+                             f"PRIMARY KEY(stage, filename));")
+                conn.execute(f"CREATE TABLE IF NOT EXISTS {SQL_ROWS_TABLE}("
+                             f"stage TEXT NOT NULL, "
+                             f"filename TEXT NOT NULL, "
+                             f"hashes BLOB NOT NULL);")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {SQL_ROWS_TABLE}_stage_filename "
+                             f"ON {SQL_ROWS_TABLE}(stage, filename);")
+        else:
+            self._collection(NOSQL_ROWS_COLLECTION).create_index([("stage", 1), ("filename", 1)])
+
+    @staticmethod
+    def _collection(name: str):
+        return Patient._get_db()[name]
+
+    def _execute(self,
+                 sql: str,
+                 params: tuple,
+                 commit: bool):
+        if commit:
+            with self._config.db_connection as conn:
+                conn.execute(sql, params)
+        else:
+            self._config.db_connection.execute(sql, params)
+
+    def _load_keys(self,
+                     stage: str,
+                     filename: str) -> np.ndarray:
+        if (stage, filename) not in self._keys:
+            if self._config.db_type == "sql":
+                blocks = [x[0] for x in self._config.db_connection.execute(
+                    f"SELECT hashes FROM {SQL_ROWS_TABLE} WHERE stage=? AND filename=?;", (stage, filename))]
+            else:
+                blocks = [doc.get("hashes") for doc in self._collection(NOSQL_ROWS_COLLECTION).find(
+                    {"stage": stage, "filename": filename}, {"hashes": 1})]
+            keys = [np.frombuffer(block, dtype=np.uint64) for block in blocks]
+            self._keys[(stage, filename)] = np.unique(np.concatenate(keys)) if keys else \
+                np.array([], dtype=np.uint64)
+        return self._keys[(stage, filename)]
+
+    def is_complete(self,
+                    stage: str,
+                    filename: str,
+                    path: str) -> bool:
+        """
+        Check if a file has been fully processed by a stage and is unchanged since
+
+        Parameters
+        ----------
+        stage: str
+            Stage key (see stage_key)
+        filename: str
+            Name of the target file
+        path: str
+            Path to the target file
+
+        Returns
+        -------
+        bool
+        """
+        if self._config.db_type == "sql":
+            row = self._config.db_connection.execute(f"SELECT fingerprint FROM {SQL_FILES_TABLE} "
+                                                     f"WHERE stage=? AND filename=?;", (stage, filename)).fetchone()
+            fingerprint = None if row is None or row[0] is None else json.loads(row[0])
+        else:
+            doc = self._collection(NOSQL_FILES_COLLECTION).find_one({"stage": stage, "filename": filename})
+            fingerprint = None if doc is None else doc.get("fingerprint")
+        return fingerprint is not None and fingerprint == file_fingerprint(path)
+
+    def new_rows(self,
+                 stage: str,
+                 filename: str,
+                 keys: np.ndarray) -> np.ndarray:
+        """
+        Identify rows read from a target file that have not been written by a stage
+
+        Parameters
+        ----------
+        stage: str
+            Stage key (see stage_key)
+        filename: str
+            Name of the target file
+        keys: Numpy.Array
+            Row keys (see row_keys)
+
+        Returns
+        -------
+        Numpy.Array
+            Boolean mask, True for new (or changed) rows
+        """
+        return ~np.isin(keys, self._load_keys(stage, filename))
+
+    def commit(self,
+               stage: str,
+               filename: str,
+               keys: np.ndarray,
+               commit: bool = True):
+        """
+        Record rows of a target file as written by a stage. Call once the rows have been written to the database
+        (SQL: or within the transaction that writes them, with commit=False).
+
+        Parameters
+        ----------
+        stage: str
+            Stage key (see stage_key)
+        filename: str
+            Name of the target file
+        keys: Numpy.Array
+            Keys of the rows written (see row_keys)
+        commit: bool, (default = True)
+            SQL only. If False, the rows are recorded within the caller's transaction and are not committed. If the
+            transaction is rolled back, discard this manifest (the rows remain recorded in its cache)
+
+        Returns
+        -------
+        None
+        """
+        existing = self._load_keys(stage, filename)
+        new = np.setdiff1d(keys, existing)
+        if len(new) == 0:
+            return
+        if self._config.db_type == "sql":
+            self._execute(f"INSERT INTO {SQL_ROWS_TABLE}(stage, filename, hashes) VALUES(?, ?, ?);",
+                          (stage, filename, new.tobytes()), commit=commit)
+        else:
+            self._collection(NOSQL_ROWS_COLLECTION).insert_many(
+                [{"stage": stage, "filename": filename, "hashes": new[i:i + NOSQL_BLOCK_SIZE].tobytes()}
+                 for i in range(0, len(new), NOSQL_BLOCK_SIZE)])
+        self._keys[(stage, filename)] = np.union1d(existing, new)
+
+    def complete(self,
+                 stage: str,
+                 filename: str,
+                 fingerprint: dict,
+                 commit: bool = True):
+        """
+        Record that a file has been fully processed by a stage, so that it is skipped until it changes
+
+        Parameters
+        ----------
+        stage: str
+            Stage key (see stage_key)
+        filename: str
+            Name of the target file
+        fingerprint: dict
+            Fingerprint of the target file taken before it was read (see patient_index.file_fingerprint), so that
+            rows appended while the file was being processed are not missed
+        commit: bool, (default = True)
+            SQL only. If False, the fingerprint is written within the caller's transaction and is not committed
+
+        Returns
+        -------
+        None
+        """
+        if self._config.db_type == "sql":
+            self._execute(f"INSERT OR REPLACE INTO {SQL_FILES_TABLE}(stage, filename, fingerprint) VALUES(?, ?, ?);",
+                          (stage, filename, json.dumps(fingerprint)), commit=commit)
+            return
+        self._collection(NOSQL_FILES_COLLECTION).replace_one(
+            {"_id": f"{stage}/{filename}"},
+            {"_id": f"{stage}/{filename}", "stage": stage, "filename": filename, "fingerprint": fingerprint},
+            upsert=True)
+
+    def reset(self, stage: str or None = None):
+        """
+        Forget the rows written by a stage (or all stages if stage is None), so that all rows are treated as new
+
+        Parameters
+        ----------
+        stage: str, optional
+            Stage key (see stage_key)
+
+        Returns
+        -------
+        None
+        """
+        self._keys = {key: value for key, value in self._keys.items() if stage is not None and key[0] != stage}
+        if self._config.db_type == "sql":
+            where, params = ("", ()) if stage is None else (" WHERE stage=?", (stage,))
+            with self._config.db_connection as conn:
+                for table in [SQL_FILES_TABLE, SQL_ROWS_TABLE]:
+                    conn.execute(f"DELETE FROM {table}{where};", params)
+            return
+        query = dict() if stage is None else {"stage": stage}
+        for name in [NOSQL_FILES_COLLECTION, NOSQL_ROWS_COLLECTION]:
+            self._collection(name).delete_many(query)
@@ -0,0 +1,118 @@
+from datetime import datetime
+from warnings import warn
+import threading
+import atexit
+import json
+
+
+class BufferedLogWriter:
+    """
+    Append-only, buffered log sink. Records are held in memory and written to the log file in batches by a
+    background (daemon) thread, either when the buffer reaches buffer_size records or every flush_interval seconds,
+    whichever comes first. Any remaining records are flushed on close and at interpreter exit.
+
+    Parameters
+    ----------
+    path: str
+        Path of log file, records are appended
+    log_format: str, (default = "text")
+        "text" - one line per record: "<timestamp>: <message>"
+        "jsonl" - one JSON object per line with keys "timestamp", "message" and any additional fields given
+    buffer_size: int, (default = 1000)
+        Number of buffered records that triggers a flush
+    flush_interval: float, (default = 1.0)
+        Maximum number of seconds between flushes
+    """
+    def __init__(self,
+                 path: str,
+                 log_format: str = "text",
+                 buffer_size: int = 1000,
+                 flush_interval: float = 1.0):
+        assert log_format in ["text", "jsonl"], "log_format must be 'text' or 'jsonl'"
+        assert buffer_size > 0, "buffer_size must be greater than 0"
+        self.path = path
+        self.log_format = log_format
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._buffer = list()
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="BufferedLogWriter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._background_flush()
+
+    def _background_flush(self):
+        try:
+            self.flush()
+        except OSError as e:
+            warn(f"Failed to write buffered log records to {self.path}; {e}")
+
+    def _format(self,
+                timestamp: datetime,
+                message: str,
+                fields: dict) -> str:
+        if self.log_format == "jsonl":
+            return json.dumps({"timestamp": timestamp.isoformat(), "message": message, **fields}, default=str) + "\n"
+        return f"{timestamp}: {message} \n"
+
+    def write(self,
+              message: str,
+              **fields):
+        """
+        Buffer a new record, timestamped now
+
+        Parameters
+        ----------
+        message: str
+        fields:
+            Additional structured fields (included in "jsonl" format only)
+
+        Returns
+        -------
+        None
+        """
+        if self._closed:
+            raise ValueError("Log writer has been closed")
+        with self._lock:
+            self._buffer.append(self._format(datetime.now(), message, fields))
+            if len(self._buffer) >= self.buffer_size:
+                self._wake.set()
+
+    def flush(self):
+        """
+        Write all buffered records to the log file
+
+        Returns
+        -------
+        None
+        """
+        with self._file_lock:
+            with self._lock:
+                lines, self._buffer = self._buffer, list()
+            if lines:
+                with open(self.path, mode="a") as log:
+                    log.writelines(lines)
+
+    def close(self):
+        """
+        Stop the background thread and flush remaining records
+
+        Returns
+        -------
+        None
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        atexit.unregister(self.close)
+        self._background_flush()
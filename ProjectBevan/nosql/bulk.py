@@ -0,0 +1,307 @@
+from ..config import GlobalConfig
+from mongoengine.errors import ValidationError
+from pymongo.errors import BulkWriteError
+from pymongo import ReplaceOne, UpdateOne
+from collections import defaultdict
+from bson import ObjectId
+import pandas as pd
+import mongoengine
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+def push_references(owner: type,
+                    field: str,
+                    references: dict,
+                    unique: bool = False) -> int:
+    """
+    Append references to a list field of many owner documents in a single unordered bulk_write, with one atomic
+    {"$push": {field: {"$each": [...]}}} update per owner (or "$addToSet" if unique is True). Owner documents are
+    never loaded or re-saved.
+
+    Parameters
+    ----------
+    owner: mongoengine.Document
+        Document class holding the references
+    field: str
+        Name of the list field on owner
+    references: dict
+        Owner primary key and list of ObjectIds to append
+    unique: bool, (default = False)
+        If True, references already present in the list are not appended again
+
+    Returns
+    -------
+    int
+        Number of owner documents modified
+    """
+    assert field in owner._fields, f"{field} is not a field of {owner.__name__}"
+    operator = "$addToSet" if unique else "$push"
+    requests = [UpdateOne({"_id": owner_id}, {operator: {field: {"$each": list(ids)}}})
+                for owner_id, ids in references.items() if len(ids) > 0]
+    if len(requests) == 0:
+        return 0
+    return owner._get_collection().bulk_write(requests, ordered=False).modified_count
+
+
+class BulkWriter:
+    """
+    Gathers documents and writes them to MongoDB in batches, rather than one round-trip per document.
+    Documents are validated client side and then flushed with an unordered insert_many (or, if upsert is True,
+    an unordered bulk_write of ReplaceOne upserts keyed on the document primary key). Unordered writes mean that a
+    single duplicate or invalid document does not prevent the remainder of the batch from being written.
+
+    Use as a context manager to ensure the final partial batch is flushed:
+
+        with BulkWriter(Patient, config=config, batch_size=5000) as writer:
+            for patient in patients:
+                writer.add(patient)
+        writer.report
+
+    Parameters
+    ----------
+    document: mongoengine.Document
+        Document class being written, all documents given to add must be of this class (or a subclass)
+    config: GlobalConfig
+        Instance of GlobalConfig, used for logging
+    batch_size: int, (default = 1000)
+        Number of documents per batch
+    upsert: bool, (default = False)
+        If True, existing documents with the same primary key are replaced rather than reported as duplicates.
+        Documents must have their primary key set
+
+    Properties
+    ----------
+    report: list
+        One dictionary per flushed batch with keys "batch", "inserted", "duplicate" and "failed". If upsert is True,
+        "duplicate" counts existing documents that were replaced.
+    """
+    def __init__(self,
+                 document: type,
+                 config: GlobalConfig,
+                 batch_size: int = 1000,
+                 upsert: bool = False):
+        assert batch_size > 0, "batch_size must be greater than 0"
+        self.document = document
+        self.batch_size = batch_size
+        self.upsert = upsert
+        self.report = list()
+        self._config = config
+        self._batch = list()
+        self._failed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+
+    def add(self, document: mongoengine.Document):
+        """
+        Validate and queue a document, flushing the batch if it has reached batch_size. Documents that fail
+        validation are logged and counted as failed in the report for the current batch. If upsert is True, the
+        document must have its primary key set (otherwise AssertionError is raised).
+
+        Parameters
+        ----------
+        document: mongoengine.Document
+
+        Returns
+        -------
+        None
+        """
+        assert not self.upsert or document.pk is not None, \
+            f"{self.document.__name__} documents must have a primary key to be upserted"
+        try:
+            document.validate()
+            self._batch.append(document.to_mongo().to_dict())
+        except ValidationError as e:
+            self._failed += 1
+            self._config.write_to_log(f"Invalid {self.document.__name__} document {document.pk} not written; {e}")
+        if len(self._batch) + self._failed >= self.batch_size:
+            self.flush()
+
+    def _upsert(self) -> dict:
+        requests = [ReplaceOne({"_id": doc.get("_id")}, doc, upsert=True) for doc in self._batch]
+        try:
+            result = self.document._get_collection().bulk_write(requests, ordered=False).bulk_api_result
+            errors = list()
+        except BulkWriteError as e:
+            result = e.details
+            errors = e.details.get("writeErrors", [])
+            for err in errors:
+                self._config.write_to_log(f"{self.document.__name__} document {err.get('op', {}).get('q')} not "
+                                          f"written; {err.get('errmsg')}")
+        return dict(inserted=result.get("nUpserted", 0), duplicate=result.get("nMatched", 0), failed=len(errors))
+
+    def _insert(self) -> dict:
+        if self.upsert:
+            return self._upsert()
+        try:
+            result = self.document._get_collection().insert_many(self._batch, ordered=False)
+            return dict(inserted=len(result.inserted_ids), duplicate=0, failed=0)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            duplicate = len([err for err in errors if err.get("code") == DUPLICATE_KEY_ERROR])
+            return dict(inserted=e.details.get("nInserted", 0),
+                        duplicate=duplicate,
+                        failed=len(errors) - duplicate)
+
+    def flush(self) -> dict or None:
+        """
+        Write all queued documents
+
+        Returns
+        -------
+        dict or None
+            Counts for the flushed batch, None if there was nothing to flush
+        """
+        if len(self._batch) == 0 and self._failed == 0:
+            return None
+        counts = dict(inserted=0, duplicate=0, failed=0)
+        if self._batch:
+            counts = self._insert()
+        counts["failed"] += self._failed
+        counts = dict(batch=len(self.report), **counts)
+        self.report.append(counts)
+        self._config.write_to_log(f"{self.document.__name__} batch {counts.get('batch')} written to "
+                                  f"{self.document._get_collection_name()} collection; "
+                                  f"inserted={counts.get('inserted')}, duplicate={counts.get('duplicate')}, "
+                                  f"failed={counts.get('failed')}",
+                                  collection=self.document._get_collection_name(),
+                                  **counts)
+        self._batch = list()
+        self._failed = 0
+        return counts
+
+    def totals(self) -> dict:
+        """
+        Sum of counts across all flushed batches
+
+        Returns
+        -------
+        dict
+        """
+        return {key: sum(batch.get(key) for batch in self.report) for key in ["inserted", "duplicate", "failed"]}
+
+
+class ReferenceBulkWriter(BulkWriter):
+    """
+    BulkWriter for documents that are referenced from a list field of their owning Patient (e.g. measurements or
+    outcome events). Each batch is inserted with an unordered insert_many as for BulkWriter, then references to the
+    documents that were written are appended to their owners with a single unordered bulk_write containing one
+    atomic {"$push": {field: {"$each": [...]}}} update per owner (see push_references). Owners are therefore never
+    loaded or re-saved.
+
+        with ReferenceBulkWriter(ContinuousMeasurement, config=config, owner=Patient, field="measurements") as writer:
+            for measurement in measurements:
+                writer.add(measurement)
+
+    Parameters
+    ----------
+    document: mongoengine.Document
+        Document class being written, all documents given to add must be of this class (or a subclass)
+    config: GlobalConfig
+        Instance of GlobalConfig, used for logging
+    owner: mongoengine.Document
+        Document class holding the references
+    field: str
+        Name of the list field on owner that references document
+    owner_key: str, (default = "patientId")
+        Field of document whose value is the primary key of its owner
+    batch_size: int, (default = 1000)
+        Number of documents per batch
+
+    Properties
+    ----------
+    report: list
+        As for BulkWriter, with the additional key "owners": number of owner documents updated
+    """
+    def __init__(self,
+                 document: type,
+                 config: GlobalConfig,
+                 owner: type,
+                 field: str,
+                 owner_key: str = "patientId",
+                 batch_size: int = 1000):
+        super().__init__(document=document, config=config, batch_size=batch_size, upsert=False)
+        assert field in owner._fields, f"{field} is not a field of {owner.__name__}"
+        self.owner = owner
+        self.field = field
+        self.owner_key = owner_key
+
+    def add(self, document: mongoengine.Document):
+        """
+        Validate and queue a document, see BulkWriter.add. An ObjectId is assigned to the document if it does not
+        yet have one, so that it can be referenced before it is written.
+
+        Parameters
+        ----------
+        document: mongoengine.Document
+
+        Returns
+        -------
+        None
+        """
+        if document.pk is None:
+            document.pk = ObjectId()
+        super().add(document)
+
+    def _insert(self) -> dict:
+        failed_idx = set()
+        try:
+            result = self.document._get_collection().insert_many(self._batch, ordered=False)
+            counts = dict(inserted=len(result.inserted_ids), duplicate=0, failed=0)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            failed_idx = {err.get("index") for err in errors}
+            duplicate = len([err for err in errors if err.get("code") == DUPLICATE_KEY_ERROR])
+            counts = dict(inserted=e.details.get("nInserted", 0),
+                          duplicate=duplicate,
+                          failed=len(errors) - duplicate)
+        references = defaultdict(list)
+        for i, doc in enumerate(self._batch):
+            if i not in failed_idx:
+                references[doc.get(self.owner_key)].append(doc.get("_id"))
+        counts["owners"] = push_references(owner=self.owner, field=self.field, references=references)
+        return counts
+
+
+def delete_patients(owner: type,
+                    children: list,
+                    patient_ids: list,
+                    batch_size: int = 10000) -> dict:
+    """
+    Delete patients and all documents that reference them by patientId (cascade), with one delete_many per
+    collection and batch of patient IDs ({"patientId": {"$in": [...]}}). Child documents are deleted before their
+    patients, so an interrupted delete can be repeated. Documents are never loaded and reverse delete rules are not
+    applied (the owners of any references are themselves deleted).
+
+    Parameters
+    ----------
+    owner: mongoengine.Document
+        Patient document class, whose primary key is the patient ID
+    children: list
+        Document classes with a patientId field
+    patient_ids: list
+        Patients to delete, duplicates and missing values are ignored
+    batch_size: int, (default = 10000)
+        Number of patient IDs per delete_many
+
+    Returns
+    -------
+    dict
+        Number of documents deleted from each collection
+    """
+    assert batch_size > 0, "batch_size must be greater than 0"
+    patient_ids = pd.Series(patient_ids, dtype=object).dropna().map(str).unique().tolist()
+    deleted = {document._get_collection_name(): 0 for document in children + [owner]}
+    for i in range(0, len(patient_ids), batch_size):
+        batch = patient_ids[i:i + batch_size]
+        for document in children:
+            result = document._get_collection().delete_many({"patientId": {"$in": batch}})
+            deleted[document._get_collection_name()] += result.deleted_count
+        result = owner._get_collection().delete_many({"_id": {"$in": batch}})
+        deleted[owner._get_collection_name()] += result.deleted_count
+    return deleted
@@ -17,6 +17,7 @@ class CriticalCare(mongoengine.DynamicDocument):
 
     meta = {
         "db_alias": "core",
-        "collection": "criticalCare"
+        "collection": "criticalCare",
+        "indexes": [("patientId", "admissionDate")]
     }
 
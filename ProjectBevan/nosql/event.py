@@ -49,5 +49,7 @@ class Event(mongoengine.DynamicDocument):
 
     meta = {
         "db_alias": "core",
-        "collection": "outcomes"
+        "collection": "outcomes",
+        "indexes": [("patientId", "eventType", "eventDate"),
+                    ("eventType", "eventDate")]
     }
@@ -0,0 +1,99 @@
+from .patient import Patient, Comorbidity
+from .event import Event
+from .measurement import Measurement
+from .critical_care import CriticalCare
+from pymongo.errors import PyMongoError
+
+DOCUMENTS = [Patient, Comorbidity, Event, Measurement, CriticalCare]
+
+
+def declared_indexes(document: type) -> list:
+    """
+    Secondary indexes declared in the meta of a document (the _id index is excluded)
+
+    Parameters
+    ----------
+    document: mongoengine.Document
+
+    Returns
+    -------
+    list
+        One list of (field, direction) tuples per index
+    """
+    return [keys for keys in document.list_indexes() if keys != [("_id", 1)]]
+
+
+def create_indexes(documents: list or None = None):
+    """
+    Build the declared indexes of each document that do not already exist
+
+    Parameters
+    ----------
+    documents: list, optional
+        Document classes, defaults to all documents (DOCUMENTS)
+
+    Returns
+    -------
+    None
+    """
+    for document in documents or DOCUMENTS:
+        document.ensure_indexes()
+
+
+def drop_indexes(documents: list or None = None):
+    """
+    Drop the declared indexes of each document, e.g. before a bulk load so that indexes are built once after the load
+    rather than maintained document by document. Indexes that do not exist are ignored.
+
+    Parameters
+    ----------
+    documents: list, optional
+        Document classes, defaults to all documents (DOCUMENTS)
+
+    Returns
+    -------
+    None
+    """
+    for document in documents or DOCUMENTS:
+        collection = document._get_collection()
+        existing = [info.get("key") for info in collection.index_information().values()]
+        for keys in declared_indexes(document):
+            if keys in existing:
+                collection.drop_index(keys)
+
+
+def _index_sizes(collection) -> dict:
+    try:
+        stats = list(collection.aggregate([{"$collStats": {"storageStats": {}}}]))
+    except (PyMongoError, NotImplementedError):
+        return dict()
+    if len(stats) == 0:
+        return dict()
+    return stats[0].get("storageStats", dict()).get("indexSizes", dict())
+
+
+def index_report(documents: list or None = None) -> list:
+    """
+    Report the indexes of each document's collection and their sizes
+
+    Parameters
+    ----------
+    documents: list, optional
+        Document classes, defaults to all documents (DOCUMENTS)
+
+    Returns
+    -------
+    list
+        One dictionary per index with keys "collection", "index", "keys" and "size" (bytes, None if the server does
+        not report storage statistics)
+    """
+    report = list()
+    for document in documents or DOCUMENTS:
+        collection = document._get_collection()
+        sizes = _index_sizes(collection)
+        for name, info in collection.index_information().items():
+            report.append(dict(collection=collection.name,
+                               index=name,
+                               keys=list(info.get("key")),
+                               size=sizes.get(name)))
+    return report
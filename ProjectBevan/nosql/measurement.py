@@ -16,7 +16,10 @@ class Measurement(mongoengine.DynamicDocument):
     meta = {
         "db_alias": "core",
         "collection": "testResults",
-        "allow_inheritance": True
+        "allow_inheritance": True,
+        "index_cls": False,
+        "indexes": [("patientId", "name", "date"),
+                    ("name", "date")]
     }
 
 
@@ -3,10 +3,33 @@ from ..config import GlobalConfig
 from .event import Event
 from .measurement import Measurement, ComplexMeasurement, ContinuousMeasurement, DiscreteMeasurement
 from .critical_care import CriticalCare
+from ..fuzzy import BKTree
 from Levenshtein import distance as levenshtein_distance
+from datetime import date, datetime
+import pandas as pd
 import mongoengine
 
 
+def _parse_datetime(x: str) -> dict:
+    """
+    As utilities.parse_datetime, but with the date as a datetime rather than a day-first string, so that it is not
+    re-parsed (month first) by mongoengine.DateField
+    """
+    parsed = parse_datetime(x)
+    if parsed.get("date") is not None:
+        parsed["date"] = datetime.strptime(parsed.get("date"), "%d/%m/%Y")
+    return parsed
+
+
+def _query_datetime(x: str or date) -> datetime:
+    if isinstance(x, str):
+        parsed = _parse_datetime(x).get("date")
+        if parsed is None:
+            raise ValueError(f"Invalid date {x}")
+        return parsed
+    return datetime(x.year, x.month, x.day)
+
+
 def _add_if_value(document,
                   input_variables):
     for name, value in input_variables:
@@ -30,7 +53,8 @@ class Comorbidity(mongoengine.DynamicDocument):
 
     meta = {
         "db_alias": "core",
-        "collection": "comorbid"
+        "collection": "comorbid",
+        "indexes": ["comorbidName"]
     }
 
     def similarity(self,
@@ -56,6 +80,36 @@ class Comorbidity(mongoengine.DynamicDocument):
         return 0
 
 
+_COMORBIDITY_INDEXES = dict()
+
+
+def comorbidity_index(reload: bool = False) -> BKTree:
+    """
+    Fuzzy-match index of the names in the comorbid collection. The index is built from the collection on first use
+    for each collection and kept for later calls; comorbidities created through Patient.add_new_comorbidity or
+    Populate.add_comorbidities are added to it. The index is rebuilt if the number of documents in the collection no
+    longer matches the index (e.g. the collection was dropped, or comorbidities were created elsewhere).
+
+    Parameters
+    ----------
+    reload: bool, (default = False)
+        If True, rebuild the index from the collection
+
+    Returns
+    -------
+    BKTree
+    """
+    collection = Comorbidity._get_collection()
+    count = collection.estimated_document_count()
+    cached = _COMORBIDITY_INDEXES.get(collection.full_name)
+    # cached = (index, number of documents not in the index, i.e. duplicate names)
+    if reload or cached is None or len(cached[0]) + cached[1] != count:
+        index = BKTree(collection.distinct("comorbidName"))
+        cached = (index, count - len(index))
+        _COMORBIDITY_INDEXES[collection.full_name] = cached
+    return cached[0]
+
+
 class Patient(mongoengine.Document):
     """
     Document object for a unique individual.
@@ -77,7 +131,8 @@ class Patient(mongoengine.Document):
         1 = patient had a stay in ICU during admission, else 0
     outcomeEvents: List(ReferenceField)
         Reference to outcome events, reverse delete rule = Pull (if an outcome event is deleted, it will
-        automatically be pulled from this list of references)
+        automatically be pulled from this list of references). Outcome events, measurements and critical care
+        records are only referenced if config.store_references is True, they can always be found by patientId
     measurements: List(ReferenceField)
         Reference to test results, reverse delete rule = Pull (if a test result is deleted, it will
         automatically be pulled from this list of references)
@@ -112,7 +167,8 @@ class Patient(mongoengine.Document):
                signal_kwargs=None,
                **write_concern):
         """
-        Method override for parent delete method. Removes all unique referenced documents for patient prior to delete.
+        Method override for parent delete method. Removes all outcome events, measurements and critical care records
+        for patient (by patientId, whether or not they are referenced) prior to delete.
 
         Parameters
         ----------
@@ -127,16 +183,40 @@ class Patient(mongoengine.Document):
         None
         """
         self._config.write_to_log(f"Deleting {self.patientId} and associated documents...")
-        for references in [self.outcomeEvents,
-                           self.measurements,
-                           self.criticalCare]:
-            for doc in references:
-                doc.delete(signal_kwargs=signal_kwargs, **write_concern)
-        super().delete(self=self,
-                       signal_kwargs=signal_kwargs,
+        for document in [Event, Measurement, CriticalCare]:
+            document._get_collection().delete_many({"patientId": self.patientId})
+        super().delete(signal_kwargs=signal_kwargs,
                        **write_concern)
         self._config.write_to_log(f"Deleted patient and asssociated documents.")
 
+    def _add_reference(self,
+                       field: str,
+                       document: mongoengine.Document,
+                       unique: bool = False):
+        """
+        Append a reference to a list field with a single atomic update ({"$push": ...}, or {"$addToSet": ...} if
+        unique is True), without loading or re-saving the patient document; the list held by this object is not
+        updated (call reload to refresh it). If the patient has not yet been saved, the reference is appended and
+        the patient is saved.
+
+        Parameters
+        ----------
+        field: str
+            Name of list field
+        document: mongoengine.Document
+            Saved document to reference
+        unique: bool, (default = False)
+
+        Returns
+        -------
+        None
+        """
+        operator = "add_to_set" if unique else "push"
+        if Patient.objects(pk=self.pk).update_one(**{f"{operator}__{field}": document}) == 0:
+            if not unique or document not in self[field]:
+                self[field].append(document)
+            self.save()
+
     def add_new_event(self,
                       event_type: str,
                       event_datetime: str,
@@ -181,7 +261,7 @@ class Patient(mongoengine.Document):
         None
         """
         # Parse datetime and check validity (None for date if invalid)
-        event_datetime = parse_datetime(event_datetime)
+        event_datetime = _parse_datetime(event_datetime)
         if event_datetime.get("date") is None:
             err = f"Datetime parsed when trying to generate a new outcome event for {self.patientId} was invalid!"
             self._config.write_to_log(err)
@@ -201,8 +281,8 @@ class Patient(mongoengine.Document):
                                                   ("wimd", wimd),
                                                   ("eventTime", event_datetime.get("time"))])
         new_outcome = new_outcome.save()
-        self.outcomeEvents.append(new_outcome)
-        self.save()
+        if self._config.store_references:
+            self._add_reference("outcomeEvents", new_outcome)
         self._config.write_to_log(f"Outcome event {new_outcome.id} for patient {self.patientId}")
 
     def add_new_measurement(self,
@@ -236,8 +316,10 @@ class Patient(mongoengine.Document):
         -------
 
         """
-        if result_datetime is not None:
-            result_datetime = result_datetime(result_datetime)
+        if result_datetime is None:
+            result_datetime = dict()
+        else:
+            result_datetime = _parse_datetime(result_datetime)
             if result_datetime.get("date") is None:
                 err = f"Datetime parsed when trying to generate a new measurement document for " \
                       f"{self.patientId} was invalid!"
@@ -282,40 +364,64 @@ class Patient(mongoengine.Document):
             raise ValueError("result_type must be one of: 'complex', 'continuous, or 'discrete'")
 
         new_result = new_result.save()
-        self.measurements.append(new_result)
-        self.save()
+        if self._config.store_references:
+            self._add_reference("measurements", new_result)
         self._config.write_to_log(f"Measurement {new_result.id} added for patient {self.patientId}")
 
     def add_new_comorbidity(self,
                             name: str,
                             conflicts: str = "ignore",
                             edit_threshold: int = 1,
+                            index: BKTree or None = None,
                             **kwargs):
-        existing = Comorbidity.objects(comorbidName=name)
-        if existing:
-            existing = existing.get()
-            self.comorbidities.append(existing)
-            self.save()
+        """
+        Associate patient to a comorbidity. If the comorbidity does not exist it is created, unless it is similar
+        to existing comorbidities (edit distance less than or equal to edit_threshold), in which case conflicts
+        determines the outcome.
+
+        Parameters
+        ----------
+        name: str
+            Name of comorbidity
+        conflicts: str, (default = "ignore")
+            "ignore" - create a new comorbidity regardless of similar comorbidities
+            "raise" - raise ValueError if similar comorbidities exist
+            "merge" - associate to the similar comorbidity (ValueError if there is more than one)
+        edit_threshold: int, (default = 1)
+        index: BKTree, optional
+            Fuzzy-match index of existing comorbidity names, updated if a new comorbidity is created. Defaults to the
+            shared index of the comorbid collection (see comorbidity_index)
+        kwargs:
+            Additional fields for a new comorbidity
+
+        Returns
+        -------
+        None
+        """
+        if conflicts not in ["ignore", "raise", "merge"]:
+            raise ValueError("conflicts argument should be one of: 'ignore', 'raise', or 'merge'")
+        if index is None:
+            index = comorbidity_index()
+        existing = Comorbidity.objects(comorbidName=name).first()
+        if existing is not None:
+            # Created since the index was built (e.g. by another process)
+            index.add(name)
+            self._add_reference("comorbidities", existing, unique=True)
             self._config.write_to_log(f"Associated patient {self.patientId} too {existing.comorbidName}")
             return None
-        similar = [comorb for comorb in Comorbidity.objects()
-                   if comorb.similarity(x=name, edit_threshold=edit_threshold) == 1]
+        similar = index.search(name, edit_threshold=edit_threshold)
         if conflicts == "ignore" or len(similar) == 0:
-            new_comorb = Comorbidity(cmorbidName=name, **kwargs)
-            self.comorbidities.append(new_comorb)
-            self.save()
+            new_comorb = Comorbidity(comorbidName=name, **kwargs).save()
+            index.add(name)
+            self._add_reference("comorbidities", new_comorb, unique=True)
             self._config.write_to_log(f"Associated patient {self.patientId} too {name}")
             return None
-        else:
-            if len(similar) > 1 or conflicts == "raise":
-                err = f"Multiple similar comorbitities found when entering {name} for patient {self.patientId}"
-                self._config.write_to_log(err)
-                raise ValueError(err)
-            if conflicts == "merge":
-                self.comorbidities.append(similar[0])
-                self.save()
-                self._config.write_to_log(f"Associated patient {self.patientId} too {similar[0].comorbidName}")
-        raise ValueError("conflicts argument should be one of: 'ignore', 'raise', or 'merge'")
+        if len(similar) > 1 or conflicts == "raise":
+            err = f"Multiple similar comorbitities found when entering {name} for patient {self.patientId}"
+            self._config.write_to_log(err)
+            raise ValueError(err)
+        self._add_reference("comorbidities", Comorbidity.objects(comorbidName=similar[0]).get(), unique=True)
+        self._config.write_to_log(f"Associated patient {self.patientId} too {similar[0]}")
 
     def add_new_critical_care(self,
                               admission_datetime: str or None = None,
@@ -326,8 +432,8 @@ class Patient(mongoengine.Document):
                               covid_status: str = "U",
                               **kwargs):
 
-        admission_datetime = parse_datetime(admission_datetime)
-        discharge_datetime = parse_datetime(discharge_datetime)
+        admission_datetime = _parse_datetime(admission_datetime) if admission_datetime is not None else dict()
+        discharge_datetime = _parse_datetime(discharge_datetime) if discharge_datetime is not None else dict()
         new_event = CriticalCare(patientId=self.patientId, **kwargs)
         new_event = _add_if_value(new_event, [("admissionDate", admission_datetime.get("date")),
                                               ("admissionTime", admission_datetime.get("time")),
@@ -336,32 +442,64 @@ class Patient(mongoengine.Document):
                                               ("requestLocation", request_location),
                                               ("icuDays", icu_days),
                                               ("ventilated", ventilated),
-                                              ("covidStatis", covid_status)])
-        self.criticalCare.append(new_event)
-        self.save()
+                                              ("covidStatus", covid_status)])
+        new_event = new_event.save()
+        if self._config.store_references:
+            self._add_reference("criticalCare", new_event)
         self._config.write_to_log(f"New critical care event added for patient {self.patientId}")
 
-    def get_measurement_by_type(self, requested_type: str):
+    def get_measurement_by_type(self,
+                                requested_type: str,
+                                name: str or list or None = None,
+                                start_date: str or date or None = None,
+                                end_date: str or date or None = None,
+                                fields: list or None = None,
+                                as_dataframe: bool = False):
         """
-        Filter measurements by data type, either continuous, discrete or complex
+        Filter measurements by data type, either continuous, discrete or complex. Measurements are queried by
+        patientId and their inheritance class (_cls), with any name and date predicates, in MongoDB; the measurements
+        list of the patient is not dereferenced, so this works whether or not references are stored.
 
         Parameters
         ----------
         requested_type: str
             'continuous', 'discrete' or 'complex'
+        name: str or list, optional
+            Name, or list of names, of measurements to return
+        start_date: str or datetime.date, optional
+            Earliest date (inclusive); strings are parsed with day first (see utilities.parse_datetime)
+        end_date: str or datetime.date, optional
+            Latest date (inclusive)
+        fields: list, optional
+            Fields to return (projection), if None, all fields are returned
+        as_dataframe: bool, (default = False)
+            If True, return a DataFrame with one column per field and one row per measurement
 
         Returns
         -------
-        list
-            List of filtered Measurement objects
+        mongoengine.QuerySet or Pandas.DataFrame
+            QuerySet (a lazy cursor over Measurement objects) or DataFrame of the matching measurements
         """
-        if requested_type == "continuous":
-            return [x for x in self.measurements if type(x) == ContinuousMeasurement]
-        if requested_type == "discrete":
-            return [x for x in self.measurements if type(x) == DiscreteMeasurement]
-        if requested_type == "complex":
-            return [x for x in self.measurements if type(x) == ComplexMeasurement]
-        raise ValueError("request_type must be one of: 'continuous', 'discrete', or 'complex'")
-
-
-
+        documents = {"continuous": ContinuousMeasurement,
+                     "discrete": DiscreteMeasurement,
+                     "complex": ComplexMeasurement}
+        if requested_type not in documents:
+            raise ValueError("request_type must be one of: 'continuous', 'discrete', or 'complex'")
+        document = documents.get(requested_type)
+        query = {"patientId": self.patientId, "_cls": document._class_name}
+        if name is not None:
+            query["name"] = {"$in": list(name)} if isinstance(name, (list, tuple, set)) else name
+        dates = dict()
+        if start_date is not None:
+            dates["$gte"] = _query_datetime(start_date)
+        if end_date is not None:
+            dates["$lte"] = _query_datetime(end_date)
+        if dates:
+            query["date"] = dates
+        if not as_dataframe:
+            queryset = document.objects(__raw__=query)
+            return queryset if fields is None else queryset.only(*fields)
+        projection = None if fields is None else {field: 1 for field in fields}
+        cursor = document._get_collection().find(query, projection)
+        df = pd.DataFrame(list(cursor), columns=None if fields is None else ["_id"] + list(fields))
+        return df.drop(columns=["_cls"], errors="ignore")
@@ -0,0 +1,204 @@
+from warnings import warn
+import numpy as np
+import hashlib
+import json
+import os
+
+
+def sidecar_directory(target_directory: str) -> str:
+    """
+    Path of the sidecar directory that accompanies a target directory e.g. "/data/extracts" ->
+    "/data/extracts.bevan". Sidecar files are written here rather than inside the target directory so that they are
+    never mistaken for target files.
+
+    Parameters
+    ----------
+    target_directory: str
+
+    Returns
+    -------
+    str
+    """
+    return f"{os.path.abspath(target_directory).rstrip(os.sep)}.bevan"
+
+
+def content_hash(path: str,
+                 block_size: int = 2 ** 20) -> str:
+    """
+    Hash the contents of a file (BLAKE2b), reading in blocks so memory usage is bounded
+
+    Parameters
+    ----------
+    path: str
+    block_size: int, (default = 1MB)
+
+    Returns
+    -------
+    str
+        Hex digest
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: str) -> dict:
+    """
+    Cheap fingerprint of a file: size in bytes and modification time in nanoseconds
+
+    Parameters
+    ----------
+    path: str
+
+    Returns
+    -------
+    dict
+        {"size": int, "mtime": int}
+    """
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+class PatientIndexStore:
+    """
+    Persistent store of per-file patient indexes, written as a sidecar to the target directory. For each file the
+    index is stored as three arrays (see populate_from_tabular._index_patient_rows): unique patient IDs, offsets and
+    row positions, the latter two being memory-mapped on load. A JSON manifest records, for each file, its size,
+    modification time and content hash along with the identifier column it was indexed on.
+
+    An index is reused if the size and modification time of the file are unchanged. If only the modification time
+    has changed, the content hash is recomputed and the index is reused if the contents are unchanged. Otherwise
+    the file must be re-indexed.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to write index files to, created if it does not exist
+    """
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._manifest_path = os.path.join(directory, "manifest.json")
+        self._manifest = dict()
+        if os.path.isfile(self._manifest_path):
+            try:
+                with open(self._manifest_path, "r") as f:
+                    self._manifest = json.load(f)
+            except ValueError:
+                warn(f"Patient index manifest {self._manifest_path} is corrupt and will be rebuilt")
+
+    @staticmethod
+    def _key(filename: str) -> str:
+        return hashlib.blake2b(filename.encode("utf-8"), digest_size=8).hexdigest()
+
+    def _array_paths(self, filename: str) -> dict:
+        key = self._key(filename)
+        return {name: os.path.join(self.directory, f"{key}.{name}.npy") for name in ["ids", "offsets", "positions"]}
+
+    def _write_manifest(self):
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def is_current(self,
+                   filename: str,
+                   path: str,
+                   id_column: str) -> bool:
+        """
+        Check if a valid index exists for the given file
+
+        Parameters
+        ----------
+        filename: str
+            Name of the target file
+        path: str
+            Path to the target file
+        id_column: str
+            Patient identifier column
+
+        Returns
+        -------
+        bool
+        """
+        entry = self._manifest.get(filename)
+        if entry is None or entry.get("id_column") != id_column:
+            return False
+        if not all(os.path.isfile(p) for p in self._array_paths(filename).values()):
+            return False
+        fingerprint = file_fingerprint(path)
+        if fingerprint.get("size") != entry.get("size"):
+            return False
+        if fingerprint.get("mtime") == entry.get("mtime"):
+            return True
+        if content_hash(path) != entry.get("hash"):
+            return False
+        entry["mtime"] = fingerprint.get("mtime")
+        self._write_manifest()
+        return True
+
+    def load(self,
+             filename: str,
+             path: str,
+             id_column: str) -> tuple or None:
+        """
+        Load the stored index for a file if it is current, otherwise return None
+
+        Parameters
+        ----------
+        filename: str
+            Name of the target file
+        path: str
+            Path to the target file
+        id_column: str
+            Patient identifier column
+
+        Returns
+        -------
+        tuple or None
+            (unique patient IDs, offsets, positions)
+        """
+        if not self.is_current(filename=filename, path=path, id_column=id_column):
+            return None
+        paths = self._array_paths(filename)
+        return (np.load(paths.get("ids")),
+                np.load(paths.get("offsets"), mmap_mode="r"),
+                np.load(paths.get("positions"), mmap_mode="r"))
+
+    def save(self,
+             filename: str,
+             path: str,
+             id_column: str,
+             pt_ids: np.ndarray,
+             offsets: np.ndarray,
+             positions: np.ndarray):
+        """
+        Store the index for a file and record its fingerprint in the manifest
+
+        Parameters
+        ----------
+        filename: str
+            Name of the target file
+        path: str
+            Path to the target file
+        id_column: str
+            Patient identifier column
+        pt_ids: Numpy.Array
+            Unique patient IDs
+        offsets: Numpy.Array
+        positions: Numpy.Array
+
+        Returns
+        -------
+        None
+        """
+        paths = self._array_paths(filename)
+        for name, values in zip(["ids", "offsets", "positions"], [pt_ids, offsets, positions]):
+            np.save(paths.get(name), np.asarray(values))
+        entry = file_fingerprint(path)
+        entry["hash"] = content_hash(path)
+        entry["id_column"] = id_column
+        self._manifest[filename] = entry
+        self._write_manifest()
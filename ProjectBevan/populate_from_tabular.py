@@ -1,12 +1,25 @@
-from .nosql.patient import Patient
+from .nosql.patient import Patient, Comorbidity, comorbidity_index
+from .nosql.measurement import ContinuousMeasurement, DiscreteMeasurement, ComplexMeasurement, Measurement
+from .nosql.event import Event
+from .nosql.bulk import BulkWriter, ReferenceBulkWriter, push_references
+from .sql.bulk import bulk_insert, bulk_insert_dataframe
 from .config import GlobalConfig
-from .utilities import parse_datetime, progress_bar, verbose_print
-from Levenshtein import distance as levenshtein_distance
+from .cache import DataFrameCache
+from .columns import ColumnRoleResolver
+from .fuzzy import BKTree
+from .patient_index import PatientIndexStore, sidecar_directory, file_fingerprint
+from .ingest import IngestManifest, row_keys, stage_key
+from .checkpoint import CheckpointStore
+from .staging import ParquetStagingStore, stage_file
+from .utilities import parse_datetime_series, iso_date_series, progress_bar, verbose_print
 from multiprocessing import Pool, cpu_count
 from collections import defaultdict
 from functools import partial
 from warnings import warn
 import pandas as pd
+import numpy as np
+import json
+import time
 import os
 import re
 
@@ -47,12 +60,122 @@ def _load_dataframe(path: str,
         raise ValueError(f'Failed parsing {path}; {e}')
 
 
+def _index_patient_rows(pt_ids: pd.Series) -> tuple:
+    """
+    Given the patient identifier column of a single file, group row positions by patient in one vectorised pass
+    (sort-and-split on the factorised identifiers). Missing identifiers are dropped.
+
+    Parameters
+    ----------
+    pt_ids: Pandas.Series
+        Patient identifier column
+
+    Returns
+    -------
+    tuple
+        (unique patient IDs as strings, offsets, positions) where the rows of patient i are given by
+        positions[offsets[i]:offsets[i + 1]]
+    """
+    pt_ids = pt_ids.dropna()
+    codes, uniques = pd.factorize(pt_ids.astype(str).values)
+    order = np.argsort(codes, kind="stable")
+    offsets = np.zeros(len(uniques) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(codes, minlength=len(uniques)), out=offsets[1:])
+    positions = pt_ids.index.values[order].astype(np.int64)
+    return np.asarray(uniques, dtype=str), offsets, positions
+
+
 def _pt_idx_multiprocess_task(file_properties: tuple, id_column: str):
     filename, file_properties = file_properties
     pt_ids = _load_dataframe(path=file_properties.get("path"),
                              filetype=file_properties.get("type"),
                              usecols=[id_column])[id_column]
-    return {str(_id): {filename: pt_ids[pt_ids == _id].index} for _id in pt_ids}
+    return (filename, *_index_patient_rows(pt_ids))
+
+
+def _stage_multiprocess_task(job: tuple,
+                             id_column: str,
+                             row_group_size: int) -> tuple:
+    filename, file_properties, destination = job
+    try:
+        df = _load_dataframe(path=file_properties.get("path"), filetype=file_properties.get("type"))
+        stage_file(df, destination=destination, id_column=id_column, row_group_size=row_group_size)
+    except (ValueError, TypeError) as e:
+        return filename, str(e)
+    return filename, None
+
+
+def _correct_ages(df: pd.DataFrame,
+                  id_column: str,
+                  age_column: str,
+                  ages: dict) -> pd.DataFrame:
+    """
+    Replace the age column of a DataFrame with the corrected age of the patient on each row
+
+    Parameters
+    ----------
+    df: Pandas.DataFrame
+    id_column: str
+    age_column: str
+    ages: dict
+        Patient ID (as string) and corrected age
+
+    Returns
+    -------
+    Pandas.DataFrame
+    """
+    pt_ids = df[id_column].astype(str).where(df[id_column].notna())
+    missing = pt_ids[~pt_ids.isin(ages.keys())].unique().tolist()
+    assert len(missing) == 0, f"No age value found for {missing}"
+    df[age_column] = pt_ids.map(ages).values
+    return df
+
+
+def _age_correction_task(job: tuple,
+                         id_column: str,
+                         ages: dict,
+                         chunksize: int):
+    """
+    Rewrite the age column of a single target file with corrected ages. CSV files are streamed in chunks of
+    chunksize rows, so memory usage is bounded; Excel files cannot be read incrementally and are rewritten whole.
+    The output is written to a temporary file and moved into place once complete.
+
+    Parameters
+    ----------
+    job: tuple
+        (filename, filetype, source path, destination path, age column)
+    id_column: str
+    ages: dict
+        Patient ID (as string) and corrected age
+    chunksize: int
+
+    Returns
+    -------
+    str
+        filename
+    """
+    filename, filetype, source, destination, age_column = job
+    root, ext = os.path.splitext(destination)
+    tmp_path = f"{root}.tmp{ext}"
+    try:
+        if filetype == "csv":
+            header = True
+            for chunk in _load_dataframe(path=source, filetype="csv", chunksize=chunksize):
+                _correct_ages(chunk, id_column, age_column, ages).to_csv(tmp_path,
+                                                                         mode="w" if header else "a",
+                                                                         header=header,
+                                                                         index=False)
+                header = False
+            if header:
+                _load_dataframe(path=source, filetype="csv", nrows=0).to_csv(tmp_path, index=False)
+        else:
+            df = _load_dataframe(path=source, filetype=filetype)
+            _correct_ages(df, id_column, age_column, ages).to_excel(tmp_path, index=False)
+        os.replace(tmp_path, destination)
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+    return filename
 
 
 class Populate:
@@ -73,26 +196,61 @@ class Populate:
         multiple files.
         "raise" - throws ValueError
         "ignore" - ignored and patient is skipped, but event is logged
+    verbose: bool, (default = True)
+        If True, print progress to stdout
+    cache_size: int, (default = 1024)
+        Memory budget, in megabytes, for the in-process cache of parsed target files (see cache.DataFrameCache).
+        Least recently used files are evicted once the budget is exceeded. Set to 0 to disable caching.
+    persist_index: bool, (default = True)
+        If True, patient indexes are saved to a sidecar directory next to the target directory
+        ("<target_directory>.bevan") and reused on subsequent runs for any file whose size, modification time or
+        content is unchanged (see patient_index.PatientIndexStore)
+    staging: bool, (default = False)
+        If True, each target file is converted to Parquet, sorted and row-grouped by patient identifier (see
+        staging.ParquetStagingStore), and all subsequent reads are served from the Parquet copy: per-patient reads
+        only touch the row groups containing that patient. Requires the optional dependency pyarrow. Files that
+        cannot be converted are read from the original file, with a warning.
+    staging_directory: str, optional
+        Directory for Parquet files, defaults to "staging" within the sidecar directory
+    reuse_staging: bool, (default = True)
+        If True, an existing staged copy is reused for any file whose size, modification time or content is
+        unchanged, otherwise all files are staged again
+    row_group_size: int, (default = 10000)
+        Number of rows per Parquet row group
     """
     def __init__(self,
                  config: GlobalConfig,
                  target_directory: str,
                  id_column: str,
                  conflicts: str = "raise",
-                 verbose: bool = True):
+                 verbose: bool = True,
+                 cache_size: int = 1024,
+                 persist_index: bool = True,
+                 staging: bool = False,
+                 staging_directory: str or None = None,
+                 reuse_staging: bool = True,
+                 row_group_size: int = 10000):
         assert os.path.isdir(target_directory), f"Target directory {target_directory} does not exist!"
         self._verbose = verbose
         self._vprint = verbose_print(verbose)
         self._config = config
+        self._cache = DataFrameCache(max_bytes=int(cache_size * 1024 ** 2))
+        self._parse_stats = dict(files=0, columns=0, bytes=0)
+        self._sidecar = sidecar_directory(target_directory)
+        self._persist_index = persist_index
         self._files = self._parse_files(target_directory)
         self._id_column = self._check_id_column(id_column=id_column)
+        self._staging = None
+        if staging:
+            self._staging = self._stage_files(directory=staging_directory or os.path.join(self._sidecar, "staging"),
+                                              reuse=reuse_staging,
+                                              row_group_size=row_group_size)
+        self._column_roles = ColumnRoleResolver()
         self._patients = self._patient_indexes()
         self.conflicts = conflicts
-        if self._config.db_type == "sql":
-            if self._config.db_type == "nosql":
-                curr = self._config.db_connection.cursor()
-                self._comorb_keys = curr.execute("SELECT comorb_name FROM ComorbKey;").fetchall()
-
+        self._comorb_index = None
+        self._ingest = None
+        self._checkpoints = None
 
     @property
     def conflicts(self):
@@ -103,6 +261,30 @@ class Populate:
         assert value in ["raise", "ignore"], "Invalid value, must be 'raise' or 'ignore'"
         self._conflicts = value
 
+    def cache_info(self) -> dict:
+        """
+        Hit, miss and eviction counters for the cache of parsed target files, alongside current and maximum
+        memory usage (bytes)
+
+        Returns
+        -------
+        dict
+        """
+        return self._cache.info()
+
+    def parse_info(self) -> dict:
+        """
+        Running totals of target file reads that missed the cache: number of reads, number of columns parsed and
+        bytes parsed (in-memory size of the resulting DataFrames). Compare before and after a stage (e.g.
+        add_patients) to measure the data it parsed.
+
+        Returns
+        -------
+        dict
+            {"files", "columns", "bytes"}
+        """
+        return dict(self._parse_stats)
+
     @staticmethod
     def _parse_files(target_directory: str) -> dict:
         """
@@ -153,29 +335,80 @@ class Populate:
                                       filetype=properties.get("type"),
                                       nrows=3)
             assert id_column in temp_df.columns, f"{name} does not contain primary id column {id_column}"
+            properties["columns"] = list(temp_df.columns)
         return id_column
 
-    @staticmethod
-    def _filter_columns(columns: list,
-                        regex_terms: list):
+    def _set_search_roles(self, search_terms: dict):
+        """
+        Register the column search terms for age, gender and COVID-19 status with the column role resolver
+        (see columns.ColumnRoleResolver); a no-op if the terms are unchanged
+
+        Parameters
+        ----------
+        search_terms: dict
+            See _fetch_patient_basics
+
+        Returns
+        -------
+        None
         """
-        Given the list of columns in a DataFrame and a list of regular expression patterns to be used as search terms,
-        return the filtered list of columns such that only columns that match one or more of the search terms are kept
+        for role in ["age", "gender", "covid"]:
+            self._column_roles.set_role(role, search_terms.get(f"{role}_search_terms"))
+
+    def _role_columns(self,
+                      columns: list,
+                      role: str) -> list:
+        """
+        Given the columns of a target file, return those matching the given role, excluding the identifier column
 
         Parameters
         ----------
         columns: list
             List of column names
-        regex_terms: list
-            List of regex search term patterns
+        role: str
+            Role registered with the column role resolver e.g. "age"
 
         Returns
         -------
         list
             Filtered list of column names
         """
-        return list(filter(lambda x: any([re.match(pattern=p, string=x, flags=re.IGNORECASE) for p in regex_terms]),
-                           columns))
+        return [c for c in self._column_roles.columns(columns=columns, role=role) if c != self._id_column]
+
+    def _file_role_columns(self,
+                           filename: str,
+                           role: str,
+                           columns: list or None = None) -> list:
+        """
+        Columns of a target file matching the given role, excluding the identifier column. The role map of each file
+        is resolved from its header once (and again only if search terms change) and stored with the header in
+        self._files, so per-patient lookups do no column matching.
+
+        Parameters
+        ----------
+        filename: str
+            Name of target file (key of self._files)
+        role: str
+            Role registered with the column role resolver e.g. "age"
+        columns: list, optional
+            Columns of the loaded DataFrame, used if the header of the file is unknown
+
+        Returns
+        -------
+        list
+        """
+        properties = self._files.get(filename)
+        header = properties.get("columns")
+        if header is None:
+            return self._role_columns(columns=columns, role=role)
+        version, roles = properties.get("roles", (None, None))
+        if version != self._column_roles.version:
+            version = self._column_roles.version
+            roles = {key: [c for c in values if c != self._id_column]
+                     for key, values in self._column_roles.resolve(header).items()}
+            properties["roles"] = (version, roles)
+        assert role in roles, f"No search terms registered for role {role}"
+        return roles.get(role)
 
     def _patient_indexes(self):
         """
@@ -190,67 +423,224 @@ class Populate:
         """
         # Search through every file and generate a dictionary of unique patient indexes
         self._vprint("----- Caching patient identifiers -----")
-        cores = cpu_count()
-        self._vprint(f"...processing across {cores} cores")
-        idx_func = partial(_pt_idx_multiprocess_task, id_column=self._id_column)
-        pool = Pool(cores)
-        patient_idx_list = progress_bar(pool.imap(idx_func, self._files.items()), verbose=self._verbose, total=len(self._files))
+        file_indexes = dict()
+        stale = self._files
+        store = None
+        if self._persist_index:
+            try:
+                store = PatientIndexStore(os.path.join(self._sidecar, "patient_index"))
+            except OSError as e:
+                warn(f"Unable to create patient index sidecar in {self._sidecar}, index will not be persisted; {e}")
+        if store is not None:
+            for filename, properties in self._files.items():
+                idx = store.load(filename=filename, path=properties.get("path"), id_column=self._id_column)
+                if idx is not None:
+                    file_indexes[filename] = idx
+            stale = {name: properties for name, properties in self._files.items() if name not in file_indexes}
+            self._vprint(f"...reusing stored index for {len(file_indexes)} of {len(self._files)} files")
+        if stale:
+            cores = cpu_count()
+            self._vprint(f"...processing across {cores} cores")
+            idx_func = partial(_pt_idx_multiprocess_task, id_column=self._id_column)
+            with Pool(cores) as pool:
+                for filename, *idx in progress_bar(pool.imap(idx_func, stale.items()),
+                                                   verbose=self._verbose,
+                                                   total=len(stale)):
+                    file_indexes[filename] = idx
+                    if store is not None:
+                        store.save(filename, stale[filename].get("path"), self._id_column, *idx)
         patient_idx = defaultdict(dict)
-        for pt_file_idx in patient_idx_list:
-            for pt, file_idx in pt_file_idx.items():
-                for filename, idx in file_idx.items():
-                    patient_idx[pt][filename] = idx
+        for filename in self._files.keys():
+            pt_ids, offsets, positions = file_indexes.get(filename)
+            for pt, idx in zip(pt_ids.tolist(), np.split(positions, offsets[1:-1])):
+                patient_idx[pt][filename] = idx
         return patient_idx
 
-    def _load_pt_dataframe(self, patient_id: str):
+    def _stage_files(self,
+                     directory: str,
+                     reuse: bool,
+                     row_group_size: int) -> ParquetStagingStore:
+        """
+        Convert target files to Parquet (see staging.stage_file) in parallel, skipping files with a current staged
+        copy if reuse is True
+
+        Parameters
+        ----------
+        directory: str
+        reuse: bool
+        row_group_size: int
+
+        Returns
+        -------
+        ParquetStagingStore
+        """
+        self._vprint("----- Staging target files as Parquet -----")
+        store = ParquetStagingStore(directory)
+        stale = {name: properties for name, properties in self._files.items()
+                 if not (reuse and store.is_current(filename=name,
+                                                    path=properties.get("path"),
+                                                    id_column=self._id_column))}
+        self._vprint(f"...reusing staged copy of {len(self._files) - len(stale)} of {len(self._files)} files")
+        if stale:
+            jobs = [(name, properties, store.path(name)) for name, properties in stale.items()]
+            task = partial(_stage_multiprocess_task, id_column=self._id_column, row_group_size=row_group_size)
+            with Pool(min(cpu_count(), len(jobs))) as pool:
+                for filename, err in progress_bar(pool.imap(task, jobs), verbose=self._verbose, total=len(jobs)):
+                    if err is not None:
+                        warn(f"Unable to stage {filename}, the original file will be read instead; {err}")
+                        store.discard(filename)
+                        continue
+                    store.record(filename=filename, path=stale[filename].get("path"), id_column=self._id_column)
+        return store
+
+    def _is_staged(self, filename: str) -> bool:
+        return self._staging is not None and filename in self._staging
+
+    def _read_file(self,
+                   filename: str,
+                   columns: list or None = None,
+                   patient_id: str or None = None) -> pd.DataFrame:
+        """
+        Parse a target file (from its staged Parquet copy if there is one), bypassing the cache, and record the
+        data parsed (see parse_info)
+
+        Parameters
+        ----------
+        filename: str
+            Name of target file (key of self._files)
+        columns: list, optional
+            Columns to parse, if None, all columns are parsed
+        patient_id: str, optional
+            Staged files only. If given, only the rows of this patient are parsed
+
+        Returns
+        -------
+        Pandas.DataFrame
+        """
+        if self._is_staged(filename):
+            df = self._staging.read(filename=filename, columns=columns, patient_id=patient_id)
+        else:
+            properties = self._files.get(filename)
+            df = _load_dataframe(path=properties.get("path"), filetype=properties.get("type"), usecols=columns)
+        self._parse_stats["files"] += 1
+        self._parse_stats["columns"] += df.shape[1]
+        self._parse_stats["bytes"] += int(df.memory_usage(deep=True).sum())
+        return df
+
+    def _projection(self,
+                    filename: str,
+                    role: str or None = None,
+                    columns: list or None = None) -> list or None:
+        """
+        Columns of a target file needed by a caller: the identifier column, columns matching role and any
+        columns given that are present in the file, in file order. Returns None (all columns) if neither role nor
+        columns are given or the header of the file is unknown.
+        """
+        header = self._files.get(filename).get("columns")
+        if header is None or (role is None and columns is None):
+            return None
+        wanted = {self._id_column} | set(columns or [])
+        if role is not None:
+            wanted.update(self._file_role_columns(filename, role=role))
+        return [c for c in header if c in wanted]
+
+    def _load_file(self,
+                   filename: str,
+                   columns: list or None = None) -> pd.DataFrame:
+        """
+        Load a target file via the DataFrame cache; the returned DataFrame is shared and must not be
+        modified in place. If columns are given, only those columns are parsed (projection pushdown) and the
+        projection is cached separately; if the whole file is already cached the columns are selected from it.
+
+        Parameters
+        ----------
+        filename: str
+            Name of target file (key of self._files)
+        columns: list, optional
+            Columns to load, if None, all columns are loaded
+
+        Returns
+        -------
+        Pandas.DataFrame
+        """
+        if columns is None:
+            return self._cache.get(filename, partial(self._read_file, filename=filename))
+        if filename in self._cache:
+            return self._cache.get(filename, partial(self._read_file, filename=filename))[columns]
+        return self._cache.get((filename, tuple(columns)), partial(self._read_file,
+                                                                   filename=filename,
+                                                                   columns=list(columns)))
+
+    def _discard_file(self, filename: str):
+        """
+        Remove a target file, and all projections of it, from the cache
+        """
+        for key in self._cache.keys():
+            if key == filename or (isinstance(key, tuple) and key[0] == filename):
+                self._cache.discard(key)
+
+    def _load_pt_dataframe(self,
+                           patient_id: str,
+                           role: str or None = None,
+                           columns: list or None = None):
         """
         For a given patient ID, yield the DataFrame for each target file, filtered to contain only rows that
-        correspond to the given patient. Only yields DataFrames with 1 or more rows.
+        correspond to the given patient. Only yields DataFrames with 1 or more rows. Staged files that are not
+        already cached are read with a patient filter, touching only the row groups containing that patient.
+
+        If role and/or columns are given, only the identifier column, the columns matching role and the given
+        columns are parsed (see _projection), and files with no columns matching role are skipped.
 
         Parameters
         ----------
         patient_id: str
+        role: str, optional
+            Column role e.g. "age" (see _set_search_roles)
+        columns: list, optional
+            Additional columns required
 
         Returns
         -------
         Pandas.DataFrame
         """
         patient_idx = self._patients.get(patient_id)
-        for name, properties in self._files.items():
+        for name in self._files.keys():
             if name not in patient_idx.keys():
                 continue
-            df = _load_dataframe(path=properties.get("path"),
-                                 filetype=properties.get("type"),
-                                 index=patient_idx.get(name))
-            yield name, df
+            projection = self._projection(name, role=role, columns=columns)
+            if role is not None and projection is not None and len(self._file_role_columns(name, role=role)) == 0:
+                continue
+            if self._is_staged(name) and name not in self._cache:
+                yield name, self._read_file(filename=name, columns=projection, patient_id=patient_id)
+                continue
+            yield name, self._load_file(name, columns=projection).loc[patient_idx.get(name)]
 
     def _pt_search_multi(self,
                          patient_id: str,
-                         column_search_terms: list) -> list or None:
+                         role: str) -> list or None:
         """
-        Use when expecting a multi-value output. Iterates over all target files and given a patient ID and a list
-        of regex search patterns, loads the DataFrame for the given patient for each file, filters to keep only
-        columns matching the search patterns, and returns all unique values for columns across all files.
+        Use when expecting a multi-value output. Iterates over all target files and given a patient ID and a column
+        role, loads the DataFrame for the given patient for each file, filters to keep only columns matching the
+        role, and returns all unique values for columns across all files.
 
         Parameters
         ----------
         patient_id: str
             Patient identifier
-        column_search_terms: list
-            List of regular expressions
+        role: str
+            Column role e.g. "covid" (see _set_search_roles)
         Returns
         -------
         list or None
             If 1 or more values found, return list of unique values, else return None
         """
         all_values = dict()
-        for filename, df in self._load_pt_dataframe(patient_id=patient_id):
-            columns = self._filter_columns(columns=df.columns,
-                                           regex_terms=column_search_terms)
-            file_values = df[columns].values.flatten()
+        for filename, df in self._load_pt_dataframe(patient_id=patient_id, role=role):
+            columns = self._file_role_columns(filename, role=role, columns=df.columns)
+            file_values = pd.unique(pd.Series(df[columns].values.flatten()).dropna())
             if len(file_values) == 0:
                 continue
-            all_values[filename] = list(set(file_values))
+            all_values[filename] = list(file_values)
         unique_values = list(set([v for nested in all_values.values() for v in nested]))
         if len(unique_values) == 0:
             return None
@@ -258,25 +648,22 @@ class Populate:
 
     def _pt_search(self,
                    patient_id: str,
-                   column_search_terms: list,
-                   variable_name: str) -> str or int or float or None:
+                   role: str) -> str or int or float or None:
         """
-        Use when expecting a singular value returned. Iterates over all target files and given a patient ID and a list
-        of regex search patterns, loads the DataFrame for the given patient for each file, filters to keep only
-        columns matching the search patterns, and returns all unique values for columns across all files.
+        Use when expecting a singular value returned. Iterates over all target files and given a patient ID and a
+        column role, loads the DataFrame for the given patient for each file, filters to keep only columns matching
+        the role, and returns all unique values for columns across all files.
 
-        Expects that, once removing duplicates, only one unique value will remain. If more than one value is found
-        for the chosen columns across all DataFrames, will throw a ValueError if conflicts setting = "raise". If
-        conflicts setting = "ignore", will return None.
+        Expects that, once removing duplicates and missing values, only one unique value will remain. If more than one
+        value is found for the chosen columns across all DataFrames, will throw a ValueError if conflicts setting =
+        "raise". If conflicts setting = "ignore", will return None.
 
         Parameters
         ----------
         patient_id: str
             Patient identifier
-        column_search_terms: list
-             List of regular expressions
-        variable_name: str
-            Common name of the variable being searched for, used for error logging.
+        role: str
+            Column role e.g. "age" (see _set_search_roles), also used as the variable name for error logging
 
         Returns
         -------
@@ -285,14 +672,13 @@ class Populate:
             single value of variable type
         """
         all_values = dict()
-        for filename, df in self._load_pt_dataframe(patient_id=patient_id):
-            columns = self._filter_columns(columns=df.columns,
-                                           regex_terms=column_search_terms)
-            file_values = df[columns].values.flatten()
+        for filename, df in self._load_pt_dataframe(patient_id=patient_id, role=role):
+            columns = self._file_role_columns(filename, role=role, columns=df.columns)
+            file_values = pd.unique(pd.Series(df[columns].values.flatten()).dropna())
             if len(file_values) == 0:
                 continue
-            if len(set(file_values)) > 1:
-                err = f"Conflicting {variable_name} values found for patient {patient_id} in file {filename}, " \
+            if len(file_values) > 1:
+                err = f"Conflicting {role} values found for patient {patient_id} in file {filename}, " \
                       f"if conflict option set to ignore, this file will be ignored from this process"
                 self._config.write_to_log(err)
                 if self.conflicts == "raise":
@@ -301,8 +687,8 @@ class Populate:
                 all_values[filename] = file_values[0]
         n_unique = len(set(all_values.values()))
         if n_unique > 1:
-            err = f"Conflicting {variable_name} values found for patient {patient_id}. " \
-                  f"{variable_name} registered in each file: {all_values}"
+            err = f"Conflicting {role} values found for patient {patient_id}. " \
+                  f"{role} registered in each file: {all_values}"
             self._config.write_to_log(err)
             if self.conflicts == "raise":
                 raise ValueError(err)
@@ -334,12 +720,14 @@ class Populate:
         death_file = death_options.get("death_file")
         death_column = death_options.get("death_column")
         search_terms = death_options.get("search_terms")
-        files = [(filename, df) for filename, df in self._load_pt_dataframe(patient_id=patient_id)
+        files = [(filename, df) for filename, df in self._load_pt_dataframe(patient_id=patient_id,
+                                                                           columns=[death_column])
                  if death_file.lower() in filename.lower()]
         if len(files) == 0:
             return 0
         for filename, df in files:
-            if any(re.match(pattern=st, string=df[death_column].values, flags=re.IGNORECASE) for st in search_terms):
+            if any(re.match(pattern=st, string=str(x), flags=re.IGNORECASE)
+                   for st in search_terms for x in df[death_column].values):
                 return 1
         return 0
 
@@ -356,7 +744,7 @@ class Populate:
         critical_care_options: dict
             Dictionary of specific options, keys and values as follows:
                 critical_care_file - which target file to search for events of critical care admission
-                presence_infers_positivity - if True, the presence of the patient in the target file is
+                critical_care_presence_infers_positivity - if True, the presence of the patient in the target file is
                 inferred as being positive for "critical care admission"
                 critical_care_column - if presence_infers_positivity is False, this is the column in the target file
                 that is searched for a positive value as specified by critical_care_pos_value
@@ -369,18 +757,19 @@ class Populate:
             1 if critical care admission is found, else 0
         """
         critical_care_file = critical_care_options.get("critical_care_file")
-        presence_infers_positivity = critical_care_options.get("presence_infers_positivity")
+        presence_infers_positivity = critical_care_options.get("critical_care_presence_infers_positivity")
         critical_care_column = critical_care_options.get("critical_care_column")
         critical_care_pos_value = critical_care_options.get("critical_care_pos_value")
 
-        files = [(filename, df) for filename, df in self._load_pt_dataframe(patient_id=patient_id)
+        columns = [] if presence_infers_positivity else [critical_care_column]
+        files = [(filename, df) for filename, df in self._load_pt_dataframe(patient_id=patient_id, columns=columns)
                  if critical_care_file.lower() in filename.lower()]
         if presence_infers_positivity and len(files) > 0:
             return 1
         elif critical_care_pos_value is None or critical_care_column is None:
             raise ValueError("If presence_infers_positivity is False, pos_value and column name must be given")
         else:
-            files = list(filter(lambda x: critical_care_pos_value in x[1][critical_care_column], files))
+            files = list(filter(lambda x: (x[1][critical_care_column] == critical_care_pos_value).any(), files))
             if len(files) >= 1:
                 return 1
         return 0
@@ -422,61 +811,374 @@ class Populate:
         dict
             Returns dictionary of basic results
         """
+        self._set_search_roles(search_terms)
         # Fetch age
-        age = self._pt_search(patient_id=patient_id,
-                              column_search_terms=search_terms.get("age_search_terms"),
-                              variable_name="age")
+        age = self._pt_search(patient_id=patient_id, role="age")
 
         # Determine if patient has ever stayed in critical care during admission
         critical_care_stay = self._patient_critical_care_stay(patient_id=patient_id,
                                                               critical_care_options=critical_care_options)
 
         # Fetch gender
-        gender = self._pt_search(patient_id=patient_id,
-                                 column_search_terms=search_terms.get("gender_search_terms"),
-                                 variable_name="gender")
+        gender = self._pt_search(patient_id=patient_id, role="gender")
         # Process gender
         if gender is not None:
-            if type(gender) == float:
-                gender = int(gender)
-            if type(gender) == int:
-                if gender not in gender_int_mappings.keys():
-                    raise ValueError(f"Gender returned value {gender} for patient {patient_id}, but value not present "
-                                     f"in given mappings")
-                gender = gender_int_mappings[gender]
-            elif re.match(pattern="m[ale]*", string=gender, flags=re.IGNORECASE):
-                gender = "M"
-            elif re.match(pattern="f[emale]*", string=gender, flags=re.IGNORECASE):
-                gender = "F"
-            else:
-                gender = "U"
+            gender = self._process_gender(gender=gender,
+                                          patient_id=patient_id,
+                                          gender_int_mappings=gender_int_mappings)
 
         # Fetch covid status
-        covid = self._pt_search_multi(patient_id=patient_id,
-                                      column_search_terms=search_terms.get("covid_search_terms"))
+        covid = self._pt_search_multi(patient_id=patient_id, role="covid")
         # Filter covid status and summarise
         cst = search_terms.get("covid_status_search_terms")
-        filtered_values = {status: list(filter(lambda x: any(re.match(pattern=p, string=x, flags=re.IGNORECASE)
-                                                             for p in patterns), covid))
-                           for status, patterns in cst.keys()}
-        if len(filtered_values["positive"]) == 0 and len(filtered_values["negative"]) >= 1:
-            covid_status = "N"
-        elif len(filtered_values["positive"]) > 0:
-            covid_status = "P"
-        else:
-            covid_status = "U"
+        statuses = [self._classify_covid_value(x, cst) for x in (covid or [])]
+        covid_status = self._summarise_covid_status(positive=any(s == "positive" for s in statuses),
+                                                    negative=any(s == "negative" for s in statuses))
 
         # Fetch events of death
         died = self._patient_death(patient_id=patient_id,
                                    death_options=death_options)
-        return dict(age=age, gender=gender, covid=covid_status, died=died, critical_care_stay=critical_care_stay)
+        return dict(age=age, gender=gender, covid=covid_status, died=died, criticalCareStay=critical_care_stay)
+
+    @staticmethod
+    def _process_gender(gender: str or int or float,
+                        patient_id: str,
+                        gender_int_mappings: dict) -> str:
+        """
+        Convert a raw gender value to "M", "F" or "U". Numeric values are converted using gender_int_mappings,
+        if the value is not present in the mappings a ValueError is raised.
+
+        Parameters
+        ----------
+        gender: str or int or float
+            Raw gender value
+        patient_id: str
+            Patient identifier, used for error reporting
+        gender_int_mappings: dict
+            Options to define how to handle interger values for gender, e.g. {1: "F", 0: "M"}
+
+        Returns
+        -------
+        str
+        """
+        if isinstance(gender, (float, np.floating)):
+            gender = int(gender)
+        if isinstance(gender, (int, np.integer)):
+            if gender not in gender_int_mappings.keys():
+                raise ValueError(f"Gender returned value {gender} for patient {patient_id}, but value not present "
+                                 f"in given mappings")
+            return gender_int_mappings[gender]
+        if re.match(pattern="m[ale]*", string=gender, flags=re.IGNORECASE):
+            return "M"
+        if re.match(pattern="f[emale]*", string=gender, flags=re.IGNORECASE):
+            return "F"
+        return "U"
+
+    @staticmethod
+    def _classify_covid_value(value,
+                              covid_status_search_terms: dict) -> str or None:
+        """
+        Classify a single COVID-19 status value as "positive" or "negative" (positive takes precedence) using the
+        given regular expression search terms.
+
+        Parameters
+        ----------
+        value
+            Raw COVID-19 status value
+        covid_status_search_terms: dict
+            See add_patients
+
+        Returns
+        -------
+        str or None
+            "positive", "negative" or None if neither matched
+        """
+        for status in ["positive", "negative"]:
+            if any(re.match(pattern=p, string=str(value), flags=re.IGNORECASE)
+                   for p in covid_status_search_terms.get(status, [])):
+                return status
+        return None
+
+    @staticmethod
+    def _summarise_covid_status(positive: bool,
+                                negative: bool) -> str:
+        if positive:
+            return "P"
+        if negative:
+            return "N"
+        return "U"
+
+    def _file_long_values(self,
+                          filename: str,
+                          role: str,
+                          patient_ids: set or None = None) -> pd.DataFrame or None:
+        """
+        For a single target file, return the values of all columns matching the given role in long format,
+        one row per patient and value, with missing values removed. The identifier column is converted to string
+        to match the keys of the patient index.
+
+        Parameters
+        ----------
+        filename: str
+            Name of the target file
+        role: str
+            Column role e.g. "covid" (see _set_search_roles)
+        patient_ids: set, optional
+            If given, only rows of these patients are returned
+
+        Returns
+        -------
+        Pandas.DataFrame or None
+            DataFrame with columns "patient_id" and "value", or None if no columns match
+        """
+        df = self._load_file(filename, columns=self._projection(filename, role=role))
+        columns = self._file_role_columns(filename, role=role, columns=df.columns)
+        if len(columns) == 0:
+            return None
+        values = self._filter_patients(df[[self._id_column] + columns].dropna(subset=[self._id_column]), patient_ids)
+        values = values.melt(id_vars=self._id_column, value_vars=columns)[[self._id_column, "value"]].dropna()
+        values.columns = ["patient_id", "value"]
+        values["patient_id"] = values["patient_id"].astype(str)
+        return values.drop_duplicates()
+
+    def _cohort_search(self,
+                       role: str,
+                       patient_ids: set or None = None) -> dict:
+        """
+        Whole-cohort equivalent of _pt_search. Each target file is scanned once and the number of unique values per
+        patient is found with a groupby, first within each file and then across files. Conflicts are handled
+        according to the conflicts setting exactly as in _pt_search.
+
+        Parameters
+        ----------
+        role: str
+            Column role e.g. "age" (see _set_search_roles), also used as the variable name for error logging
+        patient_ids: set, optional
+            If given, only these patients are searched
+
+        Returns
+        -------
+        dict
+            Patient ID and value for all patients with a single unique value; patients without a value are omitted
+        """
+        file_values = list()
+        for filename in self._files.keys():
+            values = self._file_long_values(filename=filename, role=role, patient_ids=patient_ids)
+            if values is None or values.shape[0] == 0:
+                continue
+            n_unique = values.groupby("patient_id")["value"].nunique()
+            for patient_id in n_unique[n_unique > 1].index:
+                err = f"Conflicting {role} values found for patient {patient_id} in file {filename}, " \
+                      f"if conflict option set to ignore, this file will be ignored from this process"
+                self._config.write_to_log(err)
+                if self.conflicts == "raise":
+                    raise ValueError(err)
+            values = values[values.patient_id.isin(n_unique[n_unique == 1].index)].drop_duplicates("patient_id")
+            values["filename"] = filename
+            file_values.append(values)
+        if len(file_values) == 0:
+            return dict()
+        file_values = pd.concat(file_values, ignore_index=True)
+        n_unique = file_values.groupby("patient_id")["value"].nunique()
+        for patient_id in n_unique[n_unique > 1].index:
+            pt_values = file_values[file_values.patient_id == patient_id]
+            err = f"Conflicting {role} values found for patient {patient_id}. " \
+                  f"{role} registered in each file: {dict(zip(pt_values.filename, pt_values.value))}"
+            self._config.write_to_log(err)
+            if self.conflicts == "raise":
+                raise ValueError(err)
+        file_values = file_values[file_values.patient_id.isin(n_unique[n_unique == 1].index)]
+        return file_values.drop_duplicates("patient_id").set_index("patient_id")["value"].to_dict()
+
+    def _cohort_death(self,
+                      death_options: dict,
+                      patient_ids: set or None = None) -> set:
+        """
+        Whole-cohort equivalent of _patient_death
+
+        Parameters
+        ----------
+        death_options: dict
+            See _patient_death
+        patient_ids: set, optional
+            If given, only these patients are searched
+
+        Returns
+        -------
+        set
+            Patient IDs with one or more events of death
+        """
+        death_column = death_options.get("death_column")
+        search_terms = death_options.get("search_terms")
+        died = set()
+        for filename in self._files.keys():
+            if death_options.get("death_file").lower() not in filename.lower():
+                continue
+            df = self._load_file(filename, columns=self._projection(filename, columns=[death_column]))
+            df = self._filter_patients(df.dropna(subset=[self._id_column]), patient_ids)
+            values = df[death_column].map(str)
+            matches = pd.Series(False, index=values.index)
+            for st in search_terms:
+                matches |= values.str.match(st, case=False)
+            died.update(df.loc[matches, self._id_column].astype(str))
+        return died
+
+    def _cohort_critical_care_stay(self,
+                                   critical_care_options: dict,
+                                   patient_ids: set or None = None) -> set:
+        """
+        Whole-cohort equivalent of _patient_critical_care_stay
+
+        Parameters
+        ----------
+        critical_care_options: dict
+            See _patient_critical_care_stay
+        patient_ids: set, optional
+            If given, only these patients are searched
+
+        Returns
+        -------
+        set
+            Patient IDs with one or more critical care admission
+        """
+        presence_infers_positivity = critical_care_options.get("critical_care_presence_infers_positivity")
+        critical_care_column = critical_care_options.get("critical_care_column")
+        critical_care_pos_value = critical_care_options.get("critical_care_pos_value")
+        if not presence_infers_positivity and (critical_care_pos_value is None or critical_care_column is None):
+            raise ValueError("If presence_infers_positivity is False, pos_value and column name must be given")
+        critical_care = set()
+        for filename in self._files.keys():
+            if critical_care_options.get("critical_care_file").lower() not in filename.lower():
+                continue
+            columns = [] if presence_infers_positivity else [critical_care_column]
+            df = self._load_file(filename, columns=self._projection(filename, columns=columns))
+            df = self._filter_patients(df.dropna(subset=[self._id_column]), patient_ids)
+            if not presence_infers_positivity:
+                df = df[df[critical_care_column] == critical_care_pos_value]
+            critical_care.update(df[self._id_column].astype(str))
+        return critical_care
+
+    def _fetch_cohort_basics(self,
+                             search_terms: dict,
+                             death_options: dict,
+                             gender_int_mappings: dict,
+                             critical_care_options: dict,
+                             patient_ids: set or None = None) -> dict:
+        """
+        Whole-cohort equivalent of _fetch_patient_basics. Rather than searching the target files once per patient,
+        every target file is loaded once and basic information for all patients (or the given patients) is computed
+        with vectorised groupby operations. Results and conflict handling are identical to calling
+        _fetch_patient_basics for each patient.
+
+        Parameters
+        ----------
+        search_terms: dict
+            See _fetch_patient_basics
+        death_options: dict
+            See _patient_death
+        gender_int_mappings: dict
+            See _fetch_patient_basics
+        critical_care_options: dict
+            See _patient_critical_care_stay
+        patient_ids: set, optional
+            If given, rows of other patients are dropped as each file is loaded and only these patients are returned
+
+        Returns
+        -------
+        dict
+            Dictionary of basic results (as returned by _fetch_patient_basics) for each patient ID
+        """
+        self._set_search_roles(search_terms)
+        age = self._cohort_search(role="age", patient_ids=patient_ids)
+        critical_care = self._cohort_critical_care_stay(critical_care_options=critical_care_options,
+                                                        patient_ids=patient_ids)
+        gender = self._cohort_search(role="gender", patient_ids=patient_ids)
+        gender_values = dict()
+        for patient_id, value in gender.items():
+            if value not in gender_values:
+                gender_values[value] = self._process_gender(gender=value,
+                                                            patient_id=patient_id,
+                                                            gender_int_mappings=gender_int_mappings)
+        gender = {patient_id: gender_values[value] for patient_id, value in gender.items()}
+        # Classify each distinct COVID-19 status value once, then summarise per patient
+        cst = search_terms.get("covid_status_search_terms")
+        covid = [self._file_long_values(filename=f, role="covid", patient_ids=patient_ids) for f in self._files.keys()]
+        covid = [v for v in covid if v is not None]
+        covid_status = dict()
+        if covid:
+            covid = pd.concat(covid, ignore_index=True)
+            statuses = {value: self._classify_covid_value(value, cst) for value in covid.value.unique()}
+            covid["status"] = covid.value.map(statuses)
+            covid["positive"] = covid.status == "positive"
+            covid["negative"] = covid.status == "negative"
+            covid = covid.groupby("patient_id")[["positive", "negative"]].any()
+            covid_status = {patient_id: self._summarise_covid_status(positive=pos, negative=neg)
+                            for patient_id, pos, neg in zip(covid.index, covid["positive"], covid["negative"])}
+        died = self._cohort_death(death_options=death_options, patient_ids=patient_ids)
+        return {patient_id: dict(age=age.get(patient_id),
+                                 gender=gender.get(patient_id),
+                                 covid=covid_status.get(patient_id, "U"),
+                                 died=int(patient_id in died),
+                                 criticalCareStay=int(patient_id in critical_care))
+                for patient_id in (self._patients.keys() if patient_ids is None else patient_ids)}
+
+    def _filter_patients(self,
+                         df: pd.DataFrame,
+                         patient_ids: set or None) -> pd.DataFrame:
+        if patient_ids is None:
+            return df
+        return df[df[self._id_column].astype(str).isin(patient_ids)]
+
+    def _missing_patients(self,
+                          patient_ids: list,
+                          batch_size: int = 10000) -> list:
+        """
+        Find patient IDs that are not in the Patients document/table. IDs are deduplicated first and checked as a
+        set: NoSQL issues one {"_id": {"$in": [...]}} query per batch of batch_size IDs, SQL loads the IDs into a
+        temporary table and anti-joins it against Patients.
+
+        Parameters
+        ----------
+        patient_ids: list
+            List of patients to check, may contain duplicates and missing values (ignored)
+        batch_size: int, (default = 10000)
+            NoSQL only. Number of IDs per query
+
+        Returns
+        -------
+        list
+            Sorted list of missing patient IDs
+        """
+        patient_ids = pd.Series(patient_ids, dtype=object).dropna().map(str).unique().tolist()
+        if len(patient_ids) == 0:
+            return list()
+        if self._config.db_type == "nosql":
+            collection = Patient._get_collection()
+            missing = list()
+            for i in range(0, len(patient_ids), batch_size):
+                batch = patient_ids[i:i + batch_size]
+                found = {doc.get("_id") for doc in collection.find({"_id": {"$in": batch}}, {"_id": 1})}
+                missing.extend([x for x in batch if x not in found])
+            return sorted(missing)
+        connection = self._config.db_connection
+        with connection:
+            connection.execute("CREATE TEMP TABLE IF NOT EXISTS PatientIdCheck (patient_id TEXT PRIMARY KEY)")
+            connection.execute("DELETE FROM PatientIdCheck")
+            connection.executemany("INSERT OR IGNORE INTO PatientIdCheck (patient_id) VALUES (?)",
+                                   [(x,) for x in patient_ids])
+            missing = connection.execute("""SELECT c.patient_id FROM PatientIdCheck c
+                                            LEFT JOIN Patients p ON p.patient_id = c.patient_id
+                                            WHERE p.patient_id IS NULL
+                                            ORDER BY c.patient_id""").fetchall()
+            connection.execute("DELETE FROM PatientIdCheck")
+        return [x[0] for x in missing]
 
     def _assert_patients_added(self,
                                patient_ids: list):
         """
         Checks that all patients in target files have been added to the database. Called prior to additional
-        data entry beyond the Patients document/table and throws AssertionError if patients are missing.
-        Error message prompts a call to add_patients.
+        data entry beyond the Patients document/table and throws AssertionError if patients are missing, listing
+        every missing patient (see _missing_patients). Error message prompts a call to add_patients.
 
         Parameters
         ----------
@@ -486,77 +1188,79 @@ class Populate:
         -------
         None
         """
-        if self._config.db_type == "nosql":
-            for pt_id in patient_ids:
-                assert len(Patient.objects(patientId=str(pt_id))) > 0, \
-                    f"{pt_id} missing from database, have you called add_patients?"
-        else:
-            curr = self._config.db_connection.cursor()
-            for pt_id in patient_ids:
-                curr.execute("""SELECT patient_id FROM patients WHERE patient_id=?""", pt_id)
-                assert len(curr.fetchall()) > 0, f"{pt_id} missing from database, have you called add_patients?"
+        missing = self._missing_patients(patient_ids=patient_ids)
+        if missing:
+            err = f"{len(missing)} patients missing from database, have you called add_patients? Missing: {missing}"
+            self._config.write_to_log(err)
+            raise AssertionError(err)
 
     def age_correction(self,
                        correction: callable,
                        column_search_terms: str or None = None,
-                       new_path: str or None = None):
+                       new_path: str or None = None,
+                       chunksize: int = 100000):
+        """
+        Correct the age of every patient across all target files, for example where a patient's age is recorded
+        differently in different files. The distinct age values of each patient are collected from every file (in
+        one grouped pass per file) and passed to correction, which returns the single age to use for that patient.
+        Files containing an age column are then rewritten with corrected ages, in parallel across all cores.
+
+        Parameters
+        ----------
+        correction: callable
+            Function that takes a list of age values for a patient (empty if the patient has no age recorded)
+            and returns the corrected age
+        column_search_terms: list, optional
+            Regular expression terms used to identify the age column of each file
+        new_path: str, optional
+            If given, corrected files are written to this directory, otherwise target files are modified in place
+        chunksize: int, (default = 100000)
+            Number of rows of a CSV file held in memory at once when rewriting
 
+        Returns
+        -------
+        None
+        """
         if column_search_terms is None:
             column_search_terms = ["^age$", "^age[.-_]+", "[.-_]+age"]
+        self._column_roles.set_role("age", column_search_terms)
         self._vprint("----- Correcting age values -----")
         self._vprint("...fetch age values")
+        age_columns = dict()
+        file_ages = list()
+        for filename in progress_bar(self._files.keys(), verbose=self._verbose):
+            df = self._load_file(filename, columns=self._projection(filename, role="age"))
+            columns = self._file_role_columns(filename, role="age", columns=df.columns)
+            if len(columns) == 0:
+                continue
+            if len(columns) != 1:
+                raise ValueError(f"Multiple age columns found {columns}")
+            age_columns[filename] = columns[0]
+            ages = df[[self._id_column, columns[0]]].dropna(subset=[self._id_column])
+            file_ages.append(pd.DataFrame({"patient_id": ages[self._id_column].astype(str).values,
+                                           "age": ages[columns[0]].values}).drop_duplicates())
         age_values = dict()
-        for patient_id in progress_bar(self._patients.keys(), verbose=self._verbose):
-            all_values = list()
-            for filename, df in self._load_pt_dataframe(patient_id=patient_id):
-                columns = self._filter_columns(columns=df.columns,
-                                               regex_terms=column_search_terms)
-                if len(columns) == 0:
-                    continue
-                if len(columns) != 1:
-                    raise ValueError(f"Multiple age columns found {columns}")
-                file_values = df[columns].values.flatten()
-                if len(file_values) == 0:
-                    continue
-                all_values.append(list(set(file_values)))
-            age_values[patient_id] = [x for y in all_values for x in y]
-
-        age_values = {pt_id: correction(ages) for pt_id, ages in age_values.items()}
+        if file_ages:
+            age_values = pd.concat(file_ages, ignore_index=True).groupby("patient_id", sort=False)["age"].agg(list)
+            age_values = age_values.to_dict()
+        age_values = {pt_id: correction(age_values.get(pt_id, list())) for pt_id in self._patients.keys()}
         self._vprint("...correct age values")
-
-        for filename, properties in self._files.items():
-            if new_path is not None:
-                path = os.path.join(new_path, filename)
-            else:
-                path = properties.get("path")
-            if properties.get("type") == "csv":
-                df = pd.read_csv(path)
-            else:
-                df = pd.read_excel(path)
-            df.apply(lambda x: self._update_age(x, age_values=age_values, column_search_terms=column_search_terms),
-                     axis=0,
-                     inplace=True)
-            if properties.get("type") == "csv":
-                df.to_csv(path)
-            else:
-                df.to_excel(path)
-
+        if new_path is not None:
+            os.makedirs(new_path, exist_ok=True)
+        jobs = [(filename,
+                 self._files[filename].get("type"),
+                 self._files[filename].get("path"),
+                 os.path.join(new_path, filename) if new_path is not None else self._files[filename].get("path"),
+                 age_column) for filename, age_column in age_columns.items()]
+        task = partial(_age_correction_task, id_column=self._id_column, ages=age_values, chunksize=chunksize)
+        with Pool(min(cpu_count(), max(len(jobs), 1))) as pool:
+            for filename in progress_bar(pool.imap_unordered(task, jobs), verbose=self._verbose, total=len(jobs)):
+                if new_path is None:
+                    self._discard_file(filename)
+                    if self._is_staged(filename):
+                        self._staging.discard(filename)
         self._vprint("----- Complete! -----")
 
-    def _update_age(self,
-                    x: pd.Series,
-                    age_values: dict,
-                    column_search_terms: list or None = None):
-        if column_search_terms is None:
-            column_search_terms = ["^age$", "^age[.-_]+", "[.-_]+age"]
-        update_age = age_values.get(x[self._id_column])
-        assert update_age is not None, f"No age value found for {x[self._id_column]}"
-        columns = list(filter(lambda i: any([re.match(p, i, flags=re.IGNORECASE) for p in column_search_terms]), x.index))
-        if len(columns) != 1:
-            raise ValueError(f"Multiple age columns found {columns}")
-        x[columns[0]] = update_age
-        return x
-
     def add_patients(self,
                      conflicts: str or None = None,
                      age_search_terms: list or None = None,
@@ -570,7 +1274,12 @@ class Populate:
                      critical_care_file: str = "outcome",
                      critical_care_presence_infers_positivity: bool = False,
                      critical_care_column: str = "CRITICAL_CARE",
-                     critical_care_pos_value: str = "Y") -> None:
+                     critical_care_pos_value: str = "Y",
+                     batch_mode: bool = True,
+                     batch_size: int or None = 1000,
+                     upsert: bool = False,
+                     incremental: bool = False,
+                     resume: bool = False) -> list or None:
         """
         Add all patients in target files, populating with basic information (age, gender, did they test COVID positive
         during their stay? Were they admitted to ICU during stay? Did the patient die during their stay?). This method
@@ -600,8 +1309,8 @@ class Populate:
         covid_status_search_terms: dict
             Search terms to use when classifying a patients COVID status based on the values extracted
             from target files
-            Default = {"positive": ["+ve", "^p$", "^pos$", "^positive$"],
-                       "negative": ["-ve", "^p$", "^neg$", "^negative$"],
+            Default = {"positive": ["\\+ve", "^p$", "^pos$", "^positive$"],
+                       "negative": ["-ve", "^n$", "^neg$", "^negative$"],
                        "suspected": ["suspected"]}
         death_search_terms: list, (default = ["dead", "died", "death"])
             Regular expression search terms for determining if a patient died during stay
@@ -621,10 +1330,32 @@ class Populate:
             Name of the column to locate the critical care stay event in target file
         critical_care_pos_value: str, (default = "Y")
             Value that corresponds to a critical care stay occurring
+        batch_mode: bool, (default = True)
+            If True, basic information is computed for the whole cohort at once, loading each target file a single
+            time and using vectorised operations (see _fetch_cohort_basics). If False, target files are searched
+            separately for each patient (see _fetch_patient_basics). Results are identical.
+        batch_size: int, (default = 1000)
+            Number of patients written to the database per batch (SQL: per transaction). If None, all patients are
+            written in a single batch
+        upsert: bool, (default = False)
+            If True, patients that already exist are replaced. Otherwise, NoSQL reports them as duplicates and leaves
+            them unchanged, and SQL raises an IntegrityError
+        incremental: bool, (default = False)
+            If True, only patients with rows that have not already been ingested by a previous call with the same
+            parameters are written (their basic information is derived from all of their rows, and existing patients
+            are replaced). Files unchanged since the previous call are not read (see ingest.IngestManifest). A patient
+            whose rows have changed in place is rewritten from all of their current rows.
+        resume: bool, (default = False)
+            Patients are written in order of patient ID and a checkpoint recording the last patient written is saved
+            with each batch (see checkpoint.CheckpointStore). If True, continue from the checkpoint saved by an
+            interrupted call with the same parameters: patients up to and including the last patient written are
+            skipped and their basic information is not computed. If the previous call completed, nothing is written
 
         Returns
         -------
-        None
+        list
+            NoSQL: per-batch counts of inserted, duplicate and failed patients (see nosql.bulk.BulkWriter).
+            SQL: None
         """
         if age_search_terms is None:
             age_search_terms = ["^age$", "^age[.-_]+", "[.-_]+age"]
@@ -633,8 +1364,8 @@ class Populate:
         if covid_search_terms is None:
             covid_search_terms = ["covid_status", "covid", "covid19"]
         if covid_status_search_terms is None:
-            covid_status_search_terms = {"positive": ["+ve", "^p$", "^pos$", "^positive$"],
-                                         "negative": ["-ve", "^p$", "^neg$", "^negative$"],
+            covid_status_search_terms = {"positive": ["\\+ve", "^p$", "^pos$", "^positive$"],
+                                         "negative": ["-ve", "^n$", "^neg$", "^negative$"],
                                          "suspected": ["suspected"]}
         if gender_int_mappings is None:
             gender_int_mappings = {0: "M",
@@ -655,47 +1386,377 @@ class Populate:
 
         if conflicts is not None:
             self.conflicts = conflicts
+        stage = stage_key("patients", search_terms=search_terms, death_options=death_options,
+                          critical_care_options=critical_care_options, gender_int_mappings=gender_int_mappings,
+                          db_type=self._config.db_type)
+        checkpoints = self._checkpoint_store()
+        state = checkpoints.get(stage) if resume else None
+        if state is not None and state.get("complete"):
+            self._vprint("...stage already complete, nothing to resume")
+            return list() if self._config.db_type == "nosql" else None
+        patient_ids = set(self._patients.keys())
+        delta, keys, fingerprints = None, None, None
+        if incremental:
+            delta, keys, fingerprints = self._patient_delta(stage)
+            patient_ids = set().union(*[set(df[self._id_column].dropna().astype(str)) for df in delta.values()])
+            self._vprint(f"...{len(patient_ids)} patients with new or changed rows")
+            upsert = True
+        patient_ids = sorted(patient_ids)
+        if state is not None and state.get("last_patient") is not None:
+            patient_ids = [pt_id for pt_id in patient_ids if pt_id > state.get("last_patient")]
+            self._vprint(f"...resuming after patient {state.get('last_patient')}, {len(patient_ids)} remaining")
+        if len(patient_ids) == 0:
+            self._vprint("...no patients to write")
+            self._commit_patient_delta(stage, keys, fingerprints)
+            checkpoints.save(stage, dict(last_patient=None if state is None else state.get("last_patient"),
+                                         complete=True))
+            return list() if self._config.db_type == "nosql" else None
+        self._vprint("----- Fetching patient basics -----")
+        if batch_mode:
+            # Only the patients to be written are computed (rows of other patients are dropped as files are loaded)
+            fetch = self._fetch_cohort_basics(search_terms=search_terms,
+                                              death_options=death_options,
+                                              critical_care_options=critical_care_options,
+                                              gender_int_mappings=gender_int_mappings,
+                                              patient_ids=set(patient_ids)).get
+        else:
+            fetch = partial(self._fetch_patient_basics,
+                            search_terms=search_terms,
+                            death_options=death_options,
+                            critical_care_options=critical_care_options,
+                            gender_int_mappings=gender_int_mappings)
+        self._vprint("----- Writing patients -----")
+        batch_size = batch_size or max(len(patient_ids), 1)
+        batches = [patient_ids[i:i + batch_size] for i in range(0, len(patient_ids), batch_size)]
         # Search the unique patients and check if they already exist, if they don't add them
         if self._config.db_type == "nosql":
-            for pt_id in self._patients.keys():
-                basics = self._fetch_patient_basics(patient_id=pt_id,
-                                                    search_terms=search_terms,
-                                                    death_options=death_options,
-                                                    critical_care_options=critical_care_options,
-                                                    gender_int_mappings=gender_int_mappings)
-                patient = Patient(patientId=pt_id,
-                                  config=self._config)
-                for key, value in basics.items():
-                    if value is None:
-                        continue
-                    patient[key] = value
-                patient.save()
-                self._config.write_to_log(f"New patient {pt_id} written to Patients collection")
+            with BulkWriter(Patient, config=self._config, batch_size=batch_size, upsert=upsert) as writer:
+                for batch in progress_bar(batches, verbose=self._verbose):
+                    for pt_id in batch:
+                        patient = Patient(patientId=pt_id,
+                                          config=self._config)
+                        for key, value in fetch(pt_id).items():
+                            if value is None:
+                                continue
+                            patient[key] = value
+                        writer.add(patient)
+                    writer.flush()
+                    checkpoints.save(stage, dict(last_patient=batch[-1], complete=False))
+            self._vprint(f"...{writer.totals()}")
+            report = writer.report
         else:
-            for pt_id in self._patients.keys():
-                basics = self._fetch_patient_basics(patient_id=pt_id,
-                                                    search_terms=search_terms,
-                                                    death_options=death_options,
-                                                    critical_care_options=critical_care_options,
-                                                    gender_int_mappings=gender_int_mappings)
-                patient = {"patient_id": [pt_id]}
-                for key, value in basics.items():
-                    if value is not None:
-                        patient[key] = [value]
-                patient = pd.DataFrame(patient)
-                patient.to_sql(name="patients",
-                               con=self._config.db_connection,
-                               if_exists="append")
-                self._config.db_connection.commit()
-                self._config.write_to_log(f"New patient {pt_id} written to patients table")
+            columns = ["patient_id", "age", "gender", "covid", "died", "criticalCareStay"]
+            n = 0
+            for batch in progress_bar(batches, verbose=self._verbose):
+                rows = list()
+                for pt_id in batch:
+                    basics = fetch(pt_id)
+                    rows.append((pt_id, basics.get("age"), basics.get("gender") or "U", basics.get("covid"),
+                                 basics.get("died"), basics.get("criticalCareStay")))
+                with self._config.db_connection:
+                    n += bulk_insert(connection=self._config.db_connection,
+                                     table="Patients",
+                                     columns=columns,
+                                     rows=rows,
+                                     on_conflict="REPLACE" if upsert else None,
+                                     commit=False)
+                    checkpoints.save(stage, dict(last_patient=batch[-1], complete=False), commit=False)
+            self._config.write_to_log(f"{n} new patients written to Patients table")
+            self._vprint(f"...{n} patients written")
+            report = None
+        self._commit_patient_delta(stage, keys, fingerprints)
+        checkpoints.save(stage, dict(last_patient=patient_ids[-1], complete=True))
+        return report
+
+    def _patient_delta(self, stage: str) -> (dict, dict, dict):
+        """
+        Rows of each target file not yet ingested by the given add_patients stage (see ingest.IngestManifest).
+        Files unchanged since they were last ingested are not read.
+
+        Parameters
+        ----------
+        stage: str
+            Stage key (see ingest.stage_key)
+
+        Returns
+        -------
+        dict, dict, dict
+            File name and DataFrame of new or changed rows, file name and keys of those rows (see ingest.row_keys), and
+            file name and fingerprint of each file read (taken before reading), to be recorded once the patients have
+            been written
+        """
+        manifest = self._ingest_manifest()
+        delta = dict()
+        keys = dict()
+        fingerprints = dict()
+        for name, properties in self._files.items():
+            if manifest.is_complete(stage, name, properties.get("path")):
+                continue
+            fingerprints[name] = file_fingerprint(properties.get("path"))
+            df = self._load_file(name)
+            file_keys, _ = row_keys(df)
+            new = manifest.new_rows(stage, name, file_keys)
+            delta[name] = df[new]
+            keys[name] = file_keys[new]
+        return delta, keys, fingerprints
+
+    def _commit_patient_delta(self,
+                              stage: str,
+                              keys: dict or None,
+                              fingerprints: dict or None):
+        """
+        Record the rows and files returned by _patient_delta as ingested by the given add_patients stage, once the
+        patients have been written
+
+        Parameters
+        ----------
+        stage: str
+            Stage key (see ingest.stage_key)
+        keys: dict or None
+            See _patient_delta, nothing is recorded if None
+        fingerprints: dict or None
+            See _patient_delta
+
+        Returns
+        -------
+        None
+        """
+        if keys is None:
+            return
+        manifest = self._ingest_manifest()
+        for name, file_keys in keys.items():
+            manifest.commit(stage, name, file_keys)
+            manifest.complete(stage, name, fingerprints.get(name))
 
     def _load_and_concat(self, filename: str):
 
         files = {name: properties for name, properties in self._files.items()
                  if filename.lower() in name.lower()}
-        return pd.concat([_load_dataframe(path=properties.get("path"),
-                                          filetype=properties.get("type"))
-                          for properties in files.values()], ignore_index=True)
+        return pd.concat([self._load_file(name) for name in files.keys()], ignore_index=True)
+
+    def _iter_chunks(self,
+                     filename: str,
+                     chunksize: int or None = None):
+        """
+        Yield the contents of all target files whose name contains the given keyword as DataFrames of at most
+        chunksize rows, so that peak memory is bounded by chunksize rather than by the size of the files. CSV files
+        and staged Parquet copies are streamed from disk; Excel files cannot be read incrementally so each Excel file
+        is loaded whole and then split. Streamed chunks bypass the DataFrame cache.
+
+        Parameters
+        ----------
+        filename: str
+            Keyword to match target file names against
+        chunksize: int, optional
+            Maximum number of rows per chunk, if None, all matching files are loaded (via the DataFrame cache) and
+            yielded as a single concatenated DataFrame
+
+        Returns
+        -------
+        Generator of Pandas.DataFrame
+        """
+        if chunksize is None:
+            yield self._load_and_concat(filename=filename)
+            return
+        for name in self._files.keys():
+            if filename.lower() in name.lower():
+                yield from self._iter_file_chunks(name=name, chunksize=chunksize)
+
+    def _iter_file_chunks(self,
+                          name: str,
+                          chunksize: int or None = None,
+                          skip_rows: int = 0):
+        """
+        Yield the contents of a single target file as DataFrames of at most chunksize rows (see _iter_chunks)
+
+        Parameters
+        ----------
+        name: str
+            Name of target file (key of self._files)
+        chunksize: int, optional
+            Maximum number of rows per chunk, if None, the whole file is yielded (a copy of the cached DataFrame, so
+            that writers cannot modify the cache)
+        skip_rows: int, (default = 0)
+            Number of leading rows to skip, e.g. rows already written before an interruption. Streamed CSV files skip
+            the rows without parsing them and staged Parquet copies skip whole row groups without reading them (rows
+            are counted in staged order, see staging.ParquetStagingStore.iter_batches)
+
+        Returns
+        -------
+        Generator of Pandas.DataFrame
+        """
+        if chunksize is None:
+            df = self._load_file(name)
+            yield df.iloc[skip_rows:].copy()
+            return
+        assert chunksize > 0, "chunksize must be greater than 0"
+        properties = self._files.get(name)
+        if self._is_staged(name):
+            yield from self._staging.iter_batches(filename=name, batch_size=chunksize, skip_rows=skip_rows)
+        elif properties.get("type") == "csv":
+            yield from _load_dataframe(path=properties.get("path"),
+                                       filetype="csv",
+                                       chunksize=chunksize,
+                                       skiprows=range(1, skip_rows + 1) if skip_rows else None)
+        else:
+            df = _load_dataframe(path=properties.get("path"), filetype=properties.get("type"))
+            for start in range(skip_rows, df.shape[0], chunksize):
+                yield df.iloc[start:start + chunksize]
+
+    def _ingest_manifest(self) -> IngestManifest:
+        """
+        Manifest of rows already written by each ingest stage, stored in the database (created on first use)
+
+        Returns
+        -------
+        IngestManifest
+        """
+        if self._ingest is None:
+            self._ingest = IngestManifest(self._config)
+        return self._ingest
+
+    def _checkpoint_store(self) -> CheckpointStore:
+        """
+        Checkpoints of Populate stages, stored in the database (created on first use)
+
+        Returns
+        -------
+        CheckpointStore
+        """
+        if self._checkpoints is None:
+            self._checkpoints = CheckpointStore(self._config)
+        return self._checkpoints
+
+    def _write_checkpointed(self,
+                            write: callable,
+                            df: pd.DataFrame,
+                            stage: str,
+                            state: dict):
+        """
+        Write a DataFrame and then save the checkpoint of a stage. SQL: the rows and checkpoint are written in a single
+        transaction, so either both or neither are committed. NoSQL: the checkpoint is saved once the rows have been
+        written.
+
+        Parameters
+        ----------
+        write: callable
+            Function that takes a DataFrame and writes it to the database, and for SQL, accepts the keyword argument
+            commit (see sql.bulk.bulk_insert)
+        df: Pandas.DataFrame
+        stage: str
+            Stage key (see ingest.stage_key)
+        state: dict
+            Checkpoint state once df is written
+
+        Returns
+        -------
+        None
+        """
+        checkpoints = self._checkpoint_store()
+        if self._config.db_type == "sql":
+            with self._config.db_connection:
+                if df.shape[0] > 0:
+                    write(df, commit=False)
+                checkpoints.save(stage, state, commit=False)
+            return
+        if df.shape[0] > 0:
+            write(df)
+        checkpoints.save(stage, state)
+
+    def _ingest_chunks(self,
+                       filename: str,
+                       chunksize: int or None,
+                       write: callable,
+                       stage: str,
+                       incremental: bool = False,
+                       resume: bool = False):
+        """
+        Pass the contents of each target file whose name contains the given keyword to write, one chunk at a time
+        (see _iter_file_chunks). After each chunk a checkpoint recording the files completed and the number of rows
+        consumed from the current file is saved with the chunk (see _write_checkpointed and
+        checkpoint.CheckpointStore). If resume is True, ingestion continues from the last checkpoint of the stage:
+        completed files are skipped and rows already consumed are skipped without being parsed.
+
+        If incremental is True, files that are unchanged since they were last fully processed by this stage are
+        skipped without being read, only rows of each chunk that have not already been written by this stage are
+        passed to write, and the rows are recorded in the ingest manifest as they are written (SQL: in the same
+        transaction, see ingest.IngestManifest). Rows are keyed by their position among identical rows from the start
+        of the file (see ingest.row_keys), so when resuming an incremental stage rows already consumed are read again,
+        and skipped as already recorded, rather than skipped without being parsed.
+
+        Parameters
+        ----------
+        filename: str
+            Keyword to match target file names against
+        chunksize: int, optional
+            See _iter_file_chunks
+        write: callable
+            Function that takes a DataFrame and writes it to the database (see _write_checkpointed)
+        stage: str
+            Stage key (see ingest.stage_key)
+        incremental: bool, (default = False)
+        resume: bool, (default = False)
+
+        Returns
+        -------
+        None
+        """
+        checkpoints = self._checkpoint_store()
+        state = checkpoints.get(stage) if resume else None
+        if state is not None and state.get("complete"):
+            self._vprint("...stage already complete, nothing to resume")
+            return
+        if state is None:
+            state = dict(files=list(), file=None, rows=0, staged=False, complete=False)
+        manifest = self._ingest_manifest() if incremental else None
+        for name, properties in self._files.items():
+            if filename.lower() not in name.lower() or name in state.get("files"):
+                continue
+            skip_rows = state.get("rows") if state.get("file") == name else 0
+            if skip_rows:
+                if state.get("staged") != (self._is_staged(name) and chunksize is not None):
+                    raise ValueError(f"Checkpoint for {name} was saved with a different row order (staging and "
+                                     f"chunksize settings); resume with the same settings")
+                self._vprint(f"...resuming {name} from row {skip_rows}")
+            fingerprint = file_fingerprint(properties.get("path"))
+            if incremental and manifest.is_complete(stage, name, properties.get("path")):
+                self._vprint(f"...{name} unchanged since last ingested, skipping")
+            else:
+                def write_recorded(df: pd.DataFrame, keys: np.ndarray, **kwargs):
+                    write(df, **kwargs)
+                    manifest.commit(stage, name, keys, **kwargs)
+
+                n = 0
+                rows = 0 if incremental else skip_rows
+                counts = None
+                for chunk in progress_bar(self._iter_file_chunks(name=name, chunksize=chunksize, skip_rows=rows),
+                                          verbose=self._verbose and chunksize is not None):
+                    rows += chunk.shape[0]
+                    chunk_write = write
+                    if incremental:
+                        keys, counts = row_keys(chunk, counts)
+                        new = manifest.new_rows(stage, name, keys)
+                        chunk = chunk[new]
+                        chunk_write = partial(write_recorded, keys=keys[new])
+                    state.update(file=name, rows=rows, staged=self._is_staged(name) and chunksize is not None)
+                    try:
+                        self._write_checkpointed(write=chunk_write,
+                                                 df=chunk,
+                                                 stage=stage,
+                                                 state=state)
+                    except Exception:
+                        # Rows recorded by the manifest may have been rolled back, reload it on next use
+                        self._ingest = None
+                        raise
+                    n += chunk.shape[0]
+                if incremental:
+                    manifest.complete(stage, name, fingerprint)
+                self._config.write_to_log(f"{n} rows ingested from {name}", stage=stage, filename=name, rows=n)
+            state.get("files").append(name)
+            state.update(file=None, rows=0)
+            checkpoints.save(stage, state)
+        state["complete"] = True
+        checkpoints.save(stage, state)
 
     @staticmethod
     def _remove_columns(df: pd.DataFrame,
@@ -706,14 +1767,6 @@ class Populate:
                                                         "target file(s)"
         return df.drop(exclude, axis=1)
 
-    def _add_to_patient(self,
-                        row: pd.Series,
-                        mappings: dict,
-                        method_: str):
-        pt = Patient.objects(patientId=str(row[self._id_column])).get()
-        values = {key: row[column_name] for key, column_name in mappings.items()}
-        getattr(pt, method_)(**values)
-
     @staticmethod
     def _parse_datetime_columns(df: pd.DataFrame,
                                 datetime_cols: list or str,
@@ -722,96 +1775,221 @@ class Populate:
         if prefix is not None:
             colname = "_".join([prefix, colname])
         if type(datetime_cols) == list:
-            df[colname] = df[datetime_cols].apply(lambda x: " ".join([x[c] for c in datetime_cols]))
+            values = df[datetime_cols].astype(str).agg(" ".join, axis=1)
         else:
-            df[colname] = df[datetime_cols]
-        return df.drop(datetime_cols, axis=1)
+            values = df[datetime_cols]
+        return df.assign(**{colname: values}).drop(datetime_cols, axis=1)
 
     def add_events(self,
                    event_datetime: str or list,
                    filename: str,
                    mappings: dict,
-                   exclude_columns: list or None = None):
+                   exclude_columns: list or None = None,
+                   batch_size: int or None = None,
+                   chunksize: int or None = None,
+                   incremental: bool = False,
+                   resume: bool = False):
         """
         For each patient in the target files, add outcome events to database using target files that contain the
         keyword specified in filename
 
         Parameters
         ----------
-        event_datetime: str
+        event_datetime: str or list
+            Name of the column containing the event datetime, or a list of columns (e.g. date and time) that are
+            joined to form the event datetime. Datetimes are parsed with utilities.parse_datetime_series; SQL
+            event dates are written as ISO 8601 strings (YYYY-MM-DD)
         filename: str
             Keyword to use for capturing files that contain outcome events
         mappings: dict
             Column mappings, specific key values are required and should map to the relevant column within the
-            target file(s). Expected keys: event_type, event_datetime, covid_status, death, critical_care_admission
+            target file(s). Expected keys: event_type, covid_status, death, critical_care_admission
             Additional optional keys: component, source_type, source, wimd
         exclude_columns: list
+        batch_size: int, optional
+            SQL: number of events written per transaction, if None, all events are written in a single
+            transaction. NoSQL: number of Event documents per bulk write (default 1000)
+        chunksize: int, optional
+            If given, target files are streamed in chunks of at most this many rows and each chunk is transformed
+            and written before the next is read, bounding peak memory (see _iter_chunks). If None, all target files
+            are loaded at once.
+        incremental: bool, (default = False)
+            If True, only rows that have not already been written by a previous call with the same parameters are
+            written, and files unchanged since are skipped without being read (see _ingest_chunks). Use when target
+            files are appended to between runs. Rows are identified by their contents and the number of identical
+            rows before them in the file, so a row repeated in a later delta is written again. A row changed in place
+            is written alongside its previous version, which is not replaced or removed (see ingest.IngestManifest).
+        resume: bool, (default = False)
+            If True, continue from the checkpoint saved by an interrupted call with the same parameters: files and
+            rows already written are skipped (see _ingest_chunks). If the previous call completed, nothing is written
 
         Returns
         -------
         None
         """
-        events = self._load_and_concat(filename=filename)
+        assert "event_type" in mappings.keys(), "event_type not found in mappings"
+        mappings = dict(mappings)
+        if type(event_datetime) == list:
+            mappings["event_datetime"] = "event_datetime"
+        else:
+            mappings["event_datetime"] = event_datetime
+        stage = stage_key("events", filename=filename, event_datetime=event_datetime, mappings=mappings,
+                          exclude_columns=exclude_columns, db_type=self._config.db_type)
+        self._ingest_chunks(filename=filename,
+                            chunksize=chunksize,
+                            stage=stage,
+                            incremental=incremental,
+                            resume=resume,
+                            write=partial(self._write_events,
+                                          event_datetime=event_datetime,
+                                          mappings=mappings,
+                                          exclude_columns=exclude_columns,
+                                          batch_size=batch_size))
+
+    def _write_events(self,
+                      events: pd.DataFrame,
+                      event_datetime: str or list,
+                      mappings: dict,
+                      exclude_columns: list or None = None,
+                      batch_size: int or None = None,
+                      commit: bool = True):
+        """
+        Transform and write a DataFrame of events to the database, see add_events for details. If commit is False
+        (SQL only), events are written within the caller's transaction (see sql.bulk.bulk_insert)
+        """
         patient_ids = events[self._id_column].values
         events = self._remove_columns(events, exclude_columns)
         self._assert_patients_added(patient_ids=patient_ids)
-        assert "event_type" in mappings.keys(), "event_type not found in mappings"
         if type(event_datetime) == list:
             events = self._parse_datetime_columns(events, event_datetime, prefix="event")
-            mappings["event_datetime"] = "event_datetime"
-        if self._config.db_type == "nosql":
-            events.apply(lambda x: self._add_to_patient(row=x, mappings=mappings, method_="add_new_outcome"))
-        else:
-            mappings["patient_id"] = self._id_column
-            events["event_date"] = events["event_datetime"].apply(lambda x: parse_datetime(x)).get("date")
-            events["event_time"] = events["event_datetime"].apply(lambda x: parse_datetime(x)).get("time")
-            events.drop("event_datetime", axis=1, inplace=True)
-            mappings = {value: key for key, value in mappings.items()}
-            events.rename(columns=mappings)
-            events.to_sql(name="Events",
-                            con=self._config.db_connection,
-                            if_exists="append")
-
-    def _add_measurement(self,
-                         row: pd.Series,
-                         results_columns: list,
-                         results_types: list,
-                         result_datetime: str or list,
-                         ref_ranges: list or None = None,
-                         request_source: str or None = None,
-                         complex_result_split_char: str = " "):
+        event_datetime = parse_datetime_series(events[mappings.get("event_datetime")])
+        columns = {column: key for key, column in mappings.items() if key != "event_datetime"}
+        columns[self._id_column] = "patient_id"
+        events = events.rename(columns=columns)[list(columns.values())]
+        events["event_date"] = event_datetime["date"]
+        events["event_time"] = event_datetime["time"]
+        if self._config.db_type == "sql":
+            events["event_date"] = iso_date_series(events["event_date"])
+            # event_date is required, events without a valid date are skipped rather than failing the whole chunk
+            invalid = events["event_date"].isnull()
+            if invalid.any():
+                self._config.write_to_log(f"{invalid.sum()} events skipped with a missing or invalid event date")
+                events = events[~invalid]
+            n = bulk_insert_dataframe(connection=self._config.db_connection,
+                                      table="Events",
+                                      df=events,
+                                      batch_size=batch_size,
+                                      commit=commit)
+            self._config.write_to_log(f"{n} new events written to Events table")
+            return
+        with self._child_writer(Event, field="outcomeEvents", batch_size=batch_size or 1000) as writer:
+            for document in self._event_documents(events):
+                writer.add(document)
+        self._config.write_to_log(f"{writer.totals().get('inserted')} new events written to outcomes collection")
+
+    def _child_writer(self,
+                      document: type,
+                      field: str,
+                      batch_size: int) -> BulkWriter:
+        """
+        Bulk writer for documents related to a patient by patientId (e.g. Event, Measurement). If
+        config.store_references is True, references to the documents written are also appended to the given list field
+        of their Patient (see nosql.bulk.ReferenceBulkWriter)
+
+        Parameters
+        ----------
+        document: mongoengine.Document
+        field: str
+            List field of Patient referencing document
+        batch_size: int
+
+        Returns
+        -------
+        BulkWriter
+        """
+        if self._config.store_references:
+            return ReferenceBulkWriter(document, config=self._config, owner=Patient, field=field, batch_size=batch_size)
+        return BulkWriter(document, config=self._config, batch_size=batch_size)
+
+    @staticmethod
+    def _event_documents(events: pd.DataFrame):
+        """
+        Generate (unsaved) Event documents from events with columns named as in the SQL Events table (see
+        _write_events). Columns are mapped to the Event fields populated by Patient.add_new_event; unrecognised
+        columns become dynamic fields. Dates are parsed day first, in one pass over the batch.
+
+        Parameters
+        ----------
+        events: Pandas.DataFrame
+
+        Returns
+        -------
+        Generator of Event
+        """
+        fields = {"patient_id": "patientId",
+                  "event_type": "eventType",
+                  "event_date": "eventDate",
+                  "event_time": "eventTime",
+                  "covid_status": "covidStatus",
+                  "critical_care_admission": "criticalCareAdmission",
+                  "source_type": "sourceType"}
+        events = events.copy()
+        dates = pd.to_datetime(events["event_date"], format="%d/%m/%Y", errors="coerce")
+        events["event_date"] = np.array(dates.dt.to_pydatetime(), dtype=object)
+        if "event_type" in events.columns:
+            events["event_type"] = events["event_type"].map(lambda x: x.strip() if isinstance(x, str) else x)
+        events["patient_id"] = events["patient_id"].map(str)
+        names = [fields.get(c, c) for c in events.columns]
+        for values in events.itertuples(index=False, name=None):
+            yield Event(**{name: value.item() if isinstance(value, np.generic) else value
+                           for name, value in zip(names, values) if not pd.isna(value)})
+
+    def _measurement_records(self,
+                             measurements: pd.DataFrame,
+                             results_columns: list,
+                             results_types: list,
+                             result_datetime: str or list,
+                             ref_ranges: list or None = None,
+                             request_source: str or None = None) -> pd.DataFrame:
+        """
+        Convert measurements from wide format (one column per result) to long format, with one row per patient,
+        result and datetime, using the column names of the Measurements table. Missing results are dropped.
+
+        Parameters
+        ----------
+        measurements: Pandas.DataFrame
+        results_columns: list
+        results_types: list
+        result_datetime: str or list
+        ref_ranges: list, optional
+        request_source: str, optional
+            See add_measurements
+
+        Returns
+        -------
+        Pandas.DataFrame
+        """
+        ref_ranges = ref_ranges or list()
         if type(result_datetime) == list:
-            result_datetime = " ".join([row[x] for x in result_datetime])
+            datetimes = measurements[result_datetime].astype(str).agg(" ".join, axis=1)
         else:
-            result_datetime = row[result_datetime]
-        request_source = row[request_source]
+            datetimes = measurements[result_datetime]
+        datetimes = parse_datetime_series(datetimes)
+        records = list()
         for i, result in enumerate(results_columns):
             ref = None
-            if len(ref_ranges) > i:
-                ref = ref_ranges[i]
-            if self._config.db_type == "nosql":
-                pt = Patient.objects(patientId=str(row[self._id_column])).get()
-                pt.add_new_measurements(result=row[result],
-                                        result_type=results_types[i],
-                                        name=result,
-                                        result_datetime=result_datetime,
-                                        request_source=request_source,
-                                        result_split_char=complex_result_split_char,
-                                        ref_range=ref)
-            else:
-                result_datetime = parse_datetime(result_datetime)
-                record = dict(patient_id=row[self._id_column],
-                              result_name=result,
-                              result_type=results_types[i],
-                              result=row[result],
-                              result_date=result_datetime.get("date"),
-                              result_time=result_datetime.get("time"),
-                              request_source=request_source,
-                              ref_range=ref)
-
-                pd.DataFrame(record).to_sql(name="Measurements",
-                                            con=self._config.db_connection,
-                                            if_exists="append")
+            if len(ref_ranges) > i and ref_ranges[i] is not None:
+                ref = json.dumps(list(ref_ranges[i]))
+            records.append(pd.DataFrame({"patient_id": measurements[self._id_column].astype(str),
+                                         "result_name": result,
+                                         "result_type": results_types[i],
+                                         "result": measurements[result],
+                                         "result_date": datetimes["date"],
+                                         "result_time": datetimes["time"],
+                                         "request_source": None if request_source is None
+                                         else measurements[request_source],
+                                         "ref_range": ref}).dropna(subset=["result"]))
+        return pd.concat(records, ignore_index=True)
 
     def add_measurements(self,
                          filename: str,
@@ -820,72 +1998,309 @@ class Populate:
                          results_types: list,
                          ref_ranges: list or None = None,
                          request_source: str or None = None,
-                         complex_result_split_char: str = " "):
+                         complex_result_split_char: str = " ",
+                         batch_size: int or None = None,
+                         chunksize: int or None = None,
+                         incremental: bool = False,
+                         resume: bool = False):
+        """
+        Add measurements (e.g. test results) to the database using target files that contain the keyword specified
+        in filename. Each target file row can contain multiple results, one per column in results_columns.
+
+        Parameters
+        ----------
+        filename: str
+            Keyword to use for capturing files that contain measurements
+        result_datetime: str or list
+            Name of the column containing the datetime of the results, or a list of columns that are joined to form
+            the datetime. SQL result dates are written as ISO 8601 strings (YYYY-MM-DD)
+        results_columns: list
+            Columns containing results, the column name is used as the measurement name
+        results_types: list
+            Type of each result in results_columns: "continuous", "discrete" or "complex"
+        ref_ranges: list, optional
+            Reference range (lower, upper) for each result in results_columns
+        request_source: str, optional
+            Column containing the source of the request
+        complex_result_split_char: str, (default = " ")
+            Character used to split complex results into a list
+        batch_size: int, optional
+            SQL: number of measurements written per transaction, if None, all measurements are written in a single
+            transaction. NoSQL: number of measurement documents per bulk write (default 1000)
+        chunksize: int, optional
+            If given, target files are streamed in chunks of at most this many rows and each chunk is transformed
+            and written before the next is read, bounding peak memory (see _iter_chunks). If None, all target files
+            are loaded at once.
+        incremental: bool, (default = False)
+            If True, only rows that have not already been written by a previous call with the same parameters are
+            written, and files unchanged since are skipped without being read (see _ingest_chunks). Use when target
+            files are appended to between runs. Rows are identified by their contents and the number of identical
+            rows before them in the file, so a row repeated in a later delta is written again. A row changed in place
+            is written alongside its previous version, which is not replaced or removed (see ingest.IngestManifest).
+        resume: bool, (default = False)
+            If True, continue from the checkpoint saved by an interrupted call with the same parameters: files and
+            rows already written are skipped (see _ingest_chunks). If the previous call completed, nothing is written
+
+        Returns
+        -------
+        None
+        """
         assert len(results_columns) == len(results_types), "Length of results_columns should equal length of " \
                                                            "result_types"
-        measurements = self._load_and_concat(filename=filename)
+        stage = stage_key("measurements", filename=filename, result_datetime=result_datetime,
+                          results_columns=results_columns, results_types=results_types, ref_ranges=ref_ranges,
+                          request_source=request_source, complex_result_split_char=complex_result_split_char,
+                          db_type=self._config.db_type)
+        self._ingest_chunks(filename=filename,
+                            chunksize=chunksize,
+                            stage=stage,
+                            incremental=incremental,
+                            resume=resume,
+                            write=partial(self._write_measurements,
+                                          result_datetime=result_datetime,
+                                          results_columns=results_columns,
+                                          results_types=results_types,
+                                          ref_ranges=ref_ranges,
+                                          request_source=request_source,
+                                          complex_result_split_char=complex_result_split_char,
+                                          batch_size=batch_size))
+
+    def _write_measurements(self,
+                            measurements: pd.DataFrame,
+                            result_datetime: str or list,
+                            results_columns: list,
+                            results_types: list,
+                            ref_ranges: list or None = None,
+                            request_source: str or None = None,
+                            complex_result_split_char: str = " ",
+                            batch_size: int or None = None,
+                            commit: bool = True):
+        """
+        Transform and write a DataFrame of measurements to the database, see add_measurements for details.
+        Throughput (input rows per second) is written to the log. If commit is False (SQL only), measurements are
+        written within the caller's transaction (see sql.bulk.bulk_insert)
+        """
+        start = time.perf_counter()
         self._assert_patients_added(measurements[self._id_column].values)
-        measurements.apply(lambda x: self._add_measurement(row=x,
-                                                           result_datetime=result_datetime,
-                                                           results_columns=results_columns,
-                                                           results_types=results_types,
-                                                           ref_ranges=ref_ranges,
-                                                           request_source=request_source,
-                                                           complex_result_split_char=complex_result_split_char))
+        records = self._measurement_records(measurements=measurements,
+                                            results_columns=results_columns,
+                                            results_types=results_types,
+                                            result_datetime=result_datetime,
+                                            ref_ranges=ref_ranges,
+                                            request_source=request_source)
+        if self._config.db_type == "sql":
+            n = bulk_insert_dataframe(connection=self._config.db_connection,
+                                      table="Measurements",
+                                      df=records.assign(result_date=iso_date_series(records.result_date)),
+                                      batch_size=batch_size,
+                                      commit=commit)
+        else:
+            with self._child_writer(Measurement, field="measurements", batch_size=batch_size or 1000) as writer:
+                for document in self._measurement_documents(records=records,
+                                                            complex_result_split_char=complex_result_split_char):
+                    writer.add(document)
+            n = writer.totals().get("inserted")
+        seconds = time.perf_counter() - start
+        rate = measurements.shape[0] / seconds if seconds > 0 else float("inf")
+        self._config.write_to_log(f"{n} new measurements written from {measurements.shape[0]} rows in "
+                                  f"{seconds:.2f} seconds ({rate:.0f} rows/sec)",
+                                  rows=measurements.shape[0],
+                                  measurements=n,
+                                  seconds=seconds,
+                                  rows_per_sec=rate)
+
+    @staticmethod
+    def _measurement_documents(records: pd.DataFrame,
+                               complex_result_split_char: str = " "):
+        """
+        Generate (unsaved) measurement documents from long format measurement records (see _measurement_records).
+        The document class is chosen by result type; dates are parsed day first, consistent with the SQL
+        Measurements table.
+
+        Parameters
+        ----------
+        records: Pandas.DataFrame
+        complex_result_split_char: str, (default = " ")
+            Character used to split complex results into a list
+
+        Returns
+        -------
+        Generator of Measurement
+        """
+        dates = pd.to_datetime(records["result_date"], format="%d/%m/%Y", errors="coerce")
+        dates = np.array(dates.dt.to_pydatetime(), dtype=object)
+        documents = {"continuous": ContinuousMeasurement,
+                     "discrete": DiscreteMeasurement,
+                     "complex": ComplexMeasurement}
+        for i, record in enumerate(records.itertuples(index=False)):
+            if record.result_type not in documents:
+                raise ValueError("result_type must be one of: 'complex', 'continuous, or 'discrete'")
+            result = record.result
+            if record.result_type == "continuous":
+                try:
+                    result = float(result)
+                except (TypeError, ValueError):
+                    pass
+            elif record.result_type == "discrete":
+                result = str(result)
+            else:
+                result = str(result).split(sep=complex_result_split_char)
+            document = documents.get(record.result_type)(patientId=record.patient_id,
+                                                         name=record.result_name,
+                                                         result=result)
+            optional = [("date", None if pd.isna(dates[i]) else dates[i]),
+                        ("time", record.result_time),
+                        ("requestSource", None if pd.isna(record.request_source) else str(record.request_source))]
+            if record.result_type == "continuous" and record.ref_range is not None:
+                optional.append(("refRange", json.loads(record.ref_range)))
+            for name, value in optional:
+                if value is not None:
+                    document[name] = value
+            yield document
 
     def add_comorbidities(self,
                           filename: str,
                           exclude_columns: str or None = None,
                           conflicts: str = "ignore",
-                          edit_threshold: int = 2):
+                          edit_threshold: int = 2,
+                          batch_size: int or None = None):
+        """
+        Associate patients to comorbidities using target files that contain the keyword specified in filename. Target
+        files should have one column per comorbidity, with a status of 1 if the patient has that comorbidity.
+        Comorbidity names are matched against existing comorbidity keys (ComorbKey table/comorbid collection) by edit
+        distance; names that are not within edit_threshold of any existing key are added as new keys. Comorbidities
+        already associated to a patient are not associated again.
+
+        Parameters
+        ----------
+        filename: str
+            Keyword to use for capturing files that contain comorbidities
+        exclude_columns: list, optional
+            Columns to ignore
+        conflicts: str, (default = "ignore")
+            How to handle a new name that is similar to existing key(s), see _resolve_comorbidities:
+            "ignore" - the name is skipped (with a warning)
+            "raise" - ValueError is raised
+            "merge" - the name is replaced by the similar key (if there is exactly one, otherwise skipped)
+        edit_threshold: int, (default = 2)
+            Names whose edit distance to an existing key is less than or equal to this threshold are similar
+        batch_size: int, optional
+            SQL only. Number of comorbidities written per transaction, if None, all comorbidities are written in a
+            single transaction
+
+        Returns
+        -------
+        None
+        """
+        assert conflicts in ["ignore", "raise", "merge"], "conflicts should be one of: 'ignore', 'raise', or 'merge'"
         comorbs = self._load_and_concat(filename=filename)
         self._assert_patients_added(comorbs[self._id_column].values)
         comorbs = self._remove_columns(comorbs, exclude_columns).melt(id_vars=self._id_column,
                                                                       value_name="status",
                                                                       var_name="comorb_name")
         comorbs = comorbs[comorbs.status == 1].drop_duplicates()
-        if comorbs.shape[0]:
+        if comorbs.shape[0] == 0:
             warn("No positive status for all comorbidities. This is unusual and should be checked. No data entry performed")
             return
+        comorbs = comorbs.rename({self._id_column: "patient_id"}, axis=1)
+        comorbs, new_keys = self._resolve_comorbidities(comorbs, conflicts, edit_threshold)
         if self._config.db_type == "nosql":
-            comorbs.apply(lambda x: Patient.objects(patientId=x[self._id_column]).get().add_new_comorbidity(name=x,
-                                                                                                            conflicts=conflicts,
-                                                                                                            edit_threshold=edit_threshold),
-                          axis=1)
+            if new_keys:
+                Comorbidity._get_collection().insert_many([{"comorbidName": x} for x in new_keys])
+            keys = Comorbidity._get_collection().find({"comorbidName": {"$in": list(comorbs.comorb_name.unique())}},
+                                                      {"comorbidName": 1})
+            keys = {doc.get("comorbidName"): doc.get("_id") for doc in keys}
+            references = defaultdict(list)
+            for pt_id, name in zip(comorbs.patient_id.map(str), comorbs.comorb_name):
+                references[pt_id].append(keys.get(name))
+            n = push_references(owner=Patient, field="comorbidities", references=references, unique=True)
+            self._config.write_to_log(f"Comorbidities associated to {n} patients")
         else:
-            comorbs.rename({self._id_column: "patient_id"}, axis=1, inplace=True)
-            comorbs = self._parse_comorbs_sql(comorbs, conflicts, edit_threshold)
-            comorbs.to_sql(name="Comorbidities",
-                           con=self._config.db_connection,
-                           if_exists="append")
-
-    def _parse_comorbs_sql(self,
-                           comorbs: pd.DataFrame,
-                           conflicts: str,
-                           edit_threshold: int):
-        for x in comorbs.comorb_name.unique():
-            if x not in self._comorb_keys:
-                similar = list(filter(lambda k: levenshtein_distance(k, x) >= edit_threshold,
-                                      self._comorb_keys))
+            if new_keys:
+                bulk_insert(connection=self._config.db_connection,
+                            table="ComorbKey",
+                            columns=["comorb_name"],
+                            rows=[(x,) for x in new_keys],
+                            on_conflict="IGNORE")
+            n = bulk_insert_dataframe(connection=self._config.db_connection,
+                                      table="Comorbidities",
+                                      df=comorbs[["patient_id", "comorb_name"]],
+                                      batch_size=batch_size,
+                                      on_conflict="IGNORE")
+            self._config.write_to_log(f"{n} new comorbidities written to Comorbidities table")
+
+    def _comorbidity_index(self) -> BKTree:
+        """
+        Fuzzy-match index of existing comorbidity keys, loaded from the database on first use and updated as new
+        keys are added by _resolve_comorbidities. NoSQL: the index is shared with Patient.add_new_comorbidity (see
+        nosql.patient.comorbidity_index)
+
+        Returns
+        -------
+        BKTree
+        """
+        if self._config.db_type == "nosql":
+            return comorbidity_index()
+        if self._comorb_index is None:
+            keys = [x[0] for x in self._config.db_connection.execute("SELECT comorb_name FROM ComorbKey;")]
+            self._comorb_index = BKTree(keys)
+        return self._comorb_index
+
+    def _resolve_comorbidities(self,
+                               comorbs: pd.DataFrame,
+                               conflicts: str,
+                               edit_threshold: int) -> (pd.DataFrame, list):
+        """
+        Match each distinct comorbidity name against the existing comorbidity keys. Names that are existing keys are
+        kept. Names within edit_threshold of one or more existing keys conflict and are handled according to
+        conflicts (see add_comorbidities). All other names are new keys and are added to the index.
+
+        Parameters
+        ----------
+        comorbs: Pandas.DataFrame
+            Long format comorbidities with column "comorb_name"
+        conflicts: str
+        edit_threshold: int
+
+        Returns
+        -------
+        Pandas.DataFrame, list
+            Comorbidities with conflicting names merged or removed, and names of new keys
+        """
+        index = self._comorbidity_index()
+        names = dict()
+        new_keys = list()
+        try:
+            for x in comorbs.comorb_name.unique():
+                names[x] = x
+                if x in index:
+                    continue
+                similar = index.search(x, edit_threshold=edit_threshold)
                 if len(similar) > 1:
                     err = f"{x} conflicts with more than one comorbidity keys: {similar}"
                     if conflicts == "raise":
                         raise ValueError(err)
                     warn(f"{err}; ignoring conflict, comorbiditiy {x} will be skipped")
-                    comorbs = comorbs[comorbs.comorb_name != x]
+                    names[x] = None
                 elif len(similar) == 1:
                     err = f"{x} conflicts with existing comorbidity {similar[0]}"
                     if conflicts == "merge":
                         warn(f"{err}; merging conflict with existing value")
-                        comorbs["comorb_name"] = comorbs["comorb_name"].apply(lambda x: similar[0])
+                        names[x] = similar[0]
                     elif conflicts == "raise":
                         raise ValueError(err)
                     else:
                         warn(f"{err}; ignoring conflict, comorbiditiy {x} will be skipped")
+                        names[x] = None
                 else:
-                    self._comorb_keys.append(x)
-                    curr = self._config.db_connection.cursor()
-                    curr.execute("INSERT INTO ComorbKey (comorb_name) VALUES (?)", x)
-                    self._config.db_connection.commit()
-        return comorbs
+                    index.add(x)
+                    new_keys.append(x)
+        except ValueError:
+            # Keys added to the index so far have not been written, reload the index
+            self._comorb_index = None
+            if self._config.db_type == "nosql":
+                comorbidity_index(reload=True)
+            raise
+        comorbs = comorbs.assign(comorb_name=comorbs.comorb_name.map(names))
+        return comorbs.dropna(subset=["comorb_name"]).drop_duplicates(), new_keys
 
@@ -0,0 +1,149 @@
+from itertools import islice
+import pandas as pd
+import numpy as np
+import sqlite3
+
+
+def _sqlite_value(value):
+    """
+    Convert a single value to a type that can be bound by sqlite3 (numpy scalars to Python scalars, missing values
+    to None)
+    """
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if value is pd.NA or value is pd.NaT:
+        return None
+    return value
+
+
+def bulk_insert(connection: sqlite3.Connection,
+                table: str,
+                columns: list,
+                rows: iter,
+                batch_size: int or None = None,
+                on_conflict: str or None = None,
+                commit: bool = True) -> int:
+    """
+    Stream rows into a SQLite table using executemany. If batch_size is None, all rows are written in a single
+    transaction, otherwise a transaction is committed every batch_size rows. Rows are consumed lazily so rows can
+    be a generator. If an error occurs the current transaction is rolled back; batches already committed remain.
+    If commit is False, rows are written within the caller's transaction and are neither committed nor rolled back
+    here, so that other statements (e.g. a checkpoint) can be committed atomically with them.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+    table: str
+        Name of table to insert into
+    columns: list
+        Column names, in the same order as the values in each row
+    rows: iterable
+        Iterable of tuples
+    batch_size: int, optional
+        Number of rows per transaction
+    on_conflict: str, optional
+        If given, conflict resolution algorithm for the INSERT statement: "IGNORE", "REPLACE", "ABORT", "FAIL"
+        or "ROLLBACK"
+    commit: bool, (default = True)
+        If False, batch_size is ignored and the caller is responsible for committing
+
+    Returns
+    -------
+    int
+        Number of rows inserted
+    """
+    assert batch_size is None or batch_size > 0, "batch_size must be greater than 0"
+    verb = "INSERT"
+    if on_conflict is not None:
+        assert on_conflict.upper() in ["IGNORE", "REPLACE", "ABORT", "FAIL", "ROLLBACK"], "Invalid on_conflict"
+        verb = f"INSERT OR {on_conflict.upper()}"
+    sql = f"{verb} INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+    rows = (tuple(_sqlite_value(v) for v in row) for row in rows)
+    if not commit:
+        return max(connection.executemany(sql, rows).rowcount, 0)
+    inserted = 0
+    while True:
+        batch = rows if batch_size is None else list(islice(rows, batch_size))
+        if batch_size is not None and len(batch) == 0:
+            break
+        with connection:
+            inserted += max(connection.executemany(sql, batch).rowcount, 0)
+        if batch_size is None:
+            break
+    return inserted
+
+
+def bulk_insert_dataframe(connection: sqlite3.Connection,
+                          table: str,
+                          df: pd.DataFrame,
+                          batch_size: int or None = None,
+                          on_conflict: str or None = None,
+                          commit: bool = True) -> int:
+    """
+    Insert the contents of a DataFrame into a SQLite table using bulk_insert. Column names of the DataFrame must
+    match columns in the table; the DataFrame index is ignored.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+    table: str
+        Name of table to insert into
+    df: Pandas.DataFrame
+    batch_size: int, optional
+        Number of rows per transaction, if None, all rows are written in a single transaction
+    on_conflict: str, optional
+        See bulk_insert
+    commit: bool, (default = True)
+        See bulk_insert
+
+    Returns
+    -------
+    int
+        Number of rows inserted
+    """
+    return bulk_insert(connection=connection,
+                       table=table,
+                       columns=list(df.columns),
+                       rows=df.itertuples(index=False, name=None),
+                       batch_size=batch_size,
+                       on_conflict=on_conflict,
+                       commit=commit)
+
+
+PATIENT_TABLES = ["Events", "Measurements", "CriticalCare", "Comorbidities", "Patients"]
+
+
+def delete_patients(connection: sqlite3.Connection,
+                    patient_ids: list,
+                    batch_size: int = 500) -> dict:
+    """
+    Delete patients and all of their data (cascade) from the standard tables, with one
+    DELETE ... WHERE patient_id IN (...) statement per table and batch of patient IDs. Each batch is deleted from
+    all tables in a single transaction, so a patient is never left partially deleted.
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+    patient_ids: list
+        Patients to delete, duplicates and missing values are ignored
+    batch_size: int, (default = 500)
+        Number of patient IDs per statement (must not exceed the SQLite limit on bound parameters)
+
+    Returns
+    -------
+    dict
+        Number of rows deleted from each table
+    """
+    assert batch_size > 0, "batch_size must be greater than 0"
+    patient_ids = pd.Series(patient_ids, dtype=object).dropna().map(str).unique().tolist()
+    deleted = {table: 0 for table in PATIENT_TABLES}
+    for i in range(0, len(patient_ids), batch_size):
+        batch = patient_ids[i:i + batch_size]
+        placeholders = ", ".join("?" * len(batch))
+        with connection:
+            for table in PATIENT_TABLES:
+                cursor = connection.execute(f"DELETE FROM {table} WHERE patient_id IN ({placeholders});", batch)
+                deleted[table] += max(cursor.rowcount, 0)
+    return deleted
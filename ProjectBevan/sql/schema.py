@@ -1,10 +1,13 @@
+from contextlib import contextmanager
 import sqlite3
 import os
 
 
 def _schema():
     """
-    Generates list of SQL queries for generating standard tables for sqlite3 database
+    Generates list of SQL queries for generating standard tables for sqlite3 database. Patients are keyed by
+    patient_id; all other patient data (events, measurements etc.) has an integer surrogate key so that a patient can
+    have any number of rows. Secondary indexes are defined separately (see _indexes).
 
     Returns
     -------
@@ -23,7 +26,8 @@ def _schema():
     """
     event = """
             CREATE TABLE Events(
-            patient_id TEXT PRIMARY KEY,
+            event_id INTEGER PRIMARY KEY,
+            patient_id TEXT NOT NULL,
             component TEXT,
             event_type TEXT NOT NULL,
             event_date TEXT NOT NULL,
@@ -39,7 +43,8 @@ def _schema():
         """
     measurements = """
         CREATE TABLE Measurements(
-        patient_id TEXT PRIMARY KEY,
+        measurement_id INTEGER PRIMARY KEY,
+        patient_id TEXT NOT NULL,
         result_name TEXT NOT NULL,
         result_type TEXT NOT NULL,
         result TEXT NOT NULL,
@@ -53,7 +58,8 @@ def _schema():
     """
     critical_care = """
         CREATE TABLE CriticalCare(
-        patient_id TEXT PRIMARY KEY,
+        critical_care_id INTEGER PRIMARY KEY,
+        patient_id TEXT NOT NULL,
         admission_date TEXT,
         admission_time REAL,
         discharge_date TEXT,
@@ -66,8 +72,10 @@ def _schema():
     """
     comorbidities = """
         CREATE TABLE Comorbidities(
-        patient_id TEXT PRIMARY KEY,
-        comorb_name TEXT
+        comorbidity_id INTEGER PRIMARY KEY,
+        patient_id TEXT NOT NULL,
+        comorb_name TEXT NOT NULL,
+        UNIQUE(patient_id, comorb_name)
         );
     """
     comorb_key = """CREATE TABLE ComorbKey(
@@ -76,8 +84,122 @@ def _schema():
     return [patients, event, measurements, critical_care, comorbidities, comorb_key]
 
 
+def _indexes():
+    """
+    Generates list of SQL queries for generating the secondary indexes of the standard tables, for the queries
+    run against them: all data for a patient, and results/events of a given name or type (per patient or across the
+    cohort) filtered by date. Dates are stored as ISO 8601 strings (YYYY-MM-DD, see Populate), so that date ranges
+    can be compared directly using these indexes. Composite indexes also serve queries on their leading column(s)
+    alone, e.g. (patient_id, result_name, result_date) serves lookups by patient_id.
+
+    Returns
+    -------
+    list
+        List of string values containing SQL queries for each index
+    """
+    return ["CREATE INDEX IF NOT EXISTS idx_events_patient_type_date ON Events(patient_id, event_type, event_date);",
+            "CREATE INDEX IF NOT EXISTS idx_events_type_date ON Events(event_type, event_date);",
+            "CREATE INDEX IF NOT EXISTS idx_measurements_patient_name_date "
+            "ON Measurements(patient_id, result_name, result_date);",
+            "CREATE INDEX IF NOT EXISTS idx_measurements_name_date ON Measurements(result_name, result_date);",
+            "CREATE INDEX IF NOT EXISTS idx_critical_care_patient ON CriticalCare(patient_id);",
+            "CREATE INDEX IF NOT EXISTS idx_comorbidities_name ON Comorbidities(comorb_name);"]
+
+
+def create_indexes(connection: sqlite3.Connection,
+                   analyze: bool = True):
+    """
+    Create any secondary indexes of the standard schema that do not exist (see _indexes), e.g. after a bulk load
+    into a database created with create_database(bulk_load=True)
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+    analyze: bool, (default = True)
+        If True, ANALYZE is run afterwards so that the query planner has statistics for the new indexes
+
+    Returns
+    -------
+    None
+    """
+    with connection:
+        for x in _indexes():
+            connection.execute(x)
+    if analyze:
+        connection.execute("ANALYZE;")
+
+
+def index_report(connection: sqlite3.Connection) -> list:
+    """
+    Report the indexes of each table and their sizes
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+
+    Returns
+    -------
+    list
+        One dictionary per index with keys "table", "index", "keys" and "size" (bytes, None if SQLite was compiled
+        without the dbstat virtual table)
+    """
+    try:
+        sizes = dict(connection.execute("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name;").fetchall())
+    except sqlite3.OperationalError:
+        sizes = dict()
+    report = list()
+    indexes = connection.execute("SELECT name, tbl_name FROM sqlite_master WHERE type='index' "
+                                 "ORDER BY tbl_name, name;").fetchall()
+    for name, table in indexes:
+        keys = [x[2] for x in connection.execute(f"PRAGMA index_info('{name}');").fetchall()]
+        report.append(dict(table=table, index=name, keys=keys, size=sizes.get(name)))
+    return report
+
+
+@contextmanager
+def bulk_load(connection: sqlite3.Connection,
+              build_indexes: bool = True):
+    """
+    Context manager for bulk loading (e.g. Populate) into a SQLite database. For the duration of the load the
+    connection uses write-ahead logging (journal_mode=WAL, which persists in the database file) with
+    synchronous=NORMAL, so transactions are not individually synced to disk (the database cannot be corrupted by a
+    crash, but the most recent transactions may be lost by power failure), and keeps temporary tables in memory.
+    On exit, the WAL is checkpointed, synchronous is restored and, if the load completed without error and
+    build_indexes is True, any missing secondary indexes are created (see create_indexes), so indexes deferred by create_database(bulk_load=True) are built once, after the load, rather
+    than maintained row by row.
+
+        create_database(path, bulk_load=True)
+        config.connect(path)
+        with bulk_load(config.db_connection):
+            populate.add_patients()
+            populate.add_measurements(...)
+
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+    build_indexes: bool, (default = True)
+        If False, indexes are not created on exit and create_indexes must be called once the load is complete
+
+    Returns
+    -------
+    sqlite3.Connection
+    """
+    synchronous = connection.execute("PRAGMA synchronous;").fetchone()[0]
+    connection.execute("PRAGMA journal_mode=WAL;")
+    connection.execute("PRAGMA synchronous=NORMAL;")
+    connection.execute("PRAGMA temp_store=MEMORY;")
+    try:
+        yield connection
+    finally:
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE);")
+        connection.execute(f"PRAGMA synchronous={int(synchronous)};")
+    if build_indexes:
+        create_indexes(connection)
+
+
 def create_database(db_path: str,
                     overwrite: bool = False,
+                    bulk_load: bool = False,
                     **kwargs):
     """
     Generate a new local unpopulated SQLite database following the standard schema for IDWT project
@@ -89,6 +211,10 @@ def create_database(db_path: str,
     overwrite: bool
         How to handle existing database file. If True and database file exists, database will be deleted and replaced
         witn new unpopulated data
+    bulk_load: bool, (default = False)
+        If True, the database is created for bulk loading: secondary indexes are not created (build them once
+        loading is complete with create_indexes, or load within the bulk_load context manager) and the database
+        uses write-ahead logging (journal_mode=WAL)
     kwargs
         Additional keyword arguments to pass to sqlite3.conntect() call
     Returns
@@ -105,6 +231,10 @@ def create_database(db_path: str,
     curr = conn.cursor()
     for x in _schema():
         curr.execute(x)
+    if bulk_load:
+        curr.execute("PRAGMA journal_mode=WAL;")
+    else:
+        for x in _indexes():
+            curr.execute(x)
     conn.commit()
     conn.close()
-
@@ -0,0 +1,273 @@
+from .patient_index import content_hash, file_fingerprint
+from warnings import warn
+import pandas as pd
+import hashlib
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+ROW_COLUMN = "__bevan_row__"
+KEY_COLUMN = "__bevan_patient_id__"
+
+
+def parquet_available() -> bool:
+    """
+    Check if the optional dependency pyarrow, required for Parquet staging, is installed
+
+    Returns
+    -------
+    bool
+    """
+    return pq is not None
+
+
+def stage_file(df: pd.DataFrame,
+               destination: str,
+               id_column: str,
+               row_group_size: int = 10000):
+    """
+    Write the contents of a target file to Parquet, sorted by patient identifier and in row groups of
+    row_group_size rows with min/max statistics, so that reads filtered by patient only touch the row groups that can
+    contain that patient. Two columns are added: the patient identifier as a string (KEY_COLUMN), which is the sort
+    and filter key, and the original row position (ROW_COLUMN), used to restore the original row order and index.
+    The file is written to a temporary path and moved into place once complete.
+
+    Parameters
+    ----------
+    df: Pandas.DataFrame
+        Contents of the target file
+    destination: str
+        Path of Parquet file
+    id_column: str
+        Patient identifier column
+    row_group_size: int, (default = 10000)
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ValueError
+        If the contents cannot be converted to Parquet (e.g. a column of mixed types)
+    """
+    df = df.copy()
+    df[ROW_COLUMN] = range(df.shape[0])
+    df[KEY_COLUMN] = df[id_column].astype(str).where(df[id_column].notna())
+    df = df.sort_values(KEY_COLUMN, kind="stable", na_position="last")
+    tmp_path = f"{destination}.tmp"
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pq.write_table(table, tmp_path, row_group_size=row_group_size, write_statistics=True)
+        os.replace(tmp_path, destination)
+    except pa.ArrowException as e:
+        raise ValueError(f"Unable to convert to Parquet; {e}") from e
+    finally:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+
+
+def _restore(df: pd.DataFrame) -> pd.DataFrame:
+    return df.set_index(ROW_COLUMN).sort_index().rename_axis(None).drop(columns=KEY_COLUMN, errors="ignore")
+
+
+class ParquetStagingStore:
+    """
+    Parquet copies of target files, sorted and row-grouped by patient identifier (see stage_file). Reads return
+    DataFrames with the same rows, row order and index as reading the original file. Per-patient reads use row-group
+    statistics to skip row groups, and per-column reads only decode the requested columns.
+
+    A JSON manifest records the size, modification time and content hash of each source file at the time it was
+    staged, so an existing staging directory can be reused for any file that is unchanged.
+
+    Requires the optional dependency pyarrow.
+
+    Parameters
+    ----------
+    directory: str
+        Directory to write Parquet files to, created if it does not exist
+    """
+    def __init__(self, directory: str):
+        if not parquet_available():
+            raise ImportError("Parquet staging requires pyarrow, install with: pip install pyarrow")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._manifest_path = os.path.join(directory, "manifest.json")
+        self._manifest = dict()
+        if os.path.isfile(self._manifest_path):
+            try:
+                with open(self._manifest_path, "r") as f:
+                    self._manifest = json.load(f)
+            except ValueError:
+                warn(f"Staging manifest {self._manifest_path} is corrupt and will be rebuilt")
+
+    def __contains__(self, filename: str):
+        return filename in self._manifest
+
+    def path(self, filename: str) -> str:
+        """
+        Path of the Parquet file for a target file
+
+        Parameters
+        ----------
+        filename: str
+
+        Returns
+        -------
+        str
+        """
+        key = hashlib.blake2b(filename.encode("utf-8"), digest_size=8).hexdigest()
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def _write_manifest(self):
+        tmp_path = f"{self._manifest_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    def is_current(self,
+                   filename: str,
+                   path: str,
+                   id_column: str) -> bool:
+        """
+        Check if a valid staged copy exists for the given file
+
+        Parameters
+        ----------
+        filename: str
+            Name of the target file
+        path: str
+            Path to the target file
+        id_column: str
+            Patient identifier column
+
+        Returns
+        -------
+        bool
+        """
+        entry = self._manifest.get(filename)
+        if entry is None or entry.get("id_column") != id_column or not os.path.isfile(self.path(filename)):
+            return False
+        fingerprint = file_fingerprint(path)
+        if fingerprint.get("size") != entry.get("size"):
+            return False
+        if fingerprint.get("mtime") == entry.get("mtime"):
+            return True
+        if content_hash(path) != entry.get("hash"):
+            return False
+        entry["mtime"] = fingerprint.get("mtime")
+        self._write_manifest()
+        return True
+
+    def record(self,
+               filename: str,
+               path: str,
+               id_column: str):
+        """
+        Record that a target file has been staged (see stage_file)
+
+        Parameters
+        ----------
+        filename: str
+            Name of the target file
+        path: str
+            Path to the target file
+        id_column: str
+            Patient identifier column
+
+        Returns
+        -------
+        None
+        """
+        entry = file_fingerprint(path)
+        entry["hash"] = content_hash(path)
+        entry["id_column"] = id_column
+        self._manifest[filename] = entry
+        self._write_manifest()
+
+    def discard(self, filename: str):
+        """
+        Forget the staged copy of a target file, e.g. after the target file has been modified
+
+        Parameters
+        ----------
+        filename: str
+
+        Returns
+        -------
+        None
+        """
+        if self._manifest.pop(filename, None) is not None:
+            self._write_manifest()
+        if os.path.isfile(self.path(filename)):
+            os.remove(self.path(filename))
+
+    def read(self,
+             filename: str,
+             columns: list or None = None,
+             patient_id: str or None = None) -> pd.DataFrame:
+        """
+        Read a staged file
+
+        Parameters
+        ----------
+        filename: str
+        columns: list, optional
+            Columns to read, if None, all columns are read
+        patient_id: str, optional
+            If given, only rows for this patient are returned; row groups whose statistics exclude the patient are
+            skipped
+
+        Returns
+        -------
+        Pandas.DataFrame
+        """
+        if columns is not None:
+            columns = list(columns) + [ROW_COLUMN]
+        filters = None if patient_id is None else [(KEY_COLUMN, "==", str(patient_id))]
+        table = pq.read_table(self.path(filename), columns=columns, filters=filters)
+        return _restore(table.to_pandas())
+
+    def iter_batches(self,
+                     filename: str,
+                     batch_size: int,
+                     skip_rows: int = 0):
+        """
+        Stream a staged file in DataFrames of at most batch_size rows. Batches follow the staged (patient sorted)
+        order rather than the original row order.
+
+        Parameters
+        ----------
+        filename: str
+        batch_size: int
+        skip_rows: int, (default = 0)
+            Number of rows (in staged order) to skip, e.g. rows already processed. Whole row groups that are skipped
+            are not read
+
+        Returns
+        -------
+        Generator of Pandas.DataFrame
+        """
+        parquet = pq.ParquetFile(self.path(filename))
+        row_groups = list()
+        for i in range(parquet.num_row_groups):
+            n = parquet.metadata.row_group(i).num_rows
+            if skip_rows >= n and not row_groups:
+                skip_rows -= n
+                continue
+            row_groups.append(i)
+        if not row_groups:
+            return
+        for batch in parquet.iter_batches(batch_size=batch_size, row_groups=row_groups):
+            if skip_rows >= batch.num_rows:
+                skip_rows -= batch.num_rows
+                continue
+            df = _restore(batch.slice(skip_rows).to_pandas())
+            skip_rows = 0
+            yield df
@@ -0,0 +1,45 @@
+from ProjectBevan.cache import DataFrameCache
+import pandas as pd
+import unittest
+
+
+def _example(n: int = 100):
+    return pd.DataFrame({"x": range(n)})
+
+
+class TestDataFrameCache(unittest.TestCase):
+
+    def test_hits_and_misses(self):
+        cache = DataFrameCache()
+        calls = list()
+
+        def loader():
+            calls.append(1)
+            return _example()
+
+        first = cache.get("file.csv", loader)
+        second = cache.get("file.csv", loader)
+        self.assertIs(first, second)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.info().get("hits"), 1)
+        self.assertEqual(cache.info().get("misses"), 1)
+
+    def test_lru_eviction(self):
+        nbytes = int(_example().memory_usage(deep=True).sum())
+        cache = DataFrameCache(max_bytes=nbytes * 2)
+        cache.get("a", _example)
+        cache.get("b", _example)
+        cache.get("a", _example)
+        cache.get("c", _example)
+        self.assertIn("a", cache)
+        self.assertIn("c", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.current_bytes, cache.max_bytes)
+
+    def test_oversized(self):
+        cache = DataFrameCache(max_bytes=0)
+        cache.get("a", _example)
+        cache.get("a", _example)
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.misses, 2)
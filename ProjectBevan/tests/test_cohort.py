@@ -0,0 +1,105 @@
+from ProjectBevan.cohort import CohortQuery, COLUMNS
+from ProjectBevan.config import GlobalConfig
+from ProjectBevan.sql.bulk import bulk_insert
+from ProjectBevan.nosql.patient import Patient, Comorbidity
+from ProjectBevan.nosql.measurement import Measurement
+from ProjectBevan.tests.utilities import sql_config
+from mongoengine import connect, disconnect
+from datetime import datetime
+import mongomock
+import tempfile
+import unittest
+import os
+
+PATIENTS = [("a", 50, "M", "P", 0, 1),
+            ("b", 32, "F", "N", 0, 0),
+            ("c", 71, "F", "P", 1, 0),
+            ("d", 65, "M", "P", 1, 1)]
+MEASUREMENTS = [("a", "crp", "continuous", 5.0, "1/4/2020"),
+                ("c", "crp", "continuous", 7.0, "12/4/2020"),
+                ("d", "crp", "continuous", 9.0, "02/05/2020"),
+                ("d", "hb", "continuous", 12.0, "1/4/2020")]
+COMORBIDITIES = [("c", "diabetes"), ("d", "diabetes"), ("d", "asthma")]
+
+
+def _queries(config: GlobalConfig) -> list:
+    return [CohortQuery(config),
+            CohortQuery(config).age_between(60, None).covid("P"),
+            CohortQuery(config).gender("M").critical_care_stay(),
+            CohortQuery(config).died(False),
+            CohortQuery(config).has_comorbidity("diabetes").has_comorbidity("asthma"),
+            CohortQuery(config).has_measurement("crp", start_date="02/04/2020", end_date="30/4/2020"),
+            CohortQuery(config).has_measurement("crp", start_date="1/4/2020").age_between(None, 60)]
+
+
+EXPECTED = [["a", "b", "c", "d"], ["c", "d"], ["a", "d"], ["a", "b"], ["d"], ["c"], ["a"]]
+
+
+class TestCohortSQL(unittest.TestCase):
+
+    def test_queries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = sql_config(tmp)
+            bulk_insert(config.db_connection, "Patients", COLUMNS, PATIENTS)
+            # Populate writes SQL dates as ISO 8601 strings
+            bulk_insert(config.db_connection, "Measurements",
+                        ["patient_id", "result_name", "result_type", "result", "result_date"],
+                        [(*x[:4], datetime.strptime(x[4], "%d/%m/%Y").strftime("%Y-%m-%d")) for x in MEASUREMENTS])
+            bulk_insert(config.db_connection, "Comorbidities", ["patient_id", "comorb_name"], COMORBIDITIES)
+            results = [query.to_dataframe().patient_id.tolist() for query in _queries(config)]
+            batches = [df.shape[0] for df in CohortQuery(config).fetch(batch_size=3)]
+            cohort = CohortQuery(config).age_between(70, 80).to_dataframe()
+            sql, params = _queries(config)[5].to_sql()
+            plan = config.db_connection.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            config.close()
+            config.close_log()
+        self.assertListEqual(results, EXPECTED)
+        self.assertListEqual(batches, [3, 1])
+        self.assertListEqual(cohort.values.tolist(), [list(PATIENTS[2])])
+        # The date range is searched within the index
+        self.assertTrue(any("idx_measurements_patient_name_date" in x[-1] and "result_date>" in x[-1] for x in plan))
+
+
+class TestCohortNoSQL(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("mongoenginetest", host="mongodb://localhost", alias="core", mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect(alias="core")
+
+    def test_to_pipeline(self):
+        query = CohortQuery(GlobalConfig()).gender("M").has_comorbidity("diabetes").has_measurement(
+            "crp", start_date="02/04/2020")
+        pipeline = query.to_pipeline()
+        self.assertListEqual([list(stage.keys())[0] for stage in pipeline],
+                             ["$match", "$sort", "$lookup", "$match", "$lookup", "$unwind", "$match", "$group",
+                              "$sort", "$project"])
+        # $unwind and $match immediately follow the measurement $lookup, so the server applies them within the join
+        self.assertEqual(pipeline[4].get("$lookup").get("as"), "_measurement")
+        self.assertEqual(pipeline[5].get("$unwind"), "$_measurement")
+        self.assertDictEqual(pipeline[6].get("$match"),
+                             {"_measurement.name": "crp", "_measurement.date": {"$gte": datetime(2020, 4, 2)}})
+
+    def test_queries(self):
+        config = GlobalConfig()
+        config.set_log_path(os.path.join(tempfile.gettempdir(), "test_cohort_log.txt"))
+        for document in [Patient, Measurement, Comorbidity]:
+            document.drop_collection()
+        patients = dict()
+        for values in PATIENTS:
+            patients[values[0]] = Patient(config=config, **dict(zip(["patientId"] + COLUMNS[1:], values))).save()
+        for pt_id, name, result_type, result, result_date in MEASUREMENTS:
+            patients[pt_id].add_new_measurement(result=result, result_type=result_type, name=name,
+                                                result_datetime=result_date)
+        for pt_id, name in COMORBIDITIES:
+            patients[pt_id].add_new_comorbidity(name, edit_threshold=0)
+        results = [query.to_dataframe().patient_id.tolist() for query in _queries(config)]
+        batches = [df.shape[0] for df in CohortQuery(config).fetch(batch_size=3)]
+        cohort = CohortQuery(config).age_between(70, 80).to_dataframe()
+        config.close_log()
+        self.assertListEqual(results, EXPECTED)
+        self.assertListEqual(batches, [3, 1])
+        self.assertListEqual(cohort.values.tolist(), [list(PATIENTS[2])])
@@ -0,0 +1,25 @@
+from ProjectBevan.columns import ColumnRoleResolver
+import unittest
+
+
+class TestColumnRoleResolver(unittest.TestCase):
+
+    def test_resolve(self):
+        resolver = ColumnRoleResolver({"age": ["^age$", "[.-_]+age"],
+                                       "gender": ["^gender$", "^sex$"]})
+        header = ["PATIENT_ID", "AGE", "Sex", "admission_age", "ward"]
+        roles = resolver.resolve(header)
+        self.assertListEqual(roles.get("age"), ["AGE", "admission_age"])
+        self.assertListEqual(roles.get("gender"), ["Sex"])
+        self.assertIs(resolver.resolve(list(header)), roles)
+
+    def test_set_role(self):
+        resolver = ColumnRoleResolver({"age": ["^age$"]})
+        header = ["AGE", "GENDER"]
+        roles = resolver.resolve(header)
+        resolver.set_role("age", ["^age$"])
+        self.assertIs(resolver.resolve(header), roles)
+        resolver.set_role("gender", ["^gender$"])
+        self.assertListEqual(resolver.columns(header, "gender"), ["GENDER"])
+        with self.assertRaises(AssertionError):
+            resolver.columns(header, "covid")
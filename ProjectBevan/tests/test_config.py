@@ -1,6 +1,7 @@
 from config import GlobalConfig
 from datetime import datetime
 import unittest
+import json
 import os
 
 
@@ -39,8 +40,32 @@ class TestGlobalConfig(unittest.TestCase):
 
     def test_write_to_log(self):
         config = GlobalConfig()
+        if os.path.exists(f"{os.getcwd()}/test.txt"):
+            os.remove(f"{os.getcwd()}/test.txt")
         config.set_log_path(f"{os.getcwd()}/test.txt")
+        start = datetime.now()
         config.write_to_log("TESTING")
+        config.write_to_log("TESTING AGAIN")
+        config.flush_log()
         with open(f"{os.getcwd()}/test.txt", "r") as f:
-            self.assertEqual(f.readline(), f"{datetime.now()}: TESTING \n")
+            lines = f.readlines()
+        config.close_log()
         os.remove(f"{os.getcwd()}/test.txt")
+        self.assertEqual(len(lines), 2)
+        timestamp, message = lines[0].split(": ", 1)
+        self.assertGreaterEqual(datetime.fromisoformat(timestamp), start)
+        self.assertEqual(message, "TESTING \n")
+        self.assertTrue(lines[1].endswith(": TESTING AGAIN \n"))
+
+    def test_write_to_log_jsonl(self):
+        config = GlobalConfig()
+        config.set_log_path(f"{os.getcwd()}/test.jsonl")
+        config.set_log_format("jsonl", buffer_size=2, flush_interval=60)
+        for i in range(3):
+            config.write_to_log("Patient written", patient_id=str(i))
+        config.close_log()
+        with open(f"{os.getcwd()}/test.jsonl", "r") as f:
+            records = [json.loads(line) for line in f]
+        os.remove(f"{os.getcwd()}/test.jsonl")
+        self.assertListEqual([r.get("patient_id") for r in records], ["0", "1", "2"])
+        self.assertTrue(all(r.get("message") == "Patient written" for r in records))
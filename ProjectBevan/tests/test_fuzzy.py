@@ -0,0 +1,29 @@
+from ProjectBevan.fuzzy import BKTree
+from Levenshtein import distance as levenshtein_distance
+import unittest
+
+
+class TestBKTree(unittest.TestCase):
+
+    def test_search_matches_linear_scan(self):
+        keys = ["asthma", "cancer", "copd", "diabetes", "diabetes type 2", "hypertension", "obesity", "dementia",
+                "chronic kidney disease", "chronic liver disease", "stroke", "heart failure"]
+        tree = BKTree(keys)
+        for x in ["asthma", "astma", "cancre", "diabetis", "Cancer", "heart failur", "kidney", "ckd"]:
+            for threshold in [0, 1, 2, 3]:
+                expected = sorted(k for k in keys if levenshtein_distance(k, x) <= threshold)
+                self.assertListEqual(sorted(tree.search(x, edit_threshold=threshold)), expected)
+
+    def test_add(self):
+        tree = BKTree()
+        self.assertListEqual(tree.search("copd"), [])
+        self.assertTrue(tree.add("copd"))
+        self.assertFalse(tree.add("copd"))
+        tree.add("cope")
+        self.assertEqual(len(tree), 2)
+        self.assertIn("cope", tree)
+        self.assertListEqual(tree.search("copd", edit_threshold=1), ["copd", "cope"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+from ProjectBevan.ingest import IngestManifest, row_hashes, row_keys, stage_key
+from ProjectBevan.patient_index import file_fingerprint
+from ProjectBevan.config import GlobalConfig
+from ProjectBevan.tests.utilities import sql_config
+from mongoengine import connect, disconnect
+import pandas as pd
+import mongomock
+import numpy as np
+import tempfile
+import unittest
+import os
+
+
+class TestIngestManifest(unittest.TestCase):
+
+    def test_row_hashes(self):
+        a = pd.DataFrame({"id": ["a", "b"], "value": [1, 2]})
+        b = pd.DataFrame({"id": ["a", "b", "c"], "value": [1.0, 2.0, np.nan]}, index=[5, 6, 7])
+        self.assertListEqual(row_hashes(a).tolist(), row_hashes(b).tolist()[:2])
+        self.assertNotEqual(row_hashes(a)[0], row_hashes(a)[1])
+        self.assertNotEqual(stage_key("events", mappings={"a": 1}), stage_key("events", mappings={"a": 2}))
+
+    def test_row_keys(self):
+        df = pd.DataFrame({"id": ["a", "a", "b", "a"], "value": [1, 1, 2, 1]})
+        keys, counts = row_keys(df)
+        self.assertEqual(len(set(keys.tolist())), 4)
+        # Reading the same rows in chunks gives the same keys
+        first, chunk_counts = row_keys(df.iloc[:2])
+        second, chunk_counts = row_keys(df.iloc[2:], chunk_counts)
+        self.assertListEqual(np.concatenate([first, second]).tolist(), keys.tolist())
+        self.assertListEqual(chunk_counts.sort_index().tolist(), counts.sort_index().tolist())
+
+    def _test_manifest(self, config: GlobalConfig, tmp: str):
+        path = os.path.join(tmp, "x.csv")
+        df = pd.DataFrame({"id": ["a", "b"], "value": [1, 2]})
+        df.to_csv(path, index=False)
+        keys, _ = row_keys(df)
+        manifest = IngestManifest(config)
+        self.assertFalse(manifest.is_complete("s", "x.csv", path))
+        self.assertListEqual(manifest.new_rows("s", "x.csv", keys).tolist(), [True, True])
+        manifest.commit("s", "x.csv", keys[:1])
+        manifest.commit("s", "x.csv", keys[:1])
+        manifest.complete("s", "x.csv", file_fingerprint(path))
+        reloaded = IngestManifest(config)
+        self.assertTrue(reloaded.is_complete("s", "x.csv", path))
+        self.assertListEqual(reloaded.new_rows("s", "x.csv", keys).tolist(), [False, True])
+        self.assertListEqual(reloaded.new_rows("t", "x.csv", keys).tolist(), [True, True])
+        # A repeat of a row already written, appended to the file, is new
+        repeated, _ = row_keys(pd.concat([df, df.iloc[:1]], ignore_index=True))
+        self.assertListEqual(reloaded.new_rows("s", "x.csv", repeated).tolist(), [False, True, True])
+        reloaded.reset("s")
+        self.assertFalse(reloaded.is_complete("s", "x.csv", path))
+        self.assertListEqual(reloaded.new_rows("s", "x.csv", keys).tolist(), [True, True])
+        self.assertListEqual(IngestManifest(config).new_rows("s", "x.csv", keys).tolist(), [True, True])
+
+    def test_manifest_sql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = sql_config(tmp)
+            self._test_manifest(config, tmp)
+            # Rows recorded without commit are rolled back with the caller's transaction
+            manifest = IngestManifest(config)
+            keys, _ = row_keys(pd.DataFrame({"id": ["c"], "value": [3]}))
+            with self.assertRaises(RuntimeError):
+                with config.db_connection:
+                    manifest.commit("u", "x.csv", keys, commit=False)
+                    raise RuntimeError
+            self.assertListEqual(IngestManifest(config).new_rows("u", "x.csv", keys).tolist(), [True])
+            config.close()
+            config.close_log()
+
+    def test_manifest_nosql(self):
+        connect("mongoenginetest", host="mongodb://localhost", alias="core", mongo_client_class=mongomock.MongoClient)
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                config = GlobalConfig()
+                config.set_log_path(os.path.join(tmp, "log.txt"))
+                IngestManifest(config).reset()
+                self._test_manifest(config, tmp)
+                config.close_log()
+        finally:
+            disconnect(alias="core")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,17 @@
-from ProjectBevan.nosql.patient import Comorbidity
+from ProjectBevan.nosql.patient import Comorbidity, Patient, comorbidity_index
+from ProjectBevan.nosql.event import Event
+from ProjectBevan.nosql.measurement import Measurement, ContinuousMeasurement, DiscreteMeasurement
+from ProjectBevan.nosql.bulk import BulkWriter, ReferenceBulkWriter
+from ProjectBevan.populate_from_tabular import Populate
+from ProjectBevan.config import GlobalConfig
 from mongoengine import connect, disconnect
+from pymongo.errors import BulkWriteError
+from unittest import mock
+import pandas as pd
+import mongomock
+import tempfile
 import unittest
+import os
 
 
 class TestComorbidity(unittest.TestCase):
@@ -33,3 +44,289 @@ class TestPerson(unittest.TestCase):
         fresh_pers = Person.objects().first()
         assert fresh_pers.name ==  'John'
 
+
+
+class TestBulkWriter(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("mongoenginetest", host="mongodb://localhost", alias="core", mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect(alias="core")
+
+    def setUp(self):
+        self.config = GlobalConfig()
+        self.config.set_log_path(os.path.join(tempfile.gettempdir(), "test_bulk_log.txt"))
+        Patient.drop_collection()
+
+    def tearDown(self):
+        self.config.close_log()
+
+    def test_batches(self):
+        with BulkWriter(Patient, config=self.config, batch_size=2) as writer:
+            for pt_id, age in [("a", 40), ("b", 51), ("a", 40), ("c", 33), ("d", 20)]:
+                writer.add(Patient(config=self.config, patientId=pt_id, age=age))
+            writer.add(Patient(config=self.config, patientId="e", gender="invalid"))
+        self.assertEqual(len(writer.report), 3)
+        self.assertDictEqual(writer.totals(), dict(inserted=4, duplicate=1, failed=1))
+        self.assertEqual(Patient._get_collection().count_documents({}), 4)
+
+    def test_upsert(self):
+        with BulkWriter(Patient, config=self.config) as writer:
+            writer.add(Patient(config=self.config, patientId="a", age=40))
+        with BulkWriter(Patient, config=self.config, upsert=True) as writer:
+            writer.add(Patient(config=self.config, patientId="a", age=41))
+            writer.add(Patient(config=self.config, patientId="b", age=20))
+        self.assertDictEqual(writer.totals(), dict(inserted=1, duplicate=1, failed=0))
+        self.assertEqual(Patient._get_collection().find_one({"_id": "a"}).get("age"), 41)
+
+    def test_upsert_errors(self):
+        error = BulkWriteError({"nUpserted": 1, "nMatched": 0,
+                                "writeErrors": [{"index": 1, "code": 2, "errmsg": "invalid", "op": {"q": {"_id": "b"}}}]})
+        with mock.patch.object(mongomock.collection.Collection, "bulk_write", side_effect=error):
+            with BulkWriter(Patient, config=self.config, batch_size=2, upsert=True) as writer:
+                writer.add(Patient(config=self.config, patientId="a"))
+                writer.add(Patient(config=self.config, patientId="b"))
+                writer.add(Patient(config=self.config, patientId="c"))
+        self.assertEqual(len(writer.report), 2)
+        self.assertDictEqual(writer.totals(), dict(inserted=2, duplicate=0, failed=2))
+        with self.assertRaises(AssertionError):
+            BulkWriter(Event, config=self.config, upsert=True).add(Event(patientId="a", eventType="admission"))
+
+    def test_reference_writer(self):
+        Measurement.drop_collection()
+        Patient._get_collection().insert_many([{"_id": "a"}, {"_id": "b"}])
+        with ReferenceBulkWriter(Measurement, config=self.config, owner=Patient, field="measurements",
+                                 batch_size=2) as writer:
+            writer.add(ContinuousMeasurement(patientId="a", name="crp", result=5.0))
+            writer.add(DiscreteMeasurement(patientId="b", name="flu", result="neg"))
+            writer.add(ContinuousMeasurement(patientId="a", name="crp", result=7.0))
+            writer.add(ContinuousMeasurement(patientId="b", name="crp", result="not a number"))
+        self.assertDictEqual(writer.totals(), dict(inserted=3, duplicate=0, failed=1))
+        self.assertEqual(Measurement._get_collection().count_documents({}), 3)
+        refs = {doc.get("_id"): doc.get("measurements") for doc in Patient._get_collection().find()}
+        self.assertEqual(len(refs.get("a")), 2)
+        self.assertEqual(len(refs.get("b")), 1)
+        self.assertEqual(Measurement._get_collection().find_one({"_id": refs.get("b")[0]}).get("result"), "neg")
+
+    def test_measurement_documents(self):
+        records = pd.DataFrame({"patient_id": ["a", "a", "b"],
+                                "result_name": ["crp", "flu", "cells"],
+                                "result_type": ["continuous", "discrete", "complex"],
+                                "result": [5, "neg", "x y"],
+                                "result_date": ["02/04/2020", None, "03/04/2020"],
+                                "result_time": [60.0, None, None],
+                                "request_source": [None, "ward", None],
+                                "ref_range": ["[1, 10]", None, None]})
+        docs = list(Populate._measurement_documents(records))
+        self.assertListEqual([type(d).__name__ for d in docs],
+                             ["ContinuousMeasurement", "DiscreteMeasurement", "ComplexMeasurement"])
+        self.assertEqual(docs[0].result, 5.0)
+        self.assertEqual(docs[0].date.month, 4)
+        self.assertListEqual(list(docs[0].refRange), [1, 10])
+        self.assertIsNone(docs[1].date)
+        self.assertEqual(docs[1].requestSource, "ward")
+        self.assertListEqual(list(docs[2].result), ["x", "y"])
+
+    def test_event_documents(self):
+        events = pd.DataFrame({"patient_id": [1, "b"],
+                               "event_type": [" admission ", "death"],
+                               "death": [0, 1],
+                               "destination": ["ward", None],
+                               "event_date": ["02/04/2020", None],
+                               "event_time": [90.0, None]})
+        docs = list(Populate._event_documents(events))
+        self.assertEqual(docs[0].patientId, "1")
+        self.assertEqual(docs[0].eventType, "admission")
+        self.assertEqual(docs[0].eventDate.month, 4)
+        self.assertEqual(docs[0].destination, "ward")
+        self.assertEqual(docs[1].death, 1)
+        self.assertIsNone(docs[1].eventDate)
+        docs[0].validate()
+        Patient._get_collection().insert_many([{"_id": "1"}, {"_id": "b"}])
+        with ReferenceBulkWriter(Event, config=self.config, owner=Patient, field="outcomeEvents") as writer:
+            for doc in docs:
+                writer.add(doc)
+        self.assertDictEqual(writer.totals(), dict(inserted=1, duplicate=0, failed=1))
+        self.assertEqual(len(Patient._get_collection().find_one({"_id": "1"}).get("outcomeEvents")), 1)
+
+    def test_missing_patients(self):
+        Patient._get_collection().insert_many([{"_id": "a"}, {"_id": "b"}])
+        populate = Populate.__new__(Populate)
+        populate._config = self.config
+        self.config.set_db_type("nosql")
+        missing = Populate._missing_patients(populate, ["a", "c", "b", "c", None, "d"], batch_size=2)
+        self.assertListEqual(missing, ["c", "d"])
+
+
+class TestIndexes(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("mongoenginetest", host="mongodb://localhost", alias="core", mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect(alias="core")
+
+    def setUp(self):
+        self.config = GlobalConfig()
+        self.config.set_log_path(os.path.join(tempfile.gettempdir(), "test_index_log.txt"))
+        for document in [Event, Measurement, Comorbidity]:
+            document.drop_collection()
+
+    def tearDown(self):
+        self.config.close_log()
+
+    def _keys(self, document) -> list:
+        return [info.get("key") for info in document._get_collection().index_information().values()]
+
+    def test_bulk_load(self):
+        with self.config.bulk_load():
+            deferred = self._keys(Measurement)
+            Measurement._get_collection().insert_one({"patientId": "a", "name": "crp"})
+        report = self.config.index_report()
+        self.assertNotIn([("patientId", 1), ("name", 1), ("date", 1)], deferred)
+        self.assertIn([("patientId", 1), ("name", 1), ("date", 1)], self._keys(Measurement))
+        self.assertIn([("comorbidName", 1)], self._keys(Comorbidity))
+        measurement_indexes = [x for x in report if x.get("collection") == "testResults"]
+        self.assertEqual(len(measurement_indexes), 3)
+        self.assertListEqual(sorted(x.get("keys") for x in measurement_indexes)[0], [("_id", 1)])
+
+    def test_bulk_load_error(self):
+        with self.assertWarns(UserWarning):
+            with self.assertRaises(RuntimeError):
+                with self.config.bulk_load():
+                    raise RuntimeError("Interrupted")
+        self.assertNotIn([("patientId", 1), ("name", 1), ("date", 1)], self._keys(Measurement))
+        self.config.create_indexes()
+        self.assertIn([("patientId", 1), ("name", 1), ("date", 1)], self._keys(Measurement))
+
+    def test_bulk_load_index_error(self):
+        with mock.patch("ProjectBevan.nosql.indexes.create_indexes", side_effect=RuntimeError("Index build")):
+            with self.assertWarnsRegex(UserWarning, "Building indexes failed"):
+                with self.assertRaises(RuntimeError):
+                    with self.config.bulk_load():
+                        Measurement._get_collection().insert_one({"patientId": "b", "name": "crp"})
+        self.assertEqual(Measurement._get_collection().count_documents({"patientId": "b"}), 1)
+        self.config.create_indexes()
+        self.assertIn([("patientId", 1), ("name", 1), ("date", 1)], self._keys(Measurement))
+
+
+class TestPatientReferences(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("mongoenginetest", host="mongodb://localhost", alias="core", mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect(alias="core")
+
+    def setUp(self):
+        self.config = GlobalConfig()
+        self.config.set_log_path(os.path.join(tempfile.gettempdir(), "test_references_log.txt"))
+        for document in [Patient, Event, Measurement, Comorbidity]:
+            document.drop_collection()
+
+    def tearDown(self):
+        self.config.close_log()
+
+    def test_atomic_references(self):
+        patient = Patient(config=self.config, patientId="a", age=40).save()
+        # Changes to the patient object are not written by adding references
+        patient.age = 41
+        patient.add_new_event(event_type="admission", event_datetime="01/04/2020 10:00")
+        patient.add_new_measurement(result=5.0, result_type="continuous", name="crp")
+        patient.add_new_measurement(result=7.0, result_type="continuous", name="crp")
+        patient.add_new_comorbidity("asthma")
+        patient.add_new_comorbidity("asthma")
+        doc = Patient._get_collection().find_one({"_id": "a"})
+        self.assertEqual(doc.get("age"), 40)
+        self.assertEqual(len(doc.get("outcomeEvents")), 1)
+        self.assertEqual(len(doc.get("measurements")), 2)
+        self.assertEqual(len(doc.get("comorbidities")), 1)
+        self.assertEqual(Comorbidity._get_collection().count_documents({}), 1)
+
+    def test_comorbidity_index(self):
+        Comorbidity(comorbidName="asthma").save()
+        patient = Patient(config=self.config, patientId="a").save()
+        index = comorbidity_index()
+        for name in ["asthma", "diabetes", "diabetis", "copd"]:
+            patient.add_new_comorbidity(name, conflicts="merge")
+        # The index is reused and updated as comorbidities are created
+        self.assertIs(comorbidity_index(), index)
+        self.assertSetEqual(set(comorbidity_index()), {"asthma", "diabetes", "copd"})
+        self.assertEqual(len(Patient._get_collection().find_one({"_id": "a"}).get("comorbidities")), 3)
+        Comorbidity(comorbidName="obesity").save()
+        self.assertIn("obesity", comorbidity_index())
+        Comorbidity.drop_collection()
+        self.assertEqual(len(comorbidity_index()), 0)
+
+    def test_unsaved_patient(self):
+        patient = Patient(config=self.config, patientId="b")
+        patient.add_new_measurement(result="neg", result_type="discrete", name="flu")
+        self.assertEqual(len(Patient._get_collection().find_one({"_id": "b"}).get("measurements")), 1)
+
+    def test_parent_referencing(self):
+        self.config.set_store_references(False)
+        patient = Patient(config=self.config, patientId="c").save()
+        patient.add_new_measurement(result=5.0, result_type="continuous", name="crp")
+        patient.add_new_event(event_type="admission", event_datetime="01/04/2020")
+        self.assertEqual(Patient._get_collection().find_one({"_id": "c"}).get("measurements", []), [])
+        self.assertEqual(Measurement._get_collection().count_documents({"patientId": "c"}), 1)
+        patient.delete()
+        self.assertEqual(Measurement._get_collection().count_documents({}), 0)
+        self.assertEqual(Event._get_collection().count_documents({}), 0)
+
+    def test_get_measurement_by_type(self):
+        self.config.set_store_references(False)
+        patient = Patient(config=self.config, patientId="d").save()
+        patient.add_new_measurement(result=5.0, result_type="continuous", name="crp", result_datetime="01/04/2020")
+        patient.add_new_measurement(result=7.0, result_type="continuous", name="crp", result_datetime="05/04/2020")
+        patient.add_new_measurement(result=12.0, result_type="continuous", name="hb", result_datetime="05/04/2020")
+        patient.add_new_measurement(result="neg", result_type="discrete", name="flu", result_datetime="05/04/2020")
+        Patient(config=self.config, patientId="e").add_new_measurement(result=1.0, result_type="continuous",
+                                                                       name="crp")
+        continuous = patient.get_measurement_by_type("continuous")
+        self.assertEqual(continuous.count(), 3)
+        self.assertTrue(all(isinstance(x, ContinuousMeasurement) for x in continuous))
+        crp = patient.get_measurement_by_type("continuous", name="crp", start_date="02/04/2020", fields=["result"])
+        self.assertListEqual([x.result for x in crp], [7.0])
+        df = patient.get_measurement_by_type("continuous", name=["crp", "hb"], end_date="05/04/2020",
+                                             fields=["name", "result"], as_dataframe=True)
+        self.assertListEqual(list(df.columns), ["_id", "name", "result"])
+        self.assertListEqual(sorted(df.result.tolist()), [5.0, 7.0, 12.0])
+        self.assertEqual(patient.get_measurement_by_type("discrete", as_dataframe=True).shape[0], 1)
+        with self.assertRaises(ValueError):
+            patient.get_measurement_by_type("other")
+
+
+class TestDeletePatients(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("mongoenginetest", host="mongodb://localhost", alias="core", mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect(alias="core")
+
+    def test_delete_patients(self):
+        config = GlobalConfig()
+        config.set_log_path(os.path.join(tempfile.gettempdir(), "test_delete_log.txt"))
+        for document in [Patient, Event, Measurement]:
+            document.drop_collection()
+        for pt_id in "abc":
+            patient = Patient(config=config, patientId=pt_id).save()
+            patient.add_new_measurement(result=1.0, result_type="continuous", name="crp")
+            patient.add_new_event(event_type="admission", event_datetime="01/04/2020")
+        deleted = config.delete_patients(["a", "b"], batch_size=1)
+        config.close_log()
+        self.assertEqual(deleted.get("patients"), 2)
+        self.assertEqual(deleted.get("testResults"), 2)
+        self.assertEqual(deleted.get("outcomes"), 2)
+        self.assertListEqual(Measurement._get_collection().distinct("patientId"), ["c"])
+        self.assertListEqual([x.get("_id") for x in Patient._get_collection().find()], ["c"])
@@ -0,0 +1,31 @@
+from ProjectBevan.patient_index import PatientIndexStore
+import numpy as np
+import tempfile
+import unittest
+import os
+
+
+class TestPatientIndexStore(unittest.TestCase):
+
+    def test_invalidation(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "file.csv")
+            with open(path, "w") as f:
+                f.write("PATIENT_ID\na\nb\na\n")
+            store = PatientIndexStore(os.path.join(tmp, "index"))
+            self.assertIsNone(store.load("file.csv", path, "PATIENT_ID"))
+            store.save("file.csv", path, "PATIENT_ID", np.array(["a", "b"]), np.array([0, 2, 3]), np.array([0, 2, 1]))
+            pt_ids, offsets, positions = PatientIndexStore(os.path.join(tmp, "index")).load("file.csv", path,
+                                                                                            "PATIENT_ID")
+            self.assertListEqual(pt_ids.tolist(), ["a", "b"])
+            self.assertListEqual(list(positions), [0, 2, 1])
+            # Different identifier column
+            self.assertIsNone(store.load("file.csv", path, "OTHER_ID"))
+            # Modification time changed but contents are the same
+            os.utime(path, ns=(0, 0))
+            self.assertIsNotNone(store.load("file.csv", path, "PATIENT_ID"))
+            # Contents changed
+            with open(path, "w") as f:
+                f.write("PATIENT_ID\na\nc\na\n")
+            os.utime(path, ns=(10 ** 9, 10 ** 9))
+            self.assertIsNone(store.load("file.csv", path, "PATIENT_ID"))
@@ -0,0 +1,509 @@
+from ProjectBevan.populate_from_tabular import Populate, _index_patient_rows
+from ProjectBevan.config import GlobalConfig
+from ProjectBevan.sql.schema import create_database
+from ProjectBevan.sql.bulk import bulk_insert
+from ProjectBevan.nosql.patient import Patient
+from ProjectBevan.nosql.event import Event
+from ProjectBevan.nosql.bulk import BulkWriter
+from ProjectBevan.checkpoint import NOSQL_COLLECTION
+from ProjectBevan.tests.utilities import write_example_files, sql_config
+from mongoengine import connect, disconnect
+import pandas as pd
+import mongomock
+import numpy as np
+from unittest import mock
+import tempfile
+import unittest
+import os
+
+
+class TestPatientIndex(unittest.TestCase):
+
+    def test_index_patient_rows(self):
+        pt_ids = pd.Series([3, 1, 3, 2, 1, 3, np.nan, 2])
+        uniques, offsets, positions = _index_patient_rows(pt_ids)
+        result = {pt: list(positions[offsets[i]:offsets[i + 1]]) for i, pt in enumerate(uniques)}
+        # Equivalent to the per-ID boolean scan, minus missing identifiers
+        expected = {str(_id): list(pt_ids[pt_ids == _id].index) for _id in pt_ids.dropna()}
+        self.assertDictEqual(result, expected)
+
+    def test_patient_indexes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            populate = Populate(config=GlobalConfig(),
+                                target_directory=write_example_files(tmp),
+                                id_column="PATIENT_ID",
+                                verbose=False)
+            patients = {pt: {f: list(idx) for f, idx in files.items()}
+                        for pt, files in populate._patients.items()}
+        self.assertDictEqual(patients, {"a": {"admissions.csv": [0, 2, 5], "outcome.csv": [1]},
+                                        "b": {"admissions.csv": [1, 4]},
+                                        "c": {"admissions.csv": [3], "outcome.csv": [0, 2]}})
+
+    def test_load_pt_dataframe_cached(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            populate = Populate(config=GlobalConfig(),
+                                target_directory=write_example_files(tmp),
+                                id_column="PATIENT_ID",
+                                verbose=False)
+            for pt in ["a", "b", "c"]:
+                frames = dict(populate._load_pt_dataframe(pt))
+                self.assertTrue(all((df.PATIENT_ID == pt).all() for df in frames.values()))
+        self.assertEqual(populate.cache_info().get("misses"), 2)
+        self.assertEqual(populate.cache_info().get("hits"), 3)
+
+    def test_projection(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            populate = Populate(config=GlobalConfig(),
+                                target_directory=write_example_files(tmp),
+                                id_column="PATIENT_ID",
+                                verbose=False)
+            populate._column_roles.set_role("age", ["^age$"])
+            frames = dict(populate._load_pt_dataframe("a", role="age"))
+            projected = populate.parse_info()
+            self.assertListEqual(list(frames.keys()), ["admissions.csv"])
+            self.assertListEqual(list(frames.get("admissions.csv").columns), ["PATIENT_ID", "AGE"])
+            self.assertEqual(populate._pt_search("c", "age"), 71)
+            self.assertDictEqual(populate.parse_info(), projected)
+            for name in populate._files.keys():
+                populate._load_file(name)
+            full = populate.parse_info()
+        self.assertEqual(projected.get("columns"), 2)
+        self.assertEqual(full.get("columns") - projected.get("columns"), 7)
+        self.assertLess(projected.get("bytes"), full.get("bytes") - projected.get("bytes"))
+
+    def test_persisted_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            target = write_example_files(tmp)
+            first = Populate(config=GlobalConfig(), target_directory=target, id_column="PATIENT_ID", verbose=False)
+            self.assertTrue(os.path.isfile(os.path.join(tmp, "extracts.bevan", "patient_index", "manifest.json")))
+            second = Populate(config=GlobalConfig(), target_directory=target, id_column="PATIENT_ID", verbose=False)
+            for pt, files in first._patients.items():
+                for filename, idx in files.items():
+                    self.assertListEqual(list(idx), list(second._patients[pt][filename]))
+
+
+class TestPatientBasics(unittest.TestCase):
+
+    @staticmethod
+    def _basics(populate: Populate, batch: bool) -> dict:
+        options = dict(search_terms=dict(age_search_terms=["^age$"],
+                                         gender_search_terms=["^gender$"],
+                                         covid_search_terms=["covid"],
+                                         covid_status_search_terms={"positive": ["^positive$"],
+                                                                    "negative": ["^neg$"]}),
+                       death_options=dict(death_file="outcome", death_column="destination", search_terms=["died"]),
+                       gender_int_mappings={0: "M", 1: "F"},
+                       critical_care_options=dict(critical_care_file="outcome",
+                                                  critical_care_presence_infers_positivity=False,
+                                                  critical_care_column="CRITICAL_CARE",
+                                                  critical_care_pos_value="Y"))
+        if batch:
+            return populate._fetch_cohort_basics(**options)
+        return {pt: populate._fetch_patient_basics(patient_id=pt, **options) for pt in populate._patients.keys()}
+
+    def test_batch_matches_per_patient(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            populate = Populate(config=GlobalConfig(),
+                                target_directory=write_example_files(tmp),
+                                id_column="PATIENT_ID",
+                                verbose=False,
+                                persist_index=False)
+            batch = self._basics(populate, batch=True)
+            self.assertDictEqual(batch, self._basics(populate, batch=False))
+        self.assertDictEqual(batch.get("a"), dict(age=50, gender="M", covid="P", died=0, criticalCareStay=1))
+        self.assertDictEqual(batch.get("b"), dict(age=32, gender="F", covid="N", died=0, criticalCareStay=0))
+        self.assertDictEqual(batch.get("c"), dict(age=71, gender="F", covid="U", died=1, criticalCareStay=0))
+
+    def test_roles_resolved_once_per_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            populate = Populate(config=GlobalConfig(),
+                                target_directory=write_example_files(tmp),
+                                id_column="PATIENT_ID",
+                                verbose=False,
+                                persist_index=False)
+            with mock.patch.object(populate._column_roles, "resolve", wraps=populate._column_roles.resolve) as resolve:
+                self._basics(populate, batch=False)
+        # Search terms are registered once, then each file header is resolved once
+        self.assertEqual(resolve.call_count, len(populate._files))
+
+    def test_batch_conflicts(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            target = write_example_files(tmp)
+            pd.DataFrame({"PATIENT_ID": ["a", "b", "b"],
+                          "AGE": [51, 32, 33]}).to_csv(os.path.join(target, "conflicts.csv"), index=False)
+            config = GlobalConfig()
+            config.set_log_path(os.path.join(tmp, "log.txt"))
+            populate = Populate(config=config,
+                                target_directory=target,
+                                id_column="PATIENT_ID",
+                                verbose=False,
+                                persist_index=False)
+            for batch in [True, False]:
+                populate.conflicts = "raise"
+                with self.assertRaises(ValueError):
+                    self._basics(populate, batch=batch)
+            populate.conflicts = "ignore"
+            batch = self._basics(populate, batch=True)
+            self.assertDictEqual(batch, self._basics(populate, batch=False))
+            config.close_log()
+        self.assertIsNone(batch.get("a").get("age"))
+        self.assertEqual(batch.get("b").get("age"), 32)
+
+    def test_add_patients_sql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = sql_config(tmp)
+            populate = Populate(config=config,
+                                target_directory=write_example_files(tmp),
+                                id_column="PATIENT_ID",
+                                verbose=False)
+            populate.add_patients(death_search_terms=["died"], batch_size=2)
+            patients = config.db_connection.execute("SELECT * FROM Patients ORDER BY patient_id").fetchall()
+            config.close()
+            config.close_log()
+        self.assertListEqual(patients, [("a", 50, "M", "P", 0, 1),
+                                        ("b", 32, "F", "N", 0, 0),
+                                        ("c", 71, "F", "U", 1, 0)])
+
+
+class TestAgeCorrection(unittest.TestCase):
+
+    def test_age_correction(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_example_files(tmp)
+            pd.DataFrame({"PATIENT_ID": ["a", "c", np.nan],
+                          "age": [52, 70, 20]}).to_csv(os.path.join(path, "other.csv"), index=False)
+            populate = Populate(config=GlobalConfig(), target_directory=path, id_column="PATIENT_ID", verbose=False)
+
+            def correction(ages: list):
+                return max(ages)
+
+            with self.assertRaises(AssertionError):
+                populate.age_correction(correction=correction, new_path=os.path.join(tmp, "corrected"))
+            pd.DataFrame({"PATIENT_ID": ["a", "c"], "age": [52, 70]}).to_csv(os.path.join(path, "other.csv"),
+                                                                            index=False)
+            populate.age_correction(correction=correction, new_path=os.path.join(tmp, "corrected"), chunksize=2)
+            corrected = sorted(os.listdir(os.path.join(tmp, "corrected")))
+            admissions = pd.read_csv(os.path.join(tmp, "corrected", "admissions.csv"))
+            other = pd.read_csv(os.path.join(tmp, "corrected", "other.csv"))
+            populate.age_correction(correction=correction)
+            in_place = pd.read_csv(os.path.join(path, "admissions.csv"))
+        self.assertListEqual(corrected, ["admissions.csv", "other.csv"])
+        self.assertListEqual(list(admissions.columns), ["PATIENT_ID", "AGE", "GENDER", "COVID_STATUS"])
+        self.assertListEqual(admissions.AGE.tolist(), [52, 32, 52, 71, 32, 52])
+        self.assertListEqual(other.age.tolist(), [52, 71])
+        pd.testing.assert_frame_equal(in_place, admissions)
+
+
+class TestPatientsAdded(unittest.TestCase):
+
+    def test_missing_patients_sql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = sql_config(tmp)
+            populate = Populate(config=config,
+                                target_directory=write_example_files(tmp),
+                                id_column="PATIENT_ID",
+                                verbose=False)
+            populate.add_patients(death_search_terms=["died"])
+            populate._assert_patients_added(["a", "b", "a", np.nan, "c"])
+            missing = populate._missing_patients(["patient_10", "a", "z", "patient_10"])
+            with self.assertRaises(AssertionError) as cm:
+                populate._assert_patients_added(["z", "a", "patient_10"])
+            config.close()
+            config.close_log()
+        self.assertListEqual(missing, ["patient_10", "z"])
+        self.assertIn("['patient_10', 'z']", str(cm.exception))
+
+
+class TestComorbidities(unittest.TestCase):
+
+    def test_add_comorbidities_sql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_example_files(tmp)
+            pd.DataFrame({"PATIENT_ID": ["a", "b", "c"],
+                          "diabetes": [1, 0, 0],
+                          "asthma": [0, 1, 0]}).to_csv(os.path.join(path, "comorbid_1.csv"), index=False)
+            pd.DataFrame({"PATIENT_ID": ["c"],
+                          "diabetis": [1],
+                          "asthmatic": [0]}).to_csv(os.path.join(path, "comorbid_2.csv"), index=False)
+            config = sql_config(tmp)
+            populate = Populate(config=config, target_directory=path, id_column="PATIENT_ID", verbose=False)
+            populate.add_patients(death_search_terms=["died"])
+            populate.add_comorbidities(filename="comorbid_1")
+            with self.assertRaises(ValueError):
+                populate.add_comorbidities(filename="comorbid_2", conflicts="raise", edit_threshold=1)
+            populate.add_comorbidities(filename="comorbid_2", conflicts="merge", edit_threshold=1)
+            keys = config.db_connection.execute("SELECT comorb_name FROM ComorbKey ORDER BY comorb_name").fetchall()
+            comorbs = config.db_connection.execute("SELECT patient_id, comorb_name FROM Comorbidities "
+                                                   "ORDER BY patient_id, comorb_name").fetchall()
+            config.close()
+            config.close_log()
+        self.assertListEqual(keys, [("asthma",), ("diabetes",)])
+        self.assertListEqual(comorbs, [("a", "diabetes"), ("b", "asthma"), ("c", "diabetes")])
+
+
+class TestIncrementalIngestion(unittest.TestCase):
+
+    def test_incremental_sql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_example_files(tmp)
+            pd.DataFrame({"PATIENT_ID": ["a", "b"],
+                          "EVENT_DATE": ["01/04/2020", "02/04/2020"],
+                          "EVENT_TYPE": ["admission", "admission"]}).to_csv(os.path.join(path, "events.csv"),
+                                                                            index=False)
+            config = sql_config(tmp)
+
+            def run():
+                populate = Populate(config=config, target_directory=path, id_column="PATIENT_ID", verbose=False)
+                files = populate.parse_info().get("files")
+                populate.add_patients(death_search_terms=["died"], incremental=True)
+                populate.add_events(event_datetime="EVENT_DATE",
+                                    filename="events",
+                                    mappings={"event_type": "EVENT_TYPE"},
+                                    chunksize=1,
+                                    incremental=True)
+                return populate.parse_info().get("files") - files
+
+            run()
+            # Nothing has changed, no file is read
+            self.assertEqual(run(), 0)
+            pd.DataFrame({"PATIENT_ID": ["d", "d"],
+                          "AGE": [40, 40],
+                          "GENDER": ["F", "F"],
+                          "COVID_STATUS": ["neg", "neg"]}).to_csv(os.path.join(path, "admissions.csv"), mode="a",
+                                                                  header=False, index=False)
+            # A repeat of a row already ingested is a new event
+            pd.DataFrame({"PATIENT_ID": ["d", "a"],
+                          "EVENT_DATE": ["05/04/2020", "01/04/2020"],
+                          "EVENT_TYPE": ["admission", "admission"]}).to_csv(os.path.join(path, "events.csv"),
+                                                                            mode="a", header=False, index=False)
+            run()
+            patients = config.db_connection.execute("SELECT * FROM Patients ORDER BY patient_id").fetchall()
+            events = config.db_connection.execute("SELECT patient_id FROM Events ORDER BY patient_id").fetchall()
+            config.close()
+            # The manifest is kept in the destination database, a new database is populated in full
+            create_database(os.path.join(tmp, "other.db"))
+            config.connect(os.path.join(tmp, "other.db"))
+            run()
+            other = config.db_connection.execute("SELECT * FROM Patients ORDER BY patient_id").fetchall()
+            config.close()
+            config.close_log()
+        self.assertListEqual(other, patients)
+        self.assertListEqual(patients, [("a", 50, "M", "P", 0, 1),
+                                        ("b", 32, "F", "N", 0, 0),
+                                        ("c", 71, "F", "U", 1, 0),
+                                        ("d", 40, "F", "N", 0, 0)])
+        self.assertListEqual(events, [("a",), ("a",), ("b",), ("d",)])
+
+
+class TestChunkedIngestion(unittest.TestCase):
+
+    def test_iter_chunks(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            populate = Populate(config=GlobalConfig(),
+                                target_directory=write_example_files(tmp),
+                                id_column="PATIENT_ID",
+                                verbose=False)
+            whole = list(populate._iter_chunks("admissions"))
+            chunks = list(populate._iter_chunks("admissions", chunksize=4))
+        self.assertEqual(len(whole), 1)
+        self.assertListEqual([c.shape[0] for c in chunks], [4, 2])
+        pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), whole[0])
+
+    def test_add_events_sql_chunked(self):
+        results = list()
+        for chunksize in [None, 1]:
+            with tempfile.TemporaryDirectory() as tmp:
+                path = write_example_files(tmp)
+                pd.DataFrame({"PATIENT_ID": ["a", "b", "c"],
+                              "EVENT_DATE": ["01/04/2020", "02/04/2020", "03/04/2020"],
+                              "EVENT_TYPE": ["admission", "admission", "death"]}).to_csv(
+                    os.path.join(path, "events.csv"), index=False)
+                config = sql_config(tmp)
+                populate = Populate(config=config, target_directory=path, id_column="PATIENT_ID", verbose=False)
+                populate.add_patients(death_search_terms=["died"])
+                populate.add_events(event_datetime="EVENT_DATE",
+                                    filename="events",
+                                    mappings={"event_type": "EVENT_TYPE"},
+                                    chunksize=chunksize)
+                results.append(config.db_connection.execute("SELECT patient_id, event_type, event_date "
+                                                            "FROM Events ORDER BY patient_id").fetchall())
+                config.close()
+                config.close_log()
+        self.assertEqual(len(results[0]), 3)
+        # SQL dates are written as ISO 8601 strings
+        self.assertListEqual([x[2] for x in results[0]], ["2020-04-01", "2020-04-02", "2020-04-03"])
+        self.assertListEqual(results[0], results[1])
+
+    def test_add_events_datetime_columns(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_example_files(tmp)
+            pd.DataFrame({"PATIENT_ID": ["a", "b", "c"],
+                          "D": ["01/04/2020", "02/04/2020", "not a date"],
+                          "T": ["10:00", "11:30", "12:00"],
+                          "EVENT_TYPE": ["admission", "admission", "admission"]}).to_csv(os.path.join(path, "events.csv"),
+                                                                            index=False)
+            config = sql_config(tmp)
+            populate = Populate(config=config, target_directory=path, id_column="PATIENT_ID", verbose=False)
+            populate.add_patients(death_search_terms=["died"])
+            populate.add_events(event_datetime=["D", "T"], filename="events", mappings={"event_type": "EVENT_TYPE"})
+            cached = populate._load_file("events.csv")
+            times = config.db_connection.execute("SELECT event_time FROM Events ORDER BY patient_id").fetchall()
+            config.close()
+            config.close_log()
+        # The cached target file is not modified by writers, and the event without a valid date is skipped
+        self.assertListEqual(list(cached.columns), ["PATIENT_ID", "D", "T", "EVENT_TYPE"])
+        self.assertListEqual(times, [(600,), (690,)])
+
+
+class TestCheckpointResume(unittest.TestCase):
+
+    def test_resume_patients_sql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_example_files(tmp)
+            config = sql_config(tmp)
+            populate = Populate(config=config, target_directory=path, id_column="PATIENT_ID", verbose=False)
+            calls = list()
+
+            def fail_second_batch(*args, **kwargs):
+                calls.append(kwargs.get("rows"))
+                if len(calls) == 2:
+                    raise RuntimeError("Interrupted")
+                return bulk_insert(*args, **kwargs)
+
+            with mock.patch("ProjectBevan.populate_from_tabular.bulk_insert", side_effect=fail_second_batch):
+                with self.assertRaises(RuntimeError):
+                    populate.add_patients(death_search_terms=["died"], batch_size=1)
+            written = config.db_connection.execute("SELECT patient_id FROM Patients").fetchall()
+            # Patient "a" is not written again, which would raise an IntegrityError, nor are its basics computed
+            with mock.patch.object(populate, "_fetch_cohort_basics", wraps=populate._fetch_cohort_basics) as basics:
+                populate.add_patients(death_search_terms=["died"], batch_size=1, resume=True)
+                populate.add_patients(death_search_terms=["died"], batch_size=1, resume=True)
+            patients = config.db_connection.execute("SELECT patient_id FROM Patients ORDER BY patient_id").fetchall()
+            config.close()
+            config.close_log()
+        self.assertListEqual(written, [("a",)])
+        self.assertListEqual(patients, [("a",), ("b",), ("c",)])
+        self.assertEqual(basics.call_count, 1)
+        self.assertSetEqual(basics.call_args.kwargs.get("patient_ids"), {"b", "c"})
+
+    def test_resume_events_sql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_example_files(tmp)
+            pd.DataFrame({"PATIENT_ID": ["a", "b", "c"],
+                          "EVENT_DATE": ["01/04/2020", "02/04/2020", "03/04/2020"],
+                          "EVENT_TYPE": ["admission", "admission", "death"]}).to_csv(
+                os.path.join(path, "events.csv"), index=False)
+            config = sql_config(tmp)
+            populate = Populate(config=config, target_directory=path, id_column="PATIENT_ID", verbose=False)
+            populate.add_patients(death_search_terms=["died"])
+            write_events = populate._write_events
+            calls = list()
+
+            def fail_second_chunk(events, **kwargs):
+                calls.append(events)
+                write_events(events, **kwargs)
+                if len(calls) == 2:
+                    raise RuntimeError("Interrupted")
+
+            kwargs = dict(event_datetime="EVENT_DATE",
+                          filename="events",
+                          mappings={"event_type": "EVENT_TYPE"},
+                          chunksize=1)
+            with mock.patch.object(populate, "_write_events", side_effect=fail_second_chunk):
+                with self.assertRaises(RuntimeError):
+                    populate.add_events(**kwargs)
+            # The second chunk was rolled back with its checkpoint
+            written = config.db_connection.execute("SELECT patient_id FROM Events").fetchall()
+            resumed = list()
+            with mock.patch.object(populate, "_write_events",
+                                   side_effect=lambda events, **kw: resumed.append(events) or write_events(events, **kw)):
+                populate.add_events(resume=True, **kwargs)
+            events = config.db_connection.execute("SELECT patient_id FROM Events ORDER BY patient_id").fetchall()
+            config.close()
+            config.close_log()
+        self.assertListEqual(written, [("a",)])
+        self.assertListEqual([x.PATIENT_ID.tolist() for x in resumed], [["b"], ["c"]])
+        self.assertListEqual(events, [("a",), ("b",), ("c",)])
+
+
+class TestCheckpointResumeNoSQL(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        connect("mongoenginetest", host="mongodb://localhost", alias="core", mongo_client_class=mongomock.MongoClient)
+
+    @classmethod
+    def tearDownClass(cls):
+        disconnect(alias="core")
+
+    def setUp(self):
+        for document in [Patient, Event]:
+            document.drop_collection()
+        Patient._get_db().drop_collection(NOSQL_COLLECTION)
+
+    def test_resume_patients_nosql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = GlobalConfig()
+            config.set_log_path(os.path.join(tmp, "log.txt"))
+            populate = Populate(config=config, target_directory=write_example_files(tmp), id_column="PATIENT_ID",
+                                verbose=False)
+            flush = BulkWriter.flush
+            calls = list()
+
+            def fail_second_batch(writer):
+                if len(writer._batch) > 0:
+                    calls.append(writer)
+                if len(calls) == 2:
+                    raise RuntimeError("Interrupted")
+                return flush(writer)
+
+            with mock.patch.object(BulkWriter, "flush", autospec=True, side_effect=fail_second_batch):
+                with self.assertRaises(RuntimeError):
+                    populate.add_patients(death_search_terms=["died"], batch_size=1)
+            written = Patient._get_collection().distinct("_id")
+            report = populate.add_patients(death_search_terms=["died"], batch_size=1, resume=True)
+            patients = sorted(Patient._get_collection().distinct("_id"))
+            config.close_log()
+        self.assertListEqual(written, ["a"])
+        # Patient "a" is not written again, which would be reported as a duplicate
+        self.assertListEqual([x.get("inserted") for x in report], [1, 1])
+        self.assertListEqual([x.get("duplicate") for x in report], [0, 0])
+        self.assertListEqual(patients, ["a", "b", "c"])
+
+    def test_resume_events_nosql(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_example_files(tmp)
+            pd.DataFrame({"PATIENT_ID": ["a", "b", "c"],
+                          "EVENT_DATE": ["01/04/2020", "02/04/2020", "03/04/2020"],
+                          "EVENT_TYPE": ["admission", "admission", "death"]}).to_csv(
+                os.path.join(path, "events.csv"), index=False)
+            config = GlobalConfig()
+            config.set_log_path(os.path.join(tmp, "log.txt"))
+            populate = Populate(config=config, target_directory=path, id_column="PATIENT_ID", verbose=False)
+            populate.add_patients(death_search_terms=["died"])
+            write_events = populate._write_events
+            calls = list()
+
+            def fail_second_chunk(events, **kwargs):
+                calls.append(events)
+                if len(calls) == 2:
+                    raise RuntimeError("Interrupted")
+                write_events(events, **kwargs)
+
+            kwargs = dict(event_datetime="EVENT_DATE",
+                          filename="events",
+                          mappings={"event_type": "EVENT_TYPE"},
+                          chunksize=1)
+            with mock.patch.object(populate, "_write_events", side_effect=fail_second_chunk):
+                with self.assertRaises(RuntimeError):
+                    populate.add_events(**kwargs)
+            written = Event._get_collection().distinct("patientId")
+            resumed = list()
+            with mock.patch.object(populate, "_write_events",
+                                   side_effect=lambda events, **kw: resumed.append(events) or write_events(events, **kw)):
+                populate.add_events(resume=True, **kwargs)
+            events = sorted(doc.get("patientId") for doc in Event._get_collection().find())
+            config.close_log()
+        self.assertListEqual(written, ["a"])
+        self.assertListEqual([x.PATIENT_ID.tolist() for x in resumed], [["b"], ["c"]])
+        self.assertListEqual(events, ["a", "b", "c"])
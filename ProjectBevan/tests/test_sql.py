@@ -0,0 +1,122 @@
+from ProjectBevan.sql.schema import create_database, create_indexes, bulk_load
+from ProjectBevan.sql.bulk import bulk_insert, bulk_insert_dataframe
+from ProjectBevan.tests.utilities import sql_config
+import pandas as pd
+import numpy as np
+import tempfile
+import unittest
+import sqlite3
+import os
+
+
+class TestBulkInsert(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        create_database(os.path.join(self.tmp.name, "test.db"))
+        self.conn = sqlite3.connect(os.path.join(self.tmp.name, "test.db"))
+
+    def tearDown(self):
+        self.conn.close()
+        self.tmp.cleanup()
+
+    def test_bulk_insert(self):
+        rows = ((f"pt{i}", np.int64(i), "M") for i in range(10))
+        n = bulk_insert(self.conn, "Patients", ["patient_id", "age", "gender"], rows, batch_size=3)
+        self.assertEqual(n, 10)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM Patients").fetchone()[0], 10)
+        self.assertEqual(self.conn.execute("SELECT age FROM Patients WHERE patient_id='pt9'").fetchone()[0], 9)
+
+    def test_bulk_insert_rollback(self):
+        rows = [("a", 1), ("b", 2), ("a", 3)]
+        with self.assertRaises(sqlite3.IntegrityError):
+            bulk_insert(self.conn, "Patients", ["patient_id", "age"], rows)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM Patients").fetchone()[0], 0)
+        n = bulk_insert(self.conn, "Patients", ["patient_id", "age"], rows, on_conflict="ignore")
+        self.assertEqual(n, 2)
+
+    def test_bulk_insert_dataframe(self):
+        df = pd.DataFrame({"patient_id": ["a", "b"], "age": [40, np.nan]})
+        bulk_insert_dataframe(self.conn, "Patients", df)
+        self.assertListEqual(self.conn.execute("SELECT patient_id, age FROM Patients").fetchall(),
+                             [("a", 40), ("b", None)])
+
+
+class TestSchema(unittest.TestCase):
+
+    @staticmethod
+    def _indexes(conn: sqlite3.Connection) -> list:
+        return [x[0] for x in conn.execute("SELECT name FROM sqlite_master WHERE type='index' "
+                                           "AND name LIKE 'idx_%' ORDER BY name")]
+
+    def test_many_rows_per_patient(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            create_database(os.path.join(tmp, "test.db"))
+            conn = sqlite3.connect(os.path.join(tmp, "test.db"))
+            bulk_insert(conn, "Measurements", ["patient_id", "result_name", "result_type", "result"],
+                        [("a", "hb", "continuous", 1), ("a", "hb", "continuous", 2), ("a", "crp", "continuous", 3)])
+            bulk_insert(conn, "Comorbidities", ["patient_id", "comorb_name"],
+                        [("a", "asthma"), ("a", "diabetes"), ("a", "asthma")], on_conflict="IGNORE")
+            measurements = conn.execute("SELECT measurement_id, result FROM Measurements").fetchall()
+            comorbs = conn.execute("SELECT COUNT(*) FROM Comorbidities").fetchone()[0]
+            plan = conn.execute("EXPLAIN QUERY PLAN SELECT * FROM Measurements "
+                                "WHERE patient_id='a' AND result_name='hb'").fetchall()
+            indexes = self._indexes(conn)
+            conn.close()
+        self.assertListEqual(measurements, [(1, "1"), (2, "2"), (3, "3")])
+        self.assertEqual(comorbs, 2)
+        self.assertIn("idx_measurements_patient_name_date", plan[0][-1])
+        self.assertEqual(len(indexes), 6)
+
+    def test_index_report(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = sql_config(tmp)
+            report = config.create_indexes()
+            config.close()
+            config.close_log()
+        index = [x for x in report if x.get("index") == "idx_measurements_patient_name_date"][0]
+        self.assertEqual(index.get("table"), "Measurements")
+        self.assertListEqual(index.get("keys"), ["patient_id", "result_name", "result_date"])
+        self.assertTrue(all(x.get("size") is None or x.get("size") > 0 for x in report))
+
+    def test_bulk_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            create_database(os.path.join(tmp, "test.db"), bulk_load=True)
+            conn = sqlite3.connect(os.path.join(tmp, "test.db"))
+            deferred = self._indexes(conn)
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            with bulk_load(conn):
+                synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+                bulk_insert(conn, "Events", ["patient_id", "event_type", "event_date"],
+                            [("a", "admission", "01/04/2020"), ("a", "death", "02/04/2020")])
+            indexes = self._indexes(conn)
+            restored = conn.execute("PRAGMA synchronous").fetchone()[0]
+            create_indexes(conn)
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM Events").fetchone()[0], 2)
+            conn.close()
+        self.assertListEqual(deferred, [])
+        self.assertEqual(journal_mode, "wal")
+        self.assertEqual(synchronous, 1)
+        self.assertEqual(restored, 2)
+        self.assertEqual(len(indexes), 6)
+
+
+class TestDeletePatients(unittest.TestCase):
+
+    def test_delete_patients(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            config = sql_config(tmp)
+            conn = config.db_connection
+            bulk_insert(conn, "Patients", ["patient_id"], [(x,) for x in "abc"])
+            bulk_insert(conn, "Measurements", ["patient_id", "result_name", "result_type", "result"],
+                        [(x, "hb", "continuous", i) for i, x in enumerate("aabbc")])
+            bulk_insert(conn, "Comorbidities", ["patient_id", "comorb_name"], [("a", "asthma"), ("c", "asthma")])
+            deleted = config.delete_patients(["a", "b", "b", None, "z"], batch_size=1)
+            remaining = {table: conn.execute(f"SELECT DISTINCT patient_id FROM {table}").fetchall()
+                         for table in ["Patients", "Measurements", "Comorbidities"]}
+            config.close()
+            config.close_log()
+        self.assertEqual(deleted.get("Patients"), 2)
+        self.assertEqual(deleted.get("Measurements"), 4)
+        self.assertEqual(deleted.get("Comorbidities"), 1)
+        self.assertDictEqual(remaining, {"Patients": [("c",)], "Measurements": [("c",)], "Comorbidities": [("c",)]})
@@ -0,0 +1,51 @@
+from ProjectBevan.staging import ParquetStagingStore, parquet_available, stage_file
+from ProjectBevan.populate_from_tabular import Populate
+from ProjectBevan.config import GlobalConfig
+from ProjectBevan.tests.utilities import write_example_files
+import pandas as pd
+import numpy as np
+import tempfile
+import unittest
+import os
+
+
+@unittest.skipUnless(parquet_available(), "pyarrow is not installed")
+class TestParquetStaging(unittest.TestCase):
+
+    def test_stage_file(self):
+        df = pd.DataFrame({"PATIENT_ID": ["c", "a", np.nan, "b", "a", "c"],
+                           "value": [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+        with tempfile.TemporaryDirectory() as tmp:
+            store = ParquetStagingStore(os.path.join(tmp, "staging"))
+            stage_file(df, destination=store.path("x.csv"), id_column="PATIENT_ID", row_group_size=2)
+            whole = store.read("x.csv")
+            patient = store.read("x.csv", columns=["value"], patient_id="a")
+            batches = list(store.iter_batches("x.csv", batch_size=4))
+        pd.testing.assert_frame_equal(whole, df)
+        self.assertListEqual(patient.index.tolist(), [1, 4])
+        self.assertListEqual(patient.columns.tolist(), ["value"])
+        self.assertListEqual([b.shape[0] for b in batches], [4, 2])
+
+    def test_populate_staging(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = write_example_files(tmp)
+            raw = Populate(config=GlobalConfig(), target_directory=path, id_column="PATIENT_ID", verbose=False,
+                           persist_index=False)
+            staged = Populate(config=GlobalConfig(), target_directory=path, id_column="PATIENT_ID", verbose=False,
+                              persist_index=False, staging=True, cache_size=0)
+            self.assertTrue(os.path.isfile(os.path.join(f"{path}.bevan", "staging", "manifest.json")))
+            for patient_id in ["a", "b", "c"]:
+                for (name, expected), (staged_name, df) in zip(raw._load_pt_dataframe(patient_id),
+                                                               staged._load_pt_dataframe(patient_id)):
+                    self.assertEqual(name, staged_name)
+                    pd.testing.assert_frame_equal(df, expected, check_dtype=False)
+            pd.testing.assert_frame_equal(staged._load_file("admissions.csv"), raw._load_file("admissions.csv"),
+                                          check_dtype=False)
+            staging_mtime = os.path.getmtime(staged._staging.path("admissions.csv"))
+            reused = Populate(config=GlobalConfig(), target_directory=path, id_column="PATIENT_ID", verbose=False,
+                              persist_index=False, staging=True)
+            self.assertEqual(os.path.getmtime(reused._staging.path("admissions.csv")), staging_mtime)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
-from utilities import parse_datetime
+from utilities import parse_datetime, parse_datetime_series, iso_date_series
+import pandas as pd
 import unittest
 
 
@@ -32,3 +33,18 @@ class TestUtilities(unittest.TestCase):
 
         self.assertEqual(t7.get("date"), "12/1/2020")
         self.assertEqual(t7.get("time"), (14 * 60)+30)
+
+    def test_parse_datetime_series(self):
+        values = ["15/03/2020", "1/30/2020", "15/3/2020 15:00:00", "15.3.2020 7:05", "12/01/2020 2:30pm",
+                  "2020-03-15", "15-03-20", None, "garbage", "31/02/2020", "15/03/2020"]
+        result = parse_datetime_series(pd.Series(values, index=range(10, 21)))
+        self.assertListEqual(list(result.index), list(range(10, 21)))
+        for value, date, time in zip(values, result["date"], result["time"]):
+            expected = parse_datetime(value) if value is not None else {"date": None, "time": None}
+            self.assertDictEqual(expected, {"date": date, "time": time})
+
+    def test_iso_date_series(self):
+        dates = parse_datetime_series(pd.Series(["1/4/2020", "15/03/2020 10:00", None, "garbage"], index=[3, 4, 5, 6]))
+        result = iso_date_series(dates["date"])
+        self.assertListEqual(list(result.index), [3, 4, 5, 6])
+        self.assertListEqual(result.tolist(), ["2020-04-01", "2020-03-15", None, None])
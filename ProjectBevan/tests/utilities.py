@@ -0,0 +1,55 @@
+from ProjectBevan.config import GlobalConfig
+from ProjectBevan.sql.schema import create_database
+import pandas as pd
+import os
+
+
+def write_example_files(tmp: str) -> str:
+    """
+    Write example target files (admissions.csv and outcome.csv for patients "a", "b" and "c") to a new "extracts"
+    directory within tmp
+
+    Parameters
+    ----------
+    tmp: str
+        Temporary directory
+
+    Returns
+    -------
+    str
+        Path of the target directory
+    """
+    path = os.path.join(tmp, "extracts")
+    os.mkdir(path)
+    pd.DataFrame({"PATIENT_ID": ["a", "b", "a", "c", "b", "a"],
+                  "AGE": [50, 32, 50, 71, 32, 50],
+                  "GENDER": ["M", "F", "M", "F", "F", "M"],
+                  "COVID_STATUS": ["Positive", "neg", "neg", "suspected", "neg", "neg"]}).to_csv(os.path.join(path, "admissions.csv"),
+                                                                     index=False)
+    pd.DataFrame({"PATIENT_ID": ["c", "a", "c"],
+                  "destination": ["home", "home", "died"],
+                  "CRITICAL_CARE": ["N", "Y", "N"]}).to_csv(os.path.join(path, "outcome.csv"), index=False)
+    return path
+
+
+def sql_config(tmp: str, **kwargs) -> GlobalConfig:
+    """
+    GlobalConfig connected to a new SQLite database (test.db) within tmp, logging to log.txt within tmp
+
+    Parameters
+    ----------
+    tmp: str
+        Temporary directory
+    kwargs:
+        Additional keyword arguments for sql.schema.create_database
+
+    Returns
+    -------
+    GlobalConfig
+    """
+    config = GlobalConfig()
+    config.set_log_path(os.path.join(tmp, "log.txt"))
+    config.set_db_type("sql")
+    create_database(os.path.join(tmp, "test.db"), **kwargs)
+    config.connect(os.path.join(tmp, "test.db"))
+    return config
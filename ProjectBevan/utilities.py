@@ -1,10 +1,25 @@
 from itertools import islice
+from functools import lru_cache
 from IPython import get_ipython
 from tqdm import tqdm
 from tqdm.notebook import tqdm as tqdm_notebook
+import pandas as pd
+import numpy as np
 import dateparser
 import re
 
+# Day-first (GB) formats parsed with vectorised strptime by parse_datetime_series, in the form
+# (regular expression, strptime format, date only?). Date dividers are normalised to "/" prior to matching.
+DATETIME_FORMATS = [(r"^\d{1,2}/\d{1,2}/\d{4}$", "%d/%m/%Y", True),
+                    (r"^\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}:\d{2}$", "%d/%m/%Y %H:%M:%S", False),
+                    (r"^\d{1,2}/\d{1,2}/\d{4} \d{1,2}:\d{2}$", "%d/%m/%Y %H:%M", False),
+                    (r"^\d{1,2}/\d{1,2}/\d{2}$", "%d/%m/%y", True),
+                    (r"^\d{1,2}/\d{1,2}/\d{2} \d{1,2}:\d{2}:\d{2}$", "%d/%m/%y %H:%M:%S", False),
+                    (r"^\d{1,2}/\d{1,2}/\d{2} \d{1,2}:\d{2}$", "%d/%m/%y %H:%M", False),
+                    (r"^\d{4}-\d{2}-\d{2}$", "%Y-%m-%d", False),
+                    (r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$", "%Y-%m-%d %H:%M:%S", False),
+                    (r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}$", "%Y-%m-%dT%H:%M:%S", False)]
+
 
 def which_environment() -> str:
     """
@@ -63,18 +78,93 @@ def parse_datetime(datetime: str) -> dict:
          {"date": None (if invalid datetime string) or string ("%day/%month/%year)
          "time": float (minutes passed for given date) or None (if no time value present in parsed string)}
     """
-    result = dict()
-    datetime = datetime.strip()
+    date, time = _parse_datetime(datetime.strip())
+    return {"date": date, "time": time}
+
+
+@lru_cache(maxsize=2 ** 16)
+def _parse_datetime(datetime: str) -> tuple:
+    """
+    Memoised implementation of parse_datetime, returns (date, time)
+    """
+    time = False
     pattern = "^[0-9]{1,2}[/.-][0-9]{1,2}[/.-]([0-9]{2}|[0-9]{4})$"
     if re.match(pattern, datetime):
-        result["time"] = None
+        time = None
     datetime = dateparser.parse(datetime, locales=["en-GB"])
     if datetime is None:
-        return {"date": None, "time": None}
-    result["date"] = f"{datetime.day}/{datetime.month}/{datetime.year}"
-    if "time" not in result.keys():
-        result["time"] = (datetime.hour * 60) + datetime.minute
-    return result
+        return None, None
+    if time is not None:
+        time = (datetime.hour * 60) + datetime.minute
+    return f"{datetime.day}/{datetime.month}/{datetime.year}", time
+
+
+def parse_datetime_series(datetimes: pd.Series) -> pd.DataFrame:
+    """
+    Vectorised equivalent of parse_datetime for a Series of datetime strings. Each distinct string is parsed once.
+    Distinct strings are matched against common day-first (GB) formats (see DATETIME_FORMATS), trying the most
+    frequent format first, and parsed with vectorised strptime. Only strings that match none of these formats are
+    passed to dateparser (via the memoised parse_datetime). Missing values give a missing date and time.
+
+    Parameters
+    ----------
+    datetimes: Pandas.Series
+        Datetime strings; non-string values are converted to strings
+
+    Returns
+    -------
+    Pandas.DataFrame
+        Same index as datetimes, with columns "date" (None or string "%day/%month/%year") and "time" (None or
+        minutes passed for given date), as returned by parse_datetime
+    """
+    missing = datetimes.isnull().values
+    codes, uniques = pd.factorize(datetimes[~missing].astype(str).str.strip().values)
+    uniques = pd.Series(uniques, dtype=object)
+    normalised = uniques.str.replace(r"^(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})\b", r"\1/\2/\3", regex=True)
+    dates = np.full(len(uniques), None, dtype=object)
+    times = np.full(len(uniques), None, dtype=object)
+    remaining = np.ones(len(uniques), dtype=bool)
+    matches = [(normalised.str.match(pattern).values, fmt, date_only) for pattern, fmt, date_only in DATETIME_FORMATS]
+    for match, fmt, date_only in sorted(matches, key=lambda x: x[0].sum(), reverse=True):
+        match = match & remaining
+        if not match.any():
+            continue
+        parsed = pd.to_datetime(normalised[match], format=fmt, errors="coerce").dropna()
+        if parsed.shape[0] == 0:
+            continue
+        idx = parsed.index.values
+        dates[idx] = (parsed.dt.day.astype(str) + "/" + parsed.dt.month.astype(str) + "/" +
+                      parsed.dt.year.astype(str)).tolist()
+        if not date_only:
+            times[idx] = (parsed.dt.hour * 60 + parsed.dt.minute).tolist()
+        remaining[idx] = False
+    for i in np.flatnonzero(remaining):
+        dates[i], times[i] = _parse_datetime(uniques[i])
+    result = {"date": np.full(len(datetimes), None, dtype=object),
+              "time": np.full(len(datetimes), None, dtype=object)}
+    result["date"][~missing] = dates[codes]
+    result["time"][~missing] = times[codes]
+    return pd.DataFrame(result, index=datetimes.index, dtype=object)
+
+
+def iso_date_series(dates: pd.Series) -> pd.Series:
+    """
+    Convert day-first date strings, as returned by parse_datetime_series ("%day/%month/%year"), to ISO 8601 date
+    strings ("%Y-%m-%d"). ISO dates sort in date order, so date ranges can be compared directly (and using an
+    index) in SQL.
+
+    Parameters
+    ----------
+    dates: Pandas.Series
+        Date strings
+
+    Returns
+    -------
+    Pandas.Series
+        Same index as dates, None for missing or invalid dates
+    """
+    parsed = pd.to_datetime(dates, format="%d/%m/%Y", errors="coerce")
+    return pd.Series(np.where(parsed.isna(), None, parsed.dt.strftime("%Y-%m-%d")), index=dates.index, dtype=object)
 
 
 def verbose_print(verbose: bool):